@@ -8,6 +8,11 @@ class AskRequest(BaseModel):
     question: str = Field(min_length=1)
 
 
+class AskBatchRequest(BaseModel):
+    document_id: str
+    questions: list[str] = Field(min_length=1, max_length=100)
+
+
 class AskResponse(BaseModel):
     answer: str
     sources: list[dict]
@@ -19,3 +24,19 @@ class AskResponse(BaseModel):
 class ExtractRequest(BaseModel):
     document_id: str
     force: bool = False
+
+
+class BulkExtractRequest(BaseModel):
+    # Explicit ids, or a filter over stored documents when omitted.
+    document_ids: list[str] | None = None
+    document_type: str | None = None
+    created_after: str | None = None
+    created_before: str | None = None
+    force: bool = False
+    concurrency: int | None = Field(default=None, ge=1, le=64)
+
+
+class SearchRequest(BaseModel):
+    question: str = Field(min_length=1)
+    top_k: int = Field(default=10, ge=1, le=100)
+    document_ids: list[str] | None = None
@@ -17,18 +17,113 @@ class Settings(BaseSettings):
     # Datalab
     datalab_api_key: str | None = None
     datalab_mode: str = "balanced"  # fast|balanced|accurate
-    datalab_output_format: str = "markdown"  # markdown|html|json
+    datalab_output_format: str = "markdown"  # not sent: ingestion always requests markdown
     datalab_paginate: bool = True
+    datalab_base_url: str = "https://www.datalab.to/api/v1"  # e.g. a local stand-in server
+    datalab_max_concurrent: int = 8  # conversions in flight (submit -> done)
+    datalab_submit_rate: float = 2.0  # submissions per second, 0 == unlimited
+    datalab_max_connections: int = 16  # pooled keep-alive connections
+    datalab_poll_initial_s: float = 0.5  # first status check; grows x1.5 with jitter
+    datalab_poll_max_s: float = 5.0
+    datalab_timeout_s: float = 300.0  # whole conversion
+    datalab_request_timeout_s: float = 60.0  # single HTTP request
+
+    # Converted Datalab output, keyed by sha256(file) + conversion settings
+    datalab_cache_enabled: bool = True
+    datalab_cache_dir: str | None = None  # default: <storage_dir>/cache/datalab
+    datalab_cache_max_bytes: int = 512 * 1024 * 1024
+
+    # PyMuPDF fallback (no Datalab key): page ranges extracted in a process pool
+    pdf_extract_workers: int = 0  # 0 == min(cpu count, 8)
+    pdf_pages_per_shard: int = 25
+    pdf_parallel_min_pages: int = 50  # shorter PDFs are read in a single thread
 
     # OpenAI
     openai_api_key: str | None = None
     openai_model: str = "gpt-4o-mini"
     openai_embedding_model: str = "text-embedding-3-small"
+    openai_embedding_dimensions: int | None = None  # None == model default
+    openai_base_url: str | None = None  # e.g. a local fake server for benchmarks
+    chat_backend: str = "openai"  # answering model backend (see app/services/llm.py)
+
+    # Embedding backend: openai | hashing (offline, deterministic) | auto (openai if key set)
+    embedding_backend: str = "openai"
+    hashing_embedding_dim: int = 1024
+    hashing_min_similarity: float = 0.12
+
+    # Embedding request batching (token estimate is ~3 chars/token)
+    embedding_batch_max_tokens: int = 100_000
+    embedding_batch_max_inputs: int = 512
+    embedding_concurrency: int = 4
+    embedding_max_retries: int = 5
 
     storage_dir: str = get_default_storage_dir()
 
     min_similarity: float = 0.35
     top_k: int = 6
+    ask_batch_concurrency: int = 8  # concurrent LLM calls per /ask/batch request
+    extract_bulk_concurrency: int = 8  # documents extracted at once by /extract/bulk
+    extract_group_top_k: int = 3  # chunks retrieved per field group
+    # Packed extraction context budget (~3 chars/token): room for the top chunk of each of the
+    # six field groups at CHUNK_MAX_CHARS=2400 (~810 tokens with header), plus one more.
+    extract_context_max_tokens: int = 6000
+    answer_context_max_tokens: int = 3000  # packed /ask context budget
+    context_mmr_lambda: float = 0.7  # 1.0 = pure relevance, lower favours diverse chunks
+
+    # Chunking (changing these needs POST /documents/{id}/reindex for stored documents)
+    chunk_max_chars: int = 2400
+    chunk_overlap_chars: int = 250
+
+    # In-process cache of loaded FAISS indexes + chunk metadata (bytes, LRU)
+    index_cache_max_bytes: int = 512 * 1024 * 1024
+
+    # Background ingestion jobs (in-process worker pool)
+    ingest_workers: int = 4
+    ingest_queue_max: int = 100
+    ingest_extract_concurrency: int = 4
+    ingest_chunk_concurrency: int = 2
+    ingest_embed_concurrency: int = 2
+    ingest_index_concurrency: int = 2
+    ingest_embed_batch_chunks: int = 256  # chunks embedded + appended per step (bounds ingest memory)
+    job_retention: int = 1000  # finished jobs kept for status polling
+    upload_dedupe: bool = True  # identical content (sha256) reuses the stored document
+    upload_tmp_max_age_s: int = 3600  # leftover upload temp files older than this are removed
+
+    # Per-document index type: auto | flat | hnsw | ivf_flat | ivf_pq
+    index_type: str = "auto"
+    ann_min_vectors: int = 10_000  # auto: below this, exact flat search
+    index_memory_budget_bytes: int = 256 * 1024 * 1024  # auto: per-document index budget
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 80
+    hnsw_ef_search: int = 64
+    ivf_nprobe: int = 16
+
+    # Hybrid retrieval: BM25 + dense fusion (weighted | rrf)
+    hybrid_fusion: str = "weighted"
+    rrf_k: int = 60
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+
+    # Corpus-wide sharded index for cross-document search
+    corpus_index_enabled: bool = True
+    corpus_shards: int = 8
+    corpus_ivf_min_vectors: int = 20_000  # shard switches from exact to IVF-Flat above this
+    corpus_nprobe: int = 16
+    corpus_search_threads: int = 8
+
+    # In-process /ask answer cache (TTL + LRU), keyed by doc, normalized question, model, prompt
+    answer_cache_enabled: bool = True
+    answer_cache_ttl_s: float = 3600.0
+    answer_cache_max_entries: int = 4096
+    # Near-duplicate questions (cosine of question embeddings) reuse a cached answer
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.95  # tune with evals/semantic_cache_eval.py
+    semantic_cache_max_per_doc: int = 256
+
+    # Persistent embedding cache keyed by (model, dimensions, sha256(text))
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str | None = None  # default: <storage_dir>/cache/embeddings.sqlite
+    embedding_cache_max_bytes: int = 1024 * 1024 * 1024
 
 
 settings = Settings()
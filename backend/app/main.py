@@ -1,19 +1,46 @@
 from __future__ import annotations
 
-import os
-import shutil
+import asyncio
+import json
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from app.api.schemas import AskRequest, ExtractRequest
+from app.api.schemas import AskBatchRequest, AskRequest, BulkExtractRequest, ExtractRequest, SearchRequest
 from app.core.config import settings
+from app.services import answer_cache, datalab_cache, documents, embedding_cache, faiss_store, uploads
+from app.services.bulk_extract import extract_many_ndjson, select_documents
+from app.services.corpus_index import get_corpus_index
+from app.services.datalab import datalab_client
 from app.services.extract import extract_structured
-from app.services.ingest import ingest_document
-from app.services.rag import answer_question, rerank_hybrid, retrieve_raw
+from app.services.ingest import ingest_document, reindex_document
+from app.services.jobs import TERMINAL, QueueFullError, job_queue
+from app.services.rag import (
+    answer_question,
+    answer_questions,
+    embed_question,
+    fuse_hybrid,
+    retrieve_raw,
+    search_corpus,
+    stream_answer,
+)
+from app.services.text_extract import shutdown_pdf_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    uploads.gc_uploads()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await datalab_client.aclose()
+    shutdown_pdf_pool()
+
 
-app = FastAPI(title="UltraDoc Backend", version="0.1.0")
+app = FastAPI(title="UltraDoc Backend", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,16 +56,89 @@ def health():
     return {"ok": True, "service": "ultradoc-backend"}
 
 
-@app.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    os.makedirs(os.path.join(settings.storage_dir, "uploads"), exist_ok=True)
+@app.post("/upload", status_code=202)
+async def upload(
+    response: Response, file: UploadFile = File(...), wait: bool = False, dedupe: bool | None = None
+):
+    """Queue a file for ingestion and return the job right away.
+
+    Poll `GET /jobs/{job_id}`; the document metadata is in `result` once the job
+    has `status == "succeeded"`. With `wait=true` the request blocks until the job
+    finishes and returns the document metadata (previous behaviour).
+
+    The upload is streamed to disk once while hashing it; content that is already
+    stored (or being ingested) is not ingested again unless `dedupe=false`.
+    """
+
+    dedupe = settings.upload_dedupe if dedupe is None else dedupe
+    filename = uploads.safe_filename(file.filename)
+    mime = file.content_type
+
+    tmp_path, sha256, size = await asyncio.to_thread(uploads.spool, file.file)
+    params = {"filename": filename, "mime": mime, "sha256": sha256, "size_bytes": size}
+
+    job = None
+    if dedupe:
+        existing = uploads.lookup(sha256)
+        inflight = job_queue.get(uploads.inflight_job(sha256) or "")
+        if existing is not None:
+            job = job_queue.record("ingest", {**params, "deduplicated": True}, existing)
+        elif inflight is not None and inflight.status not in TERMINAL:
+            job = inflight
+        if job is not None:
+            uploads.discard(tmp_path)
+
+    if job is None:
+
+        def cleanup():
+            uploads.untrack_inflight(sha256)
+            uploads.discard(tmp_path)
+
+        async def run(job):
+            try:
+                return await ingest_document(
+                    file_path=tmp_path, filename=filename, mime=mime, stage=job.stage, sha256=sha256, move=True
+                )
+            finally:
+                cleanup()
+
+        try:
+            job = job_queue.submit("ingest", params, run, on_cancel=cleanup)
+        except QueueFullError as e:
+            uploads.discard(tmp_path)
+            raise HTTPException(status_code=503, detail=str(e))
+        uploads.track_inflight(sha256, job.id)
+
+    if not wait:
+        return job.to_dict()
+
+    await job.wait()
+    if job.status != "succeeded":
+        raise HTTPException(status_code=500, detail=job.error or f"Ingestion {job.status}")
+    response.status_code = 200
+    return job.result
+
+
+@app.get("/jobs")
+def list_jobs():
+    return {"stats": job_queue.stats(), "jobs": [j.to_dict() for j in job_queue.list()]}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
-    tmp_path = Path(settings.storage_dir) / "uploads" / file.filename
-    with tmp_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
 
-    meta = await ingest_document(file_path=str(tmp_path), filename=file.filename, mime=file.content_type)
-    return meta
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job (partially ingested data is removed)."""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 
 @app.post("/ask")
@@ -46,6 +146,44 @@ def ask(req: AskRequest):
     return answer_question(req.document_id, req.question)
 
 
+@app.post("/ask/batch")
+def ask_batch(req: AskBatchRequest):
+    """Answer several questions about one document; results are in question order."""
+    results = answer_questions(req.document_id, req.questions)
+    return {
+        "document_id": req.document_id,
+        "results": [{"question": q, **r} for q, r in zip(req.questions, results)],
+    }
+
+
+@app.post("/ask/stream")
+def ask_stream(req: AskRequest):
+    """Server-sent events: `sources` after retrieval, `token` deltas, then `done` (full response)."""
+
+    def events():
+        try:
+            for event, data in stream_answer(req.document_id, req.question):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'{type(e).__name__}: {e}'})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/search")
+def search(req: SearchRequest):
+    """Cross-document semantic search over the corpus index."""
+    try:
+        results = search_corpus(req.question, top_k=req.top_k, document_ids=req.document_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"question": req.question, "top_k": req.top_k, "results": results}
+
+
 @app.get("/debug/retrieve")
 def debug_retrieve(document_id: str, q: str, top_k: int = 6):
     """Debug endpoint: show raw FAISS retrieval vs hybrid reranked results.
@@ -57,16 +195,7 @@ def debug_retrieve(document_id: str, q: str, top_k: int = 6):
     """
 
     doc_dir = Path(settings.storage_dir) / "docs" / document_id
-    index_path = doc_dir / "index.faiss"
-    meta_path = doc_dir / "chunks_meta.jsonl"
-
-    missing = []
-    if not doc_dir.exists():
-        missing.append("doc_dir")
-    if not index_path.exists():
-        missing.append("index.faiss")
-    if not meta_path.exists():
-        missing.append("chunks_meta.jsonl")
+    missing = faiss_store.missing_artifacts(document_id)
 
     if missing:
         return {
@@ -84,8 +213,9 @@ def debug_retrieve(document_id: str, q: str, top_k: int = 6):
         }
 
     pre_k = max(top_k * 3, 12)
-    raw, _ = retrieve_raw(document_id, q, pre_k=pre_k)
-    reranked = rerank_hybrid(q, raw, alpha=0.25)
+    q_emb = embed_question(document_id, q)
+    raw, _ = retrieve_raw(document_id, q, pre_k=pre_k, query_embedding=q_emb)
+    reranked = fuse_hybrid(document_id, q, raw, query_embedding=q_emb, pre_k=pre_k, alpha=0.25)
 
     def slim(s: dict) -> dict:
         # Keep payload readable
@@ -93,6 +223,7 @@ def debug_retrieve(document_id: str, q: str, top_k: int = 6):
             "rank": s.get("rank"),
             "similarity": s.get("similarity"),
             "keyword_score": s.get("keyword_score"),
+            "bm25_score": s.get("bm25_score"),
             "rerank_score": s.get("rerank_score"),
             "page_num": s.get("page_num"),
             "chunk_index": s.get("chunk_index"),
@@ -110,36 +241,65 @@ def debug_retrieve(document_id: str, q: str, top_k: int = 6):
     }
 
 
+@app.get("/debug/index")
+def debug_index(document_id: str, top_k: int = 10, sample: int = 200, compare: bool = False):
+    """Recall@k / latency of the document's index vs. exact flat search.
+
+    With `compare=true`, every index type is built on the fly and reported.
+    """
+    report = faiss_store.evaluate_index(document_id, top_k=top_k, sample=sample, compare=compare)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return report
+
+
+@app.get("/debug/cache")
+def debug_cache():
+    """Hit/miss counters for the in-process caches."""
+    return {
+        "index_cache": faiss_store.cache_stats(),
+        "embedding_cache": embedding_cache.cache_stats(),
+        "answer_cache": answer_cache.cache_stats(),
+        "datalab_cache": datalab_cache.cache_stats(),
+    }
+
+
+@app.get("/debug/corpus")
+def debug_corpus():
+    """Corpus index shard layout (type + vector count per shard)."""
+    return get_corpus_index().stats()
+
+
+@app.get("/debug/datalab")
+def debug_datalab():
+    """Datalab conversion latency (p50/p95), polls per conversion and in-flight count."""
+    return datalab_client.stats()
+
+
 @app.post("/extract")
 def extract(req: ExtractRequest):
     return extract_structured(req.document_id, force=req.force)
 
 
+@app.post("/extract/bulk")
+def extract_bulk(req: BulkExtractRequest):
+    """Extract many documents concurrently; streams one NDJSON line per document, then a summary."""
+    ids = select_documents(
+        document_ids=req.document_ids,
+        document_type=req.document_type,
+        created_after=req.created_after,
+        created_before=req.created_before,
+    )
+    return StreamingResponse(
+        extract_many_ndjson(ids, force=req.force, concurrency=req.concurrency),
+        media_type="application/x-ndjson",
+    )
+
+
 @app.get("/documents")
 def list_documents():
     """List uploaded documents based on storage on disk."""
-    import json
-
-    docs_dir = Path(settings.storage_dir) / "docs"
-    if not docs_dir.exists():
-        return []
-
-    out = []
-    for d in docs_dir.iterdir():
-        if not d.is_dir():
-            continue
-        meta_path = d / "meta.json"
-        if not meta_path.exists():
-            continue
-        try:
-            meta = json.loads(meta_path.read_text(encoding="utf-8"))
-            out.append(meta)
-        except Exception:
-            continue
-
-    # newest first when created_at exists
-    out.sort(key=lambda m: m.get("created_at", ""), reverse=True)
-    return out
+    return documents.list_documents()
 
 
 @app.get("/documents/{document_id}")
@@ -155,15 +315,47 @@ def get_document_meta(document_id: str):
 @app.delete("/documents/{document_id}")
 def delete_document(document_id: str):
     """Delete a stored document and its FAISS index/caches."""
-    import shutil
-
-    doc_dir = Path(settings.storage_dir) / "docs" / document_id
-    if not doc_dir.exists():
+    if not documents.delete_document(document_id):
         raise HTTPException(status_code=404, detail="Document not found")
-    shutil.rmtree(doc_dir)
     return {"ok": True, "deleted": document_id}
 
 
+@app.post("/documents/{document_id}/reindex", status_code=202)
+async def reindex(document_id: str, response: Response, wait: bool = False):
+    """Re-extract and re-chunk a stored document with the current settings.
+
+    Runs as a job (poll `GET /jobs/{job_id}`). Unchanged chunks keep their stored
+    vectors; only new or changed chunks are embedded. `result.reindex` reports
+    how many were reused vs. embedded.
+    """
+
+    if not (Path(settings.storage_dir) / "docs" / document_id / "meta.json").exists():
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    for j in job_queue.list():
+        if j.kind == "reindex" and j.params.get("document_id") == document_id and j.status not in TERMINAL:
+            job = j
+            break
+    else:
+
+        async def run(job):
+            return await reindex_document(document_id, stage=job.stage)
+
+        try:
+            job = job_queue.submit("reindex", {"document_id": document_id}, run)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    if not wait:
+        return job.to_dict()
+
+    await job.wait()
+    if job.status != "succeeded":
+        raise HTTPException(status_code=500, detail=job.error or f"Reindex {job.status}")
+    response.status_code = 200
+    return job.result
+
+
 @app.get("/documents/{document_id}/file")
 def get_document_file(document_id: str):
     """Serve the original uploaded document file."""
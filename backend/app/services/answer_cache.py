@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import copy
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import settings
+
+# In-process cache of /ask answers.
+#
+# Keyed by (document_id, normalized question, chat model, prompt version,
+# retrieval settings). Each entry remembers the document's index signature, so
+# a re-ingested document never serves answers computed from its old index.
+# Entries expire after ANSWER_CACHE_TTL_S; the least recently used entry is
+# evicted past ANSWER_CACHE_MAX_ENTRIES.
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Case/whitespace/trailing-punctuation insensitive form of a question."""
+
+    q = unicodedata.normalize("NFKC", question or "").lower()
+    q = _SPACE_RE.sub(" ", q).strip()
+    return q.rstrip(" ?!.")
+
+
+def retrieval_settings() -> tuple:
+    # Everything that changes which sources reach the prompt.
+    return (
+        settings.top_k,
+        settings.min_similarity,
+        settings.hashing_min_similarity,
+        settings.hybrid_fusion,
+        settings.rrf_k,
+        settings.bm25_k1,
+        settings.bm25_b,
+        settings.hnsw_ef_search,
+        settings.ivf_nprobe,
+        settings.answer_context_max_tokens,
+        settings.context_mmr_lambda,
+    )
+
+
+class AnswerCache:
+    def __init__(self, *, max_entries: int, ttl_s: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[tuple, tuple[float, tuple | None, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, signature: tuple | None) -> dict | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] < now or entry[1] != signature):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[2])
+
+    def put(self, key: tuple, signature: tuple | None, response: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, signature, copy.deepcopy(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, document_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == document_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+class SemanticCache:
+    """Per-document near-duplicate question cache.
+
+    Each bucket (document, chat model, prompt version, retrieval settings) holds the
+    normalized embeddings of answered questions; a new question whose cosine with a
+    cached one reaches the threshold reuses that answer. Buckets are dropped when the
+    document's index signature changes.
+    """
+
+    def __init__(self, *, max_per_doc: int, ttl_s: float) -> None:
+        self.max_per_doc = max_per_doc
+        self.ttl_s = ttl_s
+        # bucket key -> (signature, [(expires, question, response)], matrix)
+        self._buckets: dict[tuple, tuple[tuple | None, list, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, bucket: tuple, signature: tuple | None, q_emb: np.ndarray, threshold: float
+    ) -> tuple[dict, float, str] | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is not None and entry[0] != signature:
+                del self._buckets[bucket]
+                entry = None
+            if entry is not None:
+                _, items, matrix = entry
+                sims = matrix @ q_emb
+                for i in np.argsort(-sims):
+                    if sims[i] < threshold:
+                        break
+                    expires, question, response = items[i]
+                    if expires >= now:
+                        self.hits += 1
+                        return copy.deepcopy(response), float(sims[i]), question
+            self.misses += 1
+            return None
+
+    def put(self, bucket: tuple, signature: tuple | None, q_emb: np.ndarray, question: str, response: dict) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is None or entry[0] != signature:
+                items, matrix = [], np.zeros((0, q_emb.shape[0]), dtype=np.float32)
+            else:
+                _, items, matrix = entry
+            # Drop expired entries, then the oldest beyond the per-document cap.
+            keep = [i for i, it in enumerate(items) if it[0] >= now]
+            keep = keep[len(keep) - max(0, self.max_per_doc - 1) :]
+            items = [items[i] for i in keep] + [(now + self.ttl_s, question, copy.deepcopy(response))]
+            matrix = np.vstack([matrix[keep], q_emb[None, :]])
+            self._buckets[bucket] = (signature, items, matrix)
+
+    def invalidate(self, document_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._buckets if k[0] == document_id]:
+                del self._buckets[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "documents": len({k[0] for k in self._buckets}),
+                "entries": sum(len(v[1]) for v in self._buckets.values()),
+                "max_per_doc": self.max_per_doc,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_cache = AnswerCache(max_entries=settings.answer_cache_max_entries, ttl_s=settings.answer_cache_ttl_s)
+_semantic = SemanticCache(max_per_doc=settings.semantic_cache_max_per_doc, ttl_s=settings.answer_cache_ttl_s)
+
+
+def make_key(document_id: str, question: str, *, model: str, prompt_version: str) -> tuple:
+    return (document_id, normalize_question(question), model, prompt_version, retrieval_settings())
+
+
+def get(key: tuple, signature: tuple | None) -> dict | None:
+    if not settings.answer_cache_enabled:
+        return None
+    return _cache.get(key, signature)
+
+
+def put(key: tuple, signature: tuple | None, response: dict) -> None:
+    if settings.answer_cache_enabled:
+        _cache.put(key, signature, response)
+
+
+def _bucket(key: tuple) -> tuple:
+    # Same document and answering setup, any question.
+    return (key[0], *key[2:])
+
+
+def _unit(q_emb) -> np.ndarray:
+    v = np.asarray(q_emb, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+def semantic_get(key: tuple, signature: tuple | None, q_emb, *, threshold: float | None = None):
+    """(response, cosine, matched question) of the closest cached question at or above the threshold."""
+    if not settings.semantic_cache_enabled:
+        return None
+    threshold = settings.semantic_cache_threshold if threshold is None else threshold
+    return _semantic.get(_bucket(key), signature, _unit(q_emb), threshold)
+
+
+def semantic_put(key: tuple, signature: tuple | None, q_emb, question: str, response: dict) -> None:
+    if settings.semantic_cache_enabled:
+        _semantic.put(_bucket(key), signature, _unit(q_emb), question, response)
+
+
+def invalidate(document_id: str) -> None:
+    _cache.invalidate(document_id)
+    _semantic.invalidate(document_id)
+
+
+def cache_stats() -> dict:
+    return {
+        "enabled": settings.answer_cache_enabled,
+        **_cache.stats(),
+        "semantic": {
+            "enabled": settings.semantic_cache_enabled,
+            "threshold": settings.semantic_cache_threshold,
+            **_semantic.stats(),
+        },
+    }
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import uuid
+from typing import Iterable
+
+import numpy as np
+
+from app.core.config import settings
+
+# Per-document BM25 inverted index, built at ingest and stored next to the FAISS
+# index as bm25.npz (CSR postings over vector rows). Queries touch only the
+# postings of their own terms, so lexical scoring is sub-millisecond and can
+# surface chunks the dense search missed.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-@._/][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z]+|[0-9]+")
+_MAX_TOKEN_LEN = 64
+
+# Question words carry no lexical signal; documents keep them (idf handles the rest).
+_QUERY_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "give",
+    "how", "in", "is", "it", "its", "me", "of", "on", "or", "please", "show", "tell", "that",
+    "the", "this", "to", "was", "what", "when", "where", "which", "who", "whom", "why", "with",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms; compound/alphanumeric IDs also emit their parts.
+
+    "LD-53657" -> ld-53657, ld, 53657; "MC1685682" -> mc1685682, mc, 1685682; so
+    "MC 1685682" in a question still matches "MC1685682" in the document.
+    """
+
+    out: list[str] = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        if len(tok) > _MAX_TOKEN_LEN:
+            continue
+        out.append(tok)
+        parts = _PART_RE.findall(tok)
+        if len(parts) > 1:
+            out.extend(parts)
+    return out
+
+
+def query_tokens(question: str) -> list[str]:
+    return [t for t in tokenize(question) if t not in _QUERY_STOPWORDS]
+
+
+def index_path(doc_dir: str) -> str:
+    return os.path.join(doc_dir, "bm25.npz")
+
+
+def build(texts: Iterable[str]) -> dict[str, np.ndarray]:
+    """Build CSR postings (term -> rows, tf) for texts in vector-row order."""
+
+    postings: dict[str, dict[int, int]] = {}
+    doc_len: list[int] = []
+    for row, text in enumerate(texts):
+        toks = tokenize(text)
+        doc_len.append(len(toks))
+        for t in toks:
+            p = postings.setdefault(t, {})
+            p[row] = p.get(row, 0) + 1
+
+    terms = sorted(postings)
+    ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, t in enumerate(terms):
+        ptr[i + 1] = ptr[i] + len(postings[t])
+    rows = np.empty(int(ptr[-1]), dtype=np.int32)
+    tf = np.empty(int(ptr[-1]), dtype=np.float32)
+    for i, t in enumerate(terms):
+        p = postings[t]
+        rows[ptr[i] : ptr[i + 1]] = list(p.keys())
+        tf[ptr[i] : ptr[i + 1]] = list(p.values())
+
+    return {
+        "terms": np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+        "ptr": ptr,
+        "rows": rows,
+        "tf": tf,
+        "doc_len": np.asarray(doc_len, dtype=np.float32),
+    }
+
+
+def save(doc_dir: str, arrays: dict[str, np.ndarray]) -> None:
+    path = index_path(doc_dir)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+class BM25Index:
+    def __init__(self, arrays: dict[str, np.ndarray], *, k1: float | None = None, b: float | None = None) -> None:
+        raw = arrays["terms"].tobytes().decode("utf-8")
+        terms = raw.split("\n") if raw else []
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.ptr = arrays["ptr"]
+        self.rows = arrays["rows"]
+        self.tf = arrays["tf"]
+        self.doc_len = arrays["doc_len"]
+        self.n = int(self.doc_len.shape[0])
+        self.k1 = settings.bm25_k1 if k1 is None else k1
+        self.b = settings.bm25_b if b is None else b
+
+        df = np.diff(self.ptr).astype(np.float32)
+        self.idf = np.log1p((self.n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(self.doc_len.mean()) if self.n else 1.0
+        # Per-row length normalization, precomputed once.
+        self._norm = (self.k1 * (1.0 - self.b + self.b * self.doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def load(cls, doc_dir: str) -> "BM25Index | None":
+        path = index_path(doc_dir)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            return cls({k: z[k] for k in z.files})
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.rows.nbytes + self.tf.nbytes + self.ptr.nbytes + self.doc_len.nbytes) + 64 * len(self.vocab)
+
+    def _term_ids(self, tokens: list[str]) -> list[int]:
+        return [self.vocab[t] for t in dict.fromkeys(tokens) if t in self.vocab]
+
+    def scores(self, tokens: list[str]) -> np.ndarray:
+        out = np.zeros(self.n, dtype=np.float32)
+        for tid in self._term_ids(tokens):
+            lo, hi = self.ptr[tid], self.ptr[tid + 1]
+            rows = self.rows[lo:hi]
+            tf = self.tf[lo:hi]
+            out[rows] += self.idf[tid] * tf * (self.k1 + 1.0) / (tf + self._norm[rows])
+        return out
+
+    def search(self, tokens: list[str], top_k: int) -> list[tuple[int, float]]:
+        if not self.n or not tokens:
+            return []
+        s = self.scores(tokens)
+        k = min(top_k, self.n)
+        top = np.argpartition(-s, k - 1)[:k]
+        top = top[np.argsort(-s[top])]
+        return [(int(r), float(s[r])) for r in top if s[r] > 0]
+
+    def match_ratio(self, tokens: list[str], rows: np.ndarray) -> np.ndarray:
+        """Share of the query's IDF mass present in each row (0..1)."""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.zeros(len(rows), dtype=np.float32)
+        unique = list(dict.fromkeys(tokens))
+        if not unique or not len(rows):
+            return out
+
+        # Unknown query terms count with the max idf: they matched nothing.
+        max_idf = float(math.log1p((self.n + 0.5) / 0.5))
+        total = 0.0
+        for t in unique:
+            tid = self.vocab.get(t)
+            if tid is None:
+                total += max_idf
+                continue
+            idf = float(self.idf[tid])
+            total += idf
+            present = np.isin(rows, self.rows[self.ptr[tid] : self.ptr[tid + 1]])
+            out[present] += idf
+        return out / total if total > 0 else out
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+
+from app.core.config import settings
+from app.services import documents
+from app.services.extract import extract_structured
+
+# Structured extraction over many documents.
+#
+# Documents are extracted concurrently in a dedicated thread pool (retrieval and
+# the LLM call are blocking), at most `concurrency` at a time. A failure is
+# reported for its document only. Results are yielded as they finish; cached
+# extract.json results come back without an LLM call unless `force`.
+
+
+def select_documents(
+    *,
+    document_ids: list[str] | None = None,
+    document_type: str | None = None,
+    created_after: str | None = None,
+    created_before: str | None = None,
+) -> list[str]:
+    """Explicit ids (kept in order, deduplicated) or every stored document matching the filter."""
+
+    if document_ids:
+        return list(dict.fromkeys(document_ids))
+
+    out = []
+    for meta in documents.list_documents():
+        created = meta.get("created_at") or ""
+        if document_type and meta.get("document_type") != document_type:
+            continue
+        if created_after and created < created_after:
+            continue
+        if created_before and created >= created_before:
+            continue
+        out.append(meta["document_id"])
+    return out
+
+
+def _extract_one(document_id: str, force: bool) -> dict:
+    if not os.path.exists(os.path.join(documents.doc_dir(document_id), "meta.json")):
+        raise LookupError("Document not found")
+    return extract_structured(document_id, force=force)
+
+
+async def extract_many(
+    document_ids: list[str], *, force: bool = False, concurrency: int | None = None
+) -> AsyncIterator[dict]:
+    """Yield `{document_id, ok, result | error, elapsed_s}` per document, in completion order."""
+
+    if not document_ids:
+        return
+
+    concurrency = max(1, concurrency or settings.extract_bulk_concurrency)
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=min(concurrency, len(document_ids)))
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(document_id: str) -> dict:
+        async with slots:
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(pool, _extract_one, document_id, force)
+                row = {"document_id": document_id, "ok": True, "result": result}
+            except Exception as e:
+                row = {"document_id": document_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+            row["elapsed_s"] = round(time.perf_counter() - started, 4)
+            return row
+
+    tasks = [asyncio.create_task(run(d)) for d in document_ids]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
+        # Extractions already running finish in their threads; queued ones are dropped.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_many_ndjson(document_ids: list[str], *, force: bool = False, concurrency: int | None = None):
+    """NDJSON lines: one per document, then a final `{"summary": ...}` line."""
+
+    started = time.perf_counter()
+    ok = failed = cached = 0
+    async for row in extract_many(document_ids, force=force, concurrency=concurrency):
+        if row["ok"]:
+            ok += 1
+            cached += bool(row["result"].get("_cached"))
+        else:
+            failed += 1
+        yield json.dumps(row) + "\n"
+    summary = {
+        "documents": len(document_ids),
+        "ok": ok,
+        "failed": failed,
+        "cached": cached,
+        "elapsed_s": round(time.perf_counter() - started, 4),
+    }
+    yield json.dumps({"summary": summary}) + "\n"
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk structured extraction (NDJSON to stdout)")
+    parser.add_argument("document_ids", nargs="*", help="documents to extract (default: all matching the filter)")
+    parser.add_argument("--document-type")
+    parser.add_argument("--created-after", help="ISO timestamp, inclusive")
+    parser.add_argument("--created-before", help="ISO timestamp, exclusive")
+    parser.add_argument("--force", action="store_true", help="ignore cached extract.json")
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    ids = select_documents(
+        document_ids=args.document_ids,
+        document_type=args.document_type,
+        created_after=args.created_after,
+        created_before=args.created_before,
+    )
+
+    async def run() -> dict:
+        line = ""
+        async for line in extract_many_ndjson(ids, force=args.force, concurrency=args.concurrency):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return json.loads(line)["summary"]
+
+    return 1 if asyncio.run(run())["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
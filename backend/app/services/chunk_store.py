@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.types import Chunk
+from app.services.metadata import build_metadata_prefix
+
+# On-disk layout (per document):
+#   chunks.bin       utf-8 chunk bodies packed back to back (no metadata prefix)
+#   chunks_idx.npy   fixed-width records, one per vector row in index.faiss
+#   chunks_doc.json  document-level metadata + prefix, stored once
+#
+# Chunk ids are derived (`<document_id>:<page or 0>:<chunk_index>`), matching chunking.py.
+
+STORE_VERSION = 1
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("length", "<u4"),
+        ("page_num", "<i4"),  # -1 == None
+        ("chunk_index", "<i4"),
+        ("flags", "<u4"),
+    ]
+)
+
+FLAG_PREFIXED = 1
+
+_migrate_lock = threading.Lock()
+
+BLOB_NAME = "chunks.bin"
+INDEX_NAME = "chunks_idx.npy"
+DOC_NAME = "chunks_doc.json"
+LEGACY_NAME = "chunks_meta.jsonl"
+
+
+def _doc_dir(document_id: str) -> str:
+    return os.path.join(settings.storage_dir, "docs", document_id)
+
+
+def _chunk_id(document_id: str, page_num: int | None, chunk_index: int) -> str:
+    return f"{document_id}:{page_num or 0}:{chunk_index}"
+
+
+def store_paths(document_id: str) -> tuple[str, str, str]:
+    d = _doc_dir(document_id)
+    return os.path.join(d, BLOB_NAME), os.path.join(d, INDEX_NAME), os.path.join(d, DOC_NAME)
+
+
+def legacy_path(document_id: str) -> str:
+    return os.path.join(_doc_dir(document_id), LEGACY_NAME)
+
+
+def exists(document_id: str) -> bool:
+    return all(os.path.exists(p) for p in store_paths(document_id))
+
+
+def write(document_id: str, chunks: list[Chunk], *, embedding: dict | None = None) -> None:
+    """Write chunks in vector-row order. All chunks must share document metadata.
+
+    `embedding` describes the embedding space of the matching index (backend/model/dims).
+    """
+
+    writer = ChunkStoreWriter(document_id, chunks[0].meta if chunks else None, embedding=embedding)
+    try:
+        writer.append(chunks)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class ChunkStoreWriter:
+    """Write side: chunks are appended in vector-row order as they are produced; the
+    store replaces the previous one on close()."""
+
+    def __init__(self, document_id: str, meta: dict | None, *, embedding: dict | None = None) -> None:
+        self.document_id = document_id
+        self.meta = meta
+        self.embedding = embedding
+        self.prefix = build_metadata_prefix(meta or {})
+        self._paths = store_paths(document_id)
+        self._suffix = f".{uuid.uuid4().hex}.tmp"
+        os.makedirs(_doc_dir(document_id), exist_ok=True)
+        self._blob = open(self._paths[0] + self._suffix, "wb")
+        self._records: list[np.ndarray] = []
+        self._offset = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, chunks: list[Chunk]) -> None:
+        records = np.zeros(len(chunks), dtype=RECORD_DTYPE)
+        for i, c in enumerate(chunks):
+            if c.meta != self.meta:
+                raise ValueError("Chunk store expects metadata shared by all chunks of a document")
+            text = c.text or ""
+            flags = 0
+            if self.prefix and text.startswith(self.prefix):
+                text = text[len(self.prefix):]
+                flags |= FLAG_PREFIXED
+            data = text.encode("utf-8")
+            self._blob.write(data)
+            records[i] = (self._offset, len(data), -1 if c.page_num is None else c.page_num, c.chunk_index, flags)
+            self._offset += len(data)
+        self._records.append(records)
+        self._count += len(chunks)
+
+    def close(self) -> None:
+        blob_path, idx_path, doc_path = self._paths
+        self._blob.close()
+
+        records = np.concatenate(self._records) if self._records else np.zeros(0, dtype=RECORD_DTYPE)
+        with open(idx_path + self._suffix, "wb") as f:
+            np.save(f, records)
+
+        with open(doc_path + self._suffix, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": STORE_VERSION,
+                    "document_id": self.document_id,
+                    "count": self._count,
+                    "meta": self.meta,
+                    "prefix": self.prefix,
+                    "embedding": self.embedding,
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+        for path in (blob_path, idx_path, doc_path):
+            os.replace(path + self._suffix, path)
+
+    def abort(self) -> None:
+        self._blob.close()
+        for path in self._paths:
+            try:
+                os.remove(path + self._suffix)
+            except FileNotFoundError:
+                pass
+
+
+class ChunkStore:
+    """Read side: memory-maps the blob + record index and decodes records on demand."""
+
+    def __init__(self, document_id: str) -> None:
+        blob_path, idx_path, doc_path = store_paths(document_id)
+        self.document_id = document_id
+
+        with open(doc_path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        self.meta: dict | None = doc.get("meta")
+        self.prefix: str = doc.get("prefix") or ""
+        self.embedding: dict | None = doc.get("embedding")
+
+        self.records = np.load(idx_path, mmap_mode="r")
+        if self.records.dtype != RECORD_DTYPE:
+            raise ValueError(f"Unsupported chunk index layout in {idx_path}")
+
+        with open(blob_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap refuses empty files; an all-empty store has nothing to read anyway.
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return int(self.records.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        # Resident cost is the record index; the blob is paged in by the OS.
+        return int(self.records.nbytes) + len(self.prefix) + 256
+
+    def body(self, i: int) -> str:
+        r = self.records[i]
+        start = int(r["offset"])
+        return bytes(self._blob[start : start + int(r["length"])]).decode("utf-8")
+
+    def text(self, i: int) -> str:
+        body = self.body(i)
+        if int(self.records[i]["flags"]) & FLAG_PREFIXED:
+            return self.prefix + body
+        return body
+
+    def get(self, i: int) -> dict:
+        """Same shape as a legacy chunks_meta.jsonl line (asdict(Chunk))."""
+        r = self.records[i]
+        page_num = int(r["page_num"])
+        page_num = None if page_num < 0 else page_num
+        chunk_index = int(r["chunk_index"])
+        return {
+            "id": _chunk_id(self.document_id, page_num, chunk_index),
+            "document_id": self.document_id,
+            "text": self.text(i),
+            "page_num": page_num,
+            "chunk_index": chunk_index,
+            "meta": self.meta,
+        }
+
+
+def migrate_legacy(document_id: str, *, remove_legacy: bool = True) -> bool:
+    """Convert chunks_meta.jsonl into the binary store. Returns True if migrated."""
+
+    lpath = legacy_path(document_id)
+    with _migrate_lock:
+        if exists(document_id):
+            return True
+        if not os.path.exists(lpath):
+            return False
+
+        chunks: list[Chunk] = []
+        with open(lpath, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    chunks.append(Chunk(**json.loads(line)))
+
+        write(document_id, chunks)
+        if remove_legacy:
+            os.remove(lpath)
+        return True
+
+
+def migrate_all(*, remove_legacy: bool = True) -> list[str]:
+    docs_dir = os.path.join(settings.storage_dir, "docs")
+    if not os.path.isdir(docs_dir):
+        return []
+    migrated = []
+    for name in sorted(os.listdir(docs_dir)):
+        if exists(name):
+            continue
+        if migrate_legacy(name, remove_legacy=remove_legacy):
+            migrated.append(name)
+    return migrated
+
+
+if __name__ == "__main__":
+    # python -m app.services.chunk_store [--keep-legacy]
+    import sys
+
+    done = migrate_all(remove_legacy="--keep-legacy" not in sys.argv[1:])
+    print(f"migrated {len(done)} document(s)")
+    for d in done:
+        print(f"  {d}")
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import re
+from typing import Iterable, Iterator
 
 from app.core.types import Chunk
-from app.services.parsing.markdown_blocks import parse_markdown_blocks
+from app.services.parsing.markdown_blocks import iter_markdown_blocks
 
 
 def _split_by_blank_lines(text: str) -> list[str]:
@@ -46,16 +47,29 @@ def chunk_pages(
     Otherwise we fall back to paragraph packing.
     """
 
-    chunks: list[Chunk] = []
+    return list(iter_chunks(document_id, pages, max_chars=max_chars, overlap_chars=overlap_chars))
+
+
+def iter_chunks(
+    document_id: str,
+    pages: Iterable[tuple[int | None, str]],
+    *,
+    max_chars: int = 2400,
+    overlap_chars: int = 250,
+) -> Iterator[Chunk]:
+    """chunk_pages as a generator: pages are consumed one at a time and each page's
+    chunks are yielded before the next page is read."""
+
     chunk_index = 0
 
     for page_num, text in pages:
         t = text or ""
+        chunks: list[Chunk] = []
 
         looks_markdown = ("|" in t and "\n" in t) or ("#" in t and "\n" in t)
 
         if looks_markdown:
-            blocks = parse_markdown_blocks(t)
+            blocks = iter_markdown_blocks(t)
             # Pack blocks into chunks, but never split a table unless it is huge.
             buf: list[str] = []
             buf_len = 0
@@ -119,6 +133,7 @@ def chunk_pages(
                         flush()
 
             flush()
+            yield from chunks
             continue
 
         # Fallback: paragraph packing
@@ -162,5 +177,4 @@ def chunk_pages(
                     flush2()
 
         flush2()
-
-    return chunks
+        yield from chunks
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from app.services.bm25 import tokenize
+from app.services.embedding_batch import estimate_tokens
+from app.services.metadata import build_metadata_prefix
+
+# Builds the source context of an LLM prompt from retrieved chunks.
+#
+# - The metadata prefix every chunk carries is stripped and emitted once.
+# - Chunks are picked by MMR: relevance (retrieval order/score) against lexical
+#   redundancy (Jaccard of term sets) with the chunks already picked, until the
+#   token budget is spent. Near-duplicates of a picked chunk are left out.
+# - Picked chunks that are adjacent in the document (consecutive chunk_index) are
+#   merged into one block, dropping text repeated at the seam.
+
+_MAX_SEAM = 600  # longest chunk overlap looked for when merging neighbours
+_NEAR_DUPLICATE = 0.9  # Jaccard at which a chunk only repeats one already picked
+
+
+@dataclass
+class PackedContext:
+    text: str
+    sources: list[dict]  # picked sources, in block order
+    tokens: int
+    dropped: int = 0  # candidates left out (budget or redundancy)
+    blocks: list[list[int]] = field(default_factory=list)  # chunk_index groups per block
+
+
+def _body(source: dict, prefix: str) -> str:
+    text = source.get("text") or ""
+    if prefix and text.startswith(prefix):
+        text = text[len(prefix):]
+    return text.strip()
+
+
+def _relevance(sources: list[dict]) -> list[float]:
+    # Min-max scaled retrieval score; falls back to rank order.
+    raw = [s.get("rerank_score", s.get("similarity")) for s in sources]
+    if any(r is None for r in raw):
+        n = len(sources)
+        return [1.0 - i / max(1, n) for i in range(n)]
+    lo, hi = min(raw), max(raw)
+    return [(r - lo) / (hi - lo) if hi > lo else 1.0 for r in raw]
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _seam(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (bounded)."""
+    for n in range(min(len(a), len(b), _MAX_SEAM), 0, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _header(label: str, n: int, members: list[dict], show_similarity: bool) -> str:
+    pages = sorted({m.get("page_num") for m in members if m.get("page_num") is not None})
+    page = ",".join(str(p) for p in pages) if pages else "None"
+    parts = [f"{label} {n}", f"page={page}"]
+    if show_similarity:
+        parts.append(f"sim={max(float(m.get('similarity') or 0.0) for m in members):.3f}")
+    return "[" + " | ".join(parts) + "]"
+
+
+def pack(
+    sources: list[dict],
+    *,
+    max_tokens: int,
+    mmr_lambda: float = 0.7,
+    label: str = "Source",
+    show_similarity: bool = True,
+    relevance: list[float] | None = None,
+    pinned: int = 0,
+) -> PackedContext:
+    """Pack retrieved sources (most relevant first) into a prompt context within `max_tokens`.
+
+    `relevance` overrides the scaled retrieval scores (e.g. when sources come from
+    several queries whose scores don't compare). The first `pinned` sources are
+    taken in order, budget permitting, before MMR fills the rest.
+    """
+
+    if not sources:
+        return PackedContext(text="", sources=[], tokens=0)
+
+    meta = sources[0].get("chunk_meta") or {}
+    prefix = build_metadata_prefix(meta)
+    head = f"[Document metadata]\n{prefix.strip()}" if prefix else ""
+    used = estimate_tokens(head) if head else 0
+
+    bodies = [_body(s, prefix) for s in sources]
+    terms = [set(tokenize(b)) for b in bodies]
+    if relevance is None:
+        relevance = _relevance(sources)
+
+    # Selection under the budget (header cost ~ 12 tokens per block): pinned
+    # sources first, then MMR over the rest.
+    picked: list[int] = []
+    remaining = list(range(len(sources)))
+
+    def redundancy(i: int) -> float:
+        return max((_jaccard(terms[i], terms[j]) for j in picked), default=0.0)
+
+    def take(i: int, redundant: float) -> None:
+        nonlocal used
+        remaining.remove(i)
+        if redundant >= _NEAR_DUPLICATE:
+            return
+        cost = estimate_tokens(bodies[i]) + 12
+        if used + cost > max_tokens:
+            if picked:
+                return
+            # Always keep the first chunk, trimmed to what fits.
+            bodies[i] = bodies[i][: max(0, (max_tokens - used - 12) * 3)]
+            cost = estimate_tokens(bodies[i]) + 12
+        picked.append(i)
+        used += cost
+
+    for i in range(min(pinned, len(sources))):
+        take(i, redundancy(i))
+    while remaining:
+        scores = {i: redundancy(i) for i in remaining}
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1.0 - mmr_lambda) * scores[i])
+        take(best, scores[best])
+
+    # Merge neighbours (consecutive chunk_index); blocks keep the order of their best member.
+    blocks: list[list[int]] = []
+    by_chunk = sorted(
+        picked, key=lambda i: (sources[i].get("chunk_index") is None, sources[i].get("chunk_index") or 0)
+    )
+    for i in by_chunk:
+        ci = sources[i].get("chunk_index")
+        if blocks and ci is not None:
+            last = sources[blocks[-1][-1]].get("chunk_index")
+            if last is not None and ci - last == 1:
+                blocks[-1].append(i)
+                continue
+        blocks.append([i])
+    rank_of = {i: r for r, i in enumerate(picked)}
+    blocks.sort(key=lambda b: min(rank_of[i] for i in b))
+
+    parts = [head] if head else []
+    ordered: list[dict] = []
+    for n, block in enumerate(blocks, start=1):
+        text = bodies[block[0]]
+        for i in block[1:]:
+            nxt = bodies[i]
+            text = text + "\n" + nxt[_seam(text, nxt):].lstrip()
+        members = [sources[i] for i in block]
+        parts.append(f"{_header(label, n, members, show_similarity)}\n{text}")
+        ordered.extend(members)
+
+    out = "\n\n".join(parts)
+    return PackedContext(
+        text=out,
+        sources=ordered,
+        tokens=estimate_tokens(out),
+        dropped=len(sources) - len(picked),
+        blocks=[[sources[i].get("chunk_index") for i in b] for b in blocks],
+    )
@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+
+# Corpus-wide vector index used for cross-document search.
+#
+# Every document gets a small integer key; its vectors are stored under ids
+# `(key << 32) | row`, where `row` is the vector's row in the per-document index
+# (and chunk store). A document lives in exactly one shard (key % num_shards),
+# so add/remove touch one shard and a per-document filter only searches there.
+#
+# Shards start as exact IndexIDMap2(IndexFlatIP) and are converted to IVF-Flat
+# (with a hashtable direct map so vectors can be removed/reconstructed) once they
+# pass CORPUS_IVF_MIN_VECTORS, which keeps query cost sub-linear in corpus size.
+#
+# Assumes one process owns the index (a single uvicorn worker): key allocation, the
+# manifest and loaded shards live in process memory. Writes hold a file lock and
+# reload manifest/shards changed on disk first, so a second writer (another worker,
+# the backfill CLI) can't hand out the same keys or overwrite a newer shard, but
+# other processes only see new documents once they reload. Each add/remove
+# rewrites the document's whole shard, i.e. it costs O(shard size), not O(document).
+
+_ROW_BITS = 32
+_ROW_MASK = (1 << _ROW_BITS) - 1
+
+
+def _corpus_dir() -> str:
+    return os.path.join(settings.storage_dir, "corpus")
+
+
+def _manifest_path() -> str:
+    return os.path.join(_corpus_dir(), "manifest.json")
+
+
+def _shard_path(shard: int) -> str:
+    return os.path.join(_corpus_dir(), f"shard_{shard}.faiss")
+
+
+def _lock_path() -> str:
+    return os.path.join(_corpus_dir(), ".lock")
+
+
+def _signature(path: str) -> tuple | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _write_atomic(path: str, write) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    # Normalized copy; inputs may be read-only memory maps or the caller's arrays.
+    v = np.array(v, dtype=np.float32, order="C")
+    faiss.normalize_L2(v)
+    return v
+
+
+def _doc_ids(key: int, count: int) -> np.ndarray:
+    return (np.int64(key) << _ROW_BITS) | np.arange(count, dtype=np.int64)
+
+
+def _space(embedding: dict | None) -> tuple:
+    e = embedding or {}
+    return (e.get("backend") or "openai", e.get("model"), e.get("dimensions"))
+
+
+class CorpusIndex:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._shards: dict[int, faiss.Index] = {}
+        self._shard_sigs: dict[int, tuple | None] = {}
+        self._shard_locks: list[threading.Lock] = []
+        self._manifest: dict = {}
+        self._manifest_sig: tuple | None = None
+        self._load()
+
+    # -- persistence -------------------------------------------------------
+
+    @contextmanager
+    def _writing(self):
+        """Process lock + file lock for a mutation, with on-disk changes reloaded first."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(_corpus_dir(), exist_ok=True)
+            with open(_lock_path(), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        # Another process rewrote the manifest: reload it and drop shards it changed.
+        if _signature(_manifest_path()) == self._manifest_sig:
+            return
+        self._load()
+        for shard in list(self._shards):
+            if _signature(_shard_path(shard)) != self._shard_sigs.get(shard):
+                del self._shards[shard]
+
+    def _load(self) -> None:
+        path = _manifest_path()
+        self._manifest_sig = _signature(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {
+                "num_shards": settings.corpus_shards,
+                "embedding": None,
+                "dim": None,
+                "next_key": 0,
+                "docs": {},
+                "trained_at": {},
+            }
+        if len(self._shard_locks) != self.num_shards:
+            self._shard_locks = [threading.Lock() for _ in range(self.num_shards)]
+
+    @property
+    def num_shards(self) -> int:
+        return int(self._manifest["num_shards"])
+
+    def _save_manifest(self) -> None:
+        os.makedirs(_corpus_dir(), exist_ok=True)
+
+        def write(tmp: str) -> None:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._manifest, f)
+
+        _write_atomic(_manifest_path(), write)
+        self._manifest_sig = _signature(_manifest_path())
+
+    def _shard(self, shard: int) -> faiss.Index | None:
+        index = self._shards.get(shard)
+        if index is None and os.path.exists(_shard_path(shard)):
+            self._shard_sigs[shard] = _signature(_shard_path(shard))
+            index = faiss.read_index(_shard_path(shard))
+            self._shards[shard] = index
+        return index
+
+    def _save_shard(self, shard: int, index: faiss.Index) -> None:
+        os.makedirs(_corpus_dir(), exist_ok=True)
+        _write_atomic(_shard_path(shard), lambda tmp: faiss.write_index(index, tmp))
+        self._shard_sigs[shard] = _signature(_shard_path(shard))
+
+    # -- mutation ----------------------------------------------------------
+
+    def add_document(self, document_id: str, embeddings, *, embedding: dict | None = None) -> bool:
+        """Add (or replace) a document's vectors. Returns False if its embedding space differs."""
+
+        emb = np.asarray(embeddings, dtype=np.float32)
+        if emb.ndim != 2 or emb.shape[0] == 0:
+            return False
+        emb = _normalize(emb)
+
+        with self._writing():
+            m = self._manifest
+            if m["embedding"] is None:
+                m["embedding"] = embedding
+                m["dim"] = int(emb.shape[1])
+            elif not self.matches(embedding, emb.shape[1]):
+                return False
+
+            if document_id in m["docs"]:
+                self._remove_locked(document_id)
+
+            key = int(m["next_key"])
+            m["next_key"] = key + 1
+            shard = key % self.num_shards
+
+            with self._shard_locks[shard]:
+                index = self._shard(shard)
+                if index is None:
+                    index = faiss.IndexIDMap2(faiss.IndexFlatIP(m["dim"]))
+                ids = _doc_ids(key, emb.shape[0])
+                index.add_with_ids(emb, ids)
+                index = self._maybe_train(shard, index, ids)
+                self._shards[shard] = index
+                self._save_shard(shard, index)
+
+            m["docs"][document_id] = {"key": key, "shard": shard, "count": int(emb.shape[0])}
+            self._save_manifest()
+            return True
+
+    def _remove_locked(self, document_id: str) -> bool:
+        doc = self._manifest["docs"].pop(document_id, None)
+        if doc is None:
+            return False
+        shard = doc["shard"]
+        with self._shard_locks[shard]:
+            index = self._shard(shard)
+            if index is not None:
+                # IDSelectorArray works for both IDMap2 and IVF with a hashtable direct map.
+                index.remove_ids(faiss.IDSelectorArray(_doc_ids(doc["key"], doc["count"])))
+                self._save_shard(shard, index)
+        return True
+
+    def remove_document(self, document_id: str) -> bool:
+        with self._writing():
+            removed = self._remove_locked(document_id)
+            if removed:
+                self._save_manifest()
+            return removed
+
+    def _shard_ids(self, shard: int) -> np.ndarray:
+        parts = [_doc_ids(d["key"], d["count"]) for d in self._manifest["docs"].values() if d["shard"] == shard]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def _maybe_train(self, shard: int, index: faiss.Index, new_ids: np.ndarray) -> faiss.Index:
+        """Convert a shard to IVF when it gets big, and retrain when it has grown 4x."""
+
+        n = int(index.ntotal)
+        if n < settings.corpus_ivf_min_vectors:
+            return index
+        trained_at = int(self._manifest["trained_at"].get(str(shard), 0))
+        if trained_at and n < trained_at * 4:
+            return index
+
+        # The manifest doesn't list the document being added yet.
+        ids = np.concatenate([self._shard_ids(shard), new_ids])
+        vectors = np.ascontiguousarray(index.reconstruct_batch(ids), dtype=np.float32)
+
+        dim = vectors.shape[1]
+        # ~4*sqrt(n) lists, but keep >= 39 training points per centroid (faiss warns below that).
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        ivf = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        ivf.train(vectors)
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        ivf.add_with_ids(vectors, ids)
+        self._manifest["trained_at"][str(shard)] = n
+        return ivf
+
+    # -- query -------------------------------------------------------------
+
+    @property
+    def embedding(self) -> dict | None:
+        return self._manifest.get("embedding")
+
+    def matches(self, embedding: dict | None, dim: int) -> bool:
+        """Whether vectors from `embedding` (backend/model/dimensions) with `dim` dims fit this index."""
+        m = self._manifest
+        return _space(m["embedding"]) == _space(embedding) and m["dim"] == int(dim)
+
+    def document_ids(self) -> list[str]:
+        return list(self._manifest["docs"])
+
+    def _search_shard(self, shard: int, q: np.ndarray, top_k: int, sel) -> list[tuple[float, int]]:
+        with self._shard_locks[shard]:
+            index = self._shard(shard)
+            if index is None or index.ntotal == 0:
+                return []
+            if isinstance(index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(nprobe=settings.corpus_nprobe)
+            else:
+                params = faiss.SearchParameters()
+            if sel is not None:
+                params.sel = sel
+            scores, ids = index.search(q, top_k, params=params)
+        return [(float(s), int(i)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def search(self, query_embedding, *, top_k: int, document_ids: list[str] | None = None) -> list[dict]:
+        """Fan out across shards and merge. `document_ids` restricts results to those documents."""
+
+        q = _normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))
+
+        with self._lock:
+            docs = self._manifest["docs"]
+            key_to_doc = {d["key"]: doc_id for doc_id, d in docs.items()}
+
+            plan: dict[int, object] = {}
+            if document_ids is None:
+                plan = {s: None for s in range(self.num_shards)}
+            else:
+                by_shard: dict[int, list[dict]] = {}
+                for doc_id in document_ids:
+                    d = docs.get(doc_id)
+                    if d is not None:
+                        by_shard.setdefault(d["shard"], []).append(d)
+                for shard, ds in by_shard.items():
+                    if len(ds) == 1:
+                        lo = ds[0]["key"] << _ROW_BITS
+                        plan[shard] = faiss.IDSelectorRange(lo, lo + ds[0]["count"])
+                    else:
+                        plan[shard] = faiss.IDSelectorBatch(np.concatenate([_doc_ids(d["key"], d["count"]) for d in ds]))
+
+        if not plan:
+            return []
+
+        if len(plan) == 1:
+            hits = [self._search_shard(s, q, top_k, sel) for s, sel in plan.items()]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(plan), settings.corpus_search_threads)) as pool:
+                hits = list(pool.map(lambda item: self._search_shard(item[0], q, top_k, item[1]), plan.items()))
+
+        merged = sorted((h for shard_hits in hits for h in shard_hits), key=lambda h: h[0], reverse=True)[:top_k]
+
+        out = []
+        for score, vid in merged:
+            doc_id = key_to_doc.get(vid >> _ROW_BITS)
+            if doc_id is None:
+                continue
+            out.append({"document_id": doc_id, "row": vid & _ROW_MASK, "similarity": score})
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            shards = []
+            for s in range(self.num_shards):
+                index = self._shard(s)
+                shards.append(
+                    {
+                        "shard": s,
+                        "type": type(index).__name__ if index is not None else None,
+                        "vectors": int(index.ntotal) if index is not None else 0,
+                    }
+                )
+            return {
+                "documents": len(self._manifest["docs"]),
+                "embedding": self._manifest.get("embedding"),
+                "shards": shards,
+            }
+
+
+_corpus: CorpusIndex | None = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus_index() -> CorpusIndex:
+    global _corpus
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = CorpusIndex()
+        return _corpus
+
+
+def rebuild() -> int:
+    """Backfill the corpus index from every per-document index on disk."""
+
+    from app.services import faiss_store
+
+    corpus = get_corpus_index()
+    docs_dir = os.path.join(settings.storage_dir, "docs")
+    if not os.path.isdir(docs_dir):
+        return 0
+
+    added = 0
+    known = set(corpus.document_ids())
+    for document_id in sorted(os.listdir(docs_dir)):
+        if document_id in known:
+            continue
+        vectors = faiss_store.load_vectors(document_id)
+        if vectors is None:
+            continue
+        if corpus.add_document(document_id, vectors, embedding=faiss_store.embedding_info(document_id)):
+            added += 1
+    return added
+
+
+if __name__ == "__main__":
+    # python -m app.services.corpus_index
+    print(f"indexed {rebuild()} document(s)")
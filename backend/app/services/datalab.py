@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import mimetypes
+import pathlib
+import random
+import time
+
+import httpx
+
+from app.core.config import settings
+
+# Datalab marker client shared for the app lifetime.
+#
+# One pooled httpx.AsyncClient (keep-alive connections are reused across
+# documents), a semaphore capping conversions in flight, a minimum spacing
+# between submissions (rate limit), and adaptive polling: the first status check
+# comes after DATALAB_POLL_INITIAL_S and the interval grows x1.5 (with jitter)
+# up to DATALAB_POLL_MAX_S, so quick conversions return quickly.
+
+_PENDING = {"queued", "processing", "running"}
+_LATENCY_WINDOW = 500
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class DatalabClient:
+    def __init__(self) -> None:
+        self._client: httpx.AsyncClient | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._submit_lock: asyncio.Lock | None = None
+        self._next_submit = 0.0
+        self._latencies: list[float] = []
+        self._polls: list[int] = []
+        self.submitted = 0
+        self.failed = 0
+        self.in_flight = 0
+
+    def _ensure(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.datalab_request_timeout_s),
+                limits=httpx.Limits(
+                    max_connections=settings.datalab_max_connections,
+                    max_keepalive_connections=settings.datalab_max_connections,
+                ),
+                headers={"X-API-Key": settings.datalab_api_key or ""},
+            )
+            self._slots = asyncio.Semaphore(settings.datalab_max_concurrent)
+            self._submit_lock = asyncio.Lock()
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _wait_submit_slot(self) -> None:
+        # Space submissions 1/rate seconds apart (0 == unlimited).
+        rate = settings.datalab_submit_rate
+        if rate <= 0:
+            return
+        assert self._submit_lock is not None
+        async with self._submit_lock:
+            now = time.monotonic()
+            wait = self._next_submit - now
+            self._next_submit = max(now, self._next_submit) + 1.0 / rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _poll_delays(self):
+        delay = settings.datalab_poll_initial_s
+        while True:
+            yield delay * random.uniform(0.8, 1.2)
+            delay = min(delay * 1.5, settings.datalab_poll_max_s)
+
+    async def convert(self, path: str, data: dict) -> dict:
+        """Submit one file to the marker endpoint and poll until done. Returns the final payload."""
+
+        client = self._ensure()
+        assert self._slots is not None
+        url = f"{settings.datalab_base_url.rstrip('/')}/marker"
+
+        # Guess content type for the file
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/pdf"
+
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                await self._wait_submit_slot()
+                started = time.monotonic()
+                polls = 0
+                try:
+                    with open(path, "rb") as f:
+                        files = {"file": (pathlib.Path(path).name, f, content_type)}
+                        submit_response = await client.post(url, data=data, files=files)
+                    self.submitted += 1
+
+                    if submit_response.status_code >= 400:
+                        raise RuntimeError(
+                            f"Datalab submit failed: {submit_response.status_code} {submit_response.text}"
+                        )
+
+                    request_url = submit_response.json().get("request_check_url")
+                    if not request_url:
+                        raise RuntimeError("Datalab response missing 'request_check_url'.")
+
+                    deadline = started + settings.datalab_timeout_s
+                    for delay in self._poll_delays():
+                        await asyncio.sleep(delay)
+
+                        status_response = await client.get(request_url)
+                        polls += 1
+                        if status_response.status_code >= 400:
+                            raise RuntimeError(f"Datalab status check failed: {status_response.status_code}")
+
+                        payload = status_response.json()
+                        status_value = str(payload.get("status", "")).lower()
+
+                        if payload.get("success") and status_value not in _PENDING:
+                            break
+                        if status_value in {"completed", "complete", "success"} and payload.get("success") is not False:
+                            break
+                        if status_value in {"failed", "error"} or payload.get("success") is False:
+                            raise RuntimeError(f"Datalab processing failed: {payload.get('error') or payload}")
+
+                        if time.monotonic() > deadline:
+                            raise TimeoutError("Datalab processing timed out.")
+                except BaseException:
+                    self.failed += 1
+                    raise
+
+                self._latencies = (self._latencies + [time.monotonic() - started])[-_LATENCY_WINDOW:]
+                self._polls = (self._polls + [polls])[-_LATENCY_WINDOW:]
+                return payload
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        lat = self._latencies
+        return {
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "latency_s": {
+                "count": len(lat),
+                "p50": _percentile(lat, 0.5),
+                "p95": _percentile(lat, 0.95),
+                "max": max(lat) if lat else None,
+            },
+            "polls_per_conversion": {
+                "p50": _percentile([float(p) for p in self._polls], 0.5),
+                "max": max(self._polls) if self._polls else None,
+            },
+        }
+
+
+datalab_client = DatalabClient()
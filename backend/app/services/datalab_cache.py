@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from app.core.config import settings
+
+# Content-addressed cache of Datalab conversions.
+#
+# One JSON file per (sha256(file), mode, output_format, paginate) under
+# storage/cache/datalab/. A hit touches the file's mtime; the directory is kept
+# under DATALAB_CACHE_MAX_BYTES by deleting the least recently used entries.
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_dir() -> str:
+    return settings.datalab_cache_dir or os.path.join(settings.storage_dir, "cache", "datalab")
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def cache_key(file_hash: str, params: dict) -> str:
+    """Key over the file content and every conversion setting that changes the output."""
+
+    settings_part = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{file_hash}\n{settings_part}".encode("utf-8")).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(cache_dir(), f"{key}.json")
+
+
+def get(key: str) -> list[tuple[int | None, str]] | None:
+    if not settings.datalab_cache_enabled:
+        return None
+    path = _path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        os.utime(path)
+    except (FileNotFoundError, ValueError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return [(p, t) for p, t in payload["pages"]]
+
+
+def put(key: str, pages: list[tuple[int | None, str]], *, params: dict) -> None:
+    if not settings.datalab_cache_enabled:
+        return
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = _path(key)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "created_at": time.time(), "pages": pages}, f)
+    os.replace(tmp, path)
+    _evict()
+
+
+def _evict() -> None:
+    budget = settings.datalab_cache_max_bytes
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir()):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, entry.path))
+        total += st.st_size
+    if total <= budget:
+        return
+    entries.sort()
+    with _lock:
+        for _, size, path in entries:
+            if total <= budget:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            _stats["evictions"] += 1
+
+
+def cache_stats() -> dict:
+    with _lock:
+        out = dict(_stats)
+    out["enabled"] = settings.datalab_cache_enabled
+    out["max_bytes"] = settings.datalab_cache_max_bytes
+    return out
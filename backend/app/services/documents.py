@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+
+from app.core.config import settings
+from app.services import answer_cache, faiss_store, uploads
+from app.services.corpus_index import get_corpus_index
+
+
+def doc_dir(document_id: str) -> str:
+    return os.path.join(settings.storage_dir, "docs", document_id)
+
+
+def list_documents() -> list[dict]:
+    """meta.json of every stored document, newest first."""
+
+    docs_dir = os.path.join(settings.storage_dir, "docs")
+    if not os.path.isdir(docs_dir):
+        return []
+
+    out = []
+    for entry in os.scandir(docs_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            with open(os.path.join(entry.path, "meta.json"), "r", encoding="utf-8") as f:
+                out.append(json.load(f))
+        except Exception:
+            continue
+
+    # newest first when created_at exists
+    out.sort(key=lambda m: m.get("created_at", ""), reverse=True)
+    return out
+
+
+def delete_document(document_id: str) -> bool:
+    """Delete a stored document and everything derived from it. False if unknown."""
+
+    path = doc_dir(document_id)
+    # Held across the whole removal so a concurrent reindex cannot commit in between.
+    with faiss_store.document_lock(document_id):
+        if not os.path.isdir(path):
+            return False
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                sha256 = json.load(f).get("sha256")
+        except (FileNotFoundError, ValueError):
+            sha256 = None
+        shutil.rmtree(path)
+        if sha256:
+            uploads.forget(sha256, document_id)
+        faiss_store.invalidate(document_id)
+        answer_cache.invalidate(document_id)
+        if settings.corpus_index_enabled:
+            get_corpus_index().remove_document(document_id)
+    return True
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Sequence
+
+import numpy as np
+
+
+def estimate_tokens(text: str) -> int:
+    # ~3 chars/token is conservative for English + IDs/tables; we only need an upper-ish bound.
+    return max(1, math.ceil(len(text or "") / 3))
+
+
+def pack_batches(texts: Sequence[str], *, max_tokens: int, max_inputs: int) -> list[tuple[int, int]]:
+    """Split texts into contiguous [start, end) ranges under a token + input budget.
+
+    An input that is over budget on its own still gets a batch to itself; the
+    provider decides whether to truncate or reject it.
+    """
+
+    batches: list[tuple[int, int]] = []
+    start = 0
+    tokens = 0
+    for i, t in enumerate(texts):
+        n = estimate_tokens(t)
+        if i > start and (tokens + n > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _with_retries(
+    fn: Callable[[], np.ndarray],
+    *,
+    max_retries: int,
+    is_retryable: Callable[[Exception], bool],
+    base_delay: float = 0.5,
+    max_delay: float = 20.0,
+) -> np.ndarray:
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            # Exponential backoff with full jitter.
+            delay = min(max_delay, base_delay * (2**attempt))
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+
+def embed_batched(
+    texts: Sequence[str],
+    embed_fn: Callable[[list[str]], np.ndarray],
+    *,
+    max_tokens: int,
+    max_inputs: int,
+    concurrency: int,
+    max_retries: int = 0,
+    is_retryable: Callable[[Exception], bool] = lambda e: False,
+) -> np.ndarray:
+    """Embed texts in token-budgeted batches, `concurrency` requests at a time.
+
+    Results are written into one preallocated C-contiguous float32 matrix in
+    input order, whatever order the batches complete in.
+    """
+
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    batches = pack_batches(texts, max_tokens=max_tokens, max_inputs=max_inputs)
+    out: np.ndarray | None = None
+    lock = threading.Lock()
+
+    def run(rng: tuple[int, int]) -> None:
+        nonlocal out
+        start, end = rng
+        vectors = _with_retries(
+            lambda: embed_fn(texts[start:end]),
+            max_retries=max_retries,
+            is_retryable=is_retryable,
+        )
+        if len(vectors) != end - start:
+            raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {end - start} inputs")
+        block = np.asarray(vectors, dtype=np.float32)
+        with lock:
+            if out is None:
+                out = np.empty((len(texts), block.shape[1]), dtype=np.float32)
+            elif block.shape[1] != out.shape[1]:
+                raise ValueError("Embedding dimension changed between batches")
+        out[start:end] = block
+
+    if len(batches) == 1 or concurrency <= 1:
+        for rng in batches:
+            run(rng)
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+            # list() re-raises the first batch failure.
+            list(pool.map(run, batches))
+
+    assert out is not None
+    return out
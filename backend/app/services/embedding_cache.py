@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embeddings import EmbeddingClient
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    dims INTEGER NOT NULL,
+    text_hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, dims, text_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def _text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, dimensions, sha256(text)).
+
+    Backed by a single SQLite file. Vectors are stored as raw float32 bytes and the
+    file is kept under `max_bytes` by evicting least-recently-used rows.
+    """
+
+    def __init__(self, path: str, *, max_bytes: int) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, model: str, dims: int, hashes: list[bytes]) -> dict[bytes, np.ndarray]:
+        found: dict[bytes, np.ndarray] = {}
+        if not hashes:
+            return found
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite caps bound parameters; 500 per statement stays well under it.
+            for start in range(0, len(unique), 500):
+                part = unique[start : start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND dims = ? AND text_hash IN ({marks})",
+                    (model, dims, *part),
+                ).fetchall()
+                for h, blob in rows:
+                    found[bytes(h)] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND dims = ? AND text_hash = ?",
+                    [(now, model, dims, h) for h in found],
+                )
+        return found
+
+    def put_many(self, model: str, dims: int, items: list[tuple[bytes, np.ndarray]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, dims, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for r in rows:
+                prev = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE model = ? AND dims = ? AND text_hash = ?",
+                    r[:3],
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (model, dims, text_hash, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                    r,
+                )
+                self._bytes += len(r[3]) - (prev[0] if prev else 0)
+            self._conn.execute("COMMIT")
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Trim to 90% of the budget so we don't evict on every insert.
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, dims, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            self._conn.execute("BEGIN")
+            for model, dims, h, size in rows:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE model = ? AND dims = ? AND text_hash = ?",
+                    (model, dims, h),
+                )
+                self._bytes -= size
+                self.evictions += 1
+                if self._bytes <= target:
+                    break
+            self._conn.execute("COMMIT")
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+class CachedEmbeddingClient(EmbeddingClient):
+    """Wraps any EmbeddingClient; only texts missing from the cache hit the backend."""
+
+    def __init__(self, inner: EmbeddingClient, cache: EmbeddingCache) -> None:
+        self.inner = inner
+        self.cache = cache
+        self.backend = inner.backend
+        self.model = inner.model
+        self.dimensions = inner.dimensions
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimensions or 0), dtype=np.float32)
+
+        model = self.inner.model
+        dims = self.inner.dimensions or 0
+        hashes = [_text_hash(t) for t in texts]
+        found = self.cache.get_many(model, dims, hashes)
+
+        # Embed each distinct missing text once, preserving first-seen order.
+        missing: dict[bytes, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+
+        if missing:
+            vectors = np.asarray(self.inner.embed(list(missing.values())), dtype=np.float32)
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(model, dims, fresh)
+            found.update(fresh)
+
+        hit_count = sum(1 for h in hashes if h not in missing)
+        self.cache.record(hit_count, len(hashes) - hit_count)
+
+        out = np.empty((len(hashes), found[hashes[0]].shape[0]), dtype=np.float32)
+        for i, h in enumerate(hashes):
+            out[i] = found[h]
+        return out
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = settings.embedding_cache_path or os.path.join(settings.storage_dir, "cache", "embeddings.sqlite")
+            _cache = EmbeddingCache(path, max_bytes=settings.embedding_cache_max_bytes)
+        return _cache
+
+
+def cache_stats() -> dict | None:
+    return _cache.stats() if _cache is not None else None
@@ -1,32 +1,173 @@
 from __future__ import annotations
 
-from typing import Sequence
+import base64
+import re
+import zlib
+from typing import Callable, Sequence
 
+import numpy as np
+import openai
 from openai import OpenAI
 
 from app.core.config import settings
+from app.services.embedding_batch import embed_batched
 
 
 class EmbeddingClient:
-    def embed(self, texts: Sequence[str]) -> list[list[float]]:
+    # Identify the embedding space; used for cache keys and to query a document
+    # with the same backend it was indexed with.
+    backend: str = ""
+    model: str = ""
+    dimensions: int | None = None
+    # Worth putting behind the persistent embedding cache (remote/slow backends).
+    cacheable: bool = True
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed texts into a C-contiguous float32 matrix of shape (len(texts), dims)."""
         raise NotImplementedError
 
+    def describe(self) -> dict:
+        return {"backend": self.backend, "model": self.model, "dimensions": self.dimensions}
+
+
+_BACKENDS: dict[str, Callable[[], EmbeddingClient]] = {}
+
+
+def register_embedding_backend(name: str):
+    """Register an EmbeddingClient factory under `name` (selected via EMBEDDING_BACKEND)."""
+
+    def deco(factory: Callable[[], EmbeddingClient]):
+        _BACKENDS[name] = factory
+        return factory
+
+    return deco
+
 
+def available_backends() -> list[str]:
+    return sorted(_BACKENDS)
+
+
+def _is_retryable(e: Exception) -> bool:
+    return isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+
+@register_embedding_backend("openai")
 class OpenAIEmbeddingClient(EmbeddingClient):
+    backend = "openai"
+
     def __init__(self) -> None:
         if not settings.openai_api_key:
             raise RuntimeError("OPENAI_API_KEY not set")
-        self._client = OpenAI(api_key=settings.openai_api_key)
+        # Retries are handled per batch in embed_batched (backoff + jitter).
+        self._client = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url, max_retries=0)
+        self.model = settings.openai_embedding_model
+        self.dimensions = settings.openai_embedding_dimensions
 
-    def embed(self, texts: Sequence[str]) -> list[list[float]]:
-        # OpenAI embeddings API returns data in order.
+    def _embed_once(self, texts: list[str]) -> np.ndarray:
+        extra = {"dimensions": self.dimensions} if self.dimensions else {}
+        # OpenAI embeddings API returns data in order. base64 carries the raw float32
+        # bytes, decoded straight into the matrix (no JSON floats, no Python lists).
         res = self._client.embeddings.create(
-            model=settings.openai_embedding_model,
-            input=list(texts),
+            model=self.model,
+            input=texts,
+            encoding_format="base64",
+            **extra,
+        )
+        return np.vstack([np.frombuffer(base64.b64decode(d.embedding), dtype=np.float32) for d in res.data])
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Token-budgeted, concurrent embedding into a contiguous float32 matrix."""
+        return embed_batched(
+            texts,
+            self._embed_once,
+            max_tokens=settings.embedding_batch_max_tokens,
+            max_inputs=settings.embedding_batch_max_inputs,
+            concurrency=settings.embedding_concurrency,
+            max_retries=settings.embedding_max_retries,
+            is_retryable=_is_retryable,
         )
-        return [d.embedding for d in res.data]
 
 
-def get_embedding_client() -> EmbeddingClient:
-    # For the POC we keep it simple: OpenAI embeddings when configured.
-    return OpenAIEmbeddingClient()
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+@register_embedding_backend("hashing")
+class HashingEmbeddingClient(EmbeddingClient):
+    """Offline, deterministic embeddings: hashed word + char n-gram features.
+
+    Features are hashed (crc32) into `dim` buckets with a sign bit, tf is damped
+    with log1p and rows are L2-normalized. No network, no model files, so it is
+    a reproducible baseline and works when the provider is unavailable.
+    """
+
+    backend = "hashing"
+    cacheable = False
+
+    def __init__(self, dim: int | None = None, ngram_range: tuple[int, int] = (3, 4)) -> None:
+        self.dim = dim or settings.hashing_embedding_dim
+        self.ngram_range = ngram_range
+        self.model = f"hashing-crc32-w1-c{ngram_range[0]}{ngram_range[1]}"
+        self.dimensions = self.dim
+
+    def _features(self, text: str) -> list[tuple[str, float]]:
+        lo, hi = self.ngram_range
+        feats: list[tuple[str, float]] = []
+        for w in _WORD_RE.findall((text or "").lower()):
+            feats.append(("w:" + w, 1.0))
+            padded = f" {w} "
+            for n in range(lo, hi + 1):
+                for i in range(len(padded) - n + 1):
+                    feats.append(("c:" + padded[i : i + n], 0.5))
+        return feats
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        dim = self.dim
+        buckets: dict[str, int] = {}
+        flat: list[int] = []
+        weights: list[float] = []
+
+        for row, t in enumerate(texts):
+            base = row * dim
+            for f, w in self._features(t):
+                h = buckets.get(f)
+                if h is None:
+                    h = zlib.crc32(f.encode("utf-8"))
+                    buckets[f] = h
+                flat.append(base + (h % dim))
+                weights.append(w if h & 0x80000000 else -w)
+
+        out = np.bincount(
+            np.asarray(flat, dtype=np.int64),
+            weights=np.asarray(weights, dtype=np.float64),
+            minlength=len(texts) * dim,
+        ).reshape(len(texts), dim)
+        out = (np.sign(out) * np.log1p(np.abs(out))).astype(np.float32)
+        out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-9
+        return out
+
+
+def _resolve_backend(name: str) -> str:
+    if name == "auto":
+        # Degraded mode: without provider credentials fall back to the local backend.
+        return "openai" if settings.openai_api_key else "hashing"
+    return name
+
+
+def get_embedding_client(backend: str | None = None) -> EmbeddingClient:
+    """Build the configured embedding client.
+
+    Pass `backend` to query a document with the backend it was indexed with.
+    """
+
+    name = _resolve_backend(backend or settings.embedding_backend)
+    factory = _BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown embedding backend {name!r} (available: {', '.join(available_backends())})")
+    client = factory()
+
+    if settings.embedding_cache_enabled and client.cacheable:
+        from app.services.embedding_cache import CachedEmbeddingClient, get_embedding_cache
+
+        client = CachedEmbeddingClient(client, get_embedding_cache())
+    return client
@@ -3,10 +3,10 @@ from __future__ import annotations
 import json
 import os
 
-from openai import OpenAI
-
 from app.core.config import settings
-from app.services.rag import retrieve
+from app.services import context_packer
+from app.services.llm import get_chat_client
+from app.services.rag import embed_questions, retrieve_batch
 
 
 SHIPMENT_SCHEMA = {
@@ -70,6 +70,85 @@ SCHEMAS = {
 }
 
 
+# Fields are retrieved per group with a short targeted query instead of one broad
+# "extract all fields" query; unknown fields fall into their own group.
+FIELD_GROUPS = {
+    "identifiers": (
+        "reference, load, shipment, PO, container, invoice and packing list numbers",
+        ["shipment_id", "reference_id", "load_id", "po_number", "container_id", "invoice_number", "packing_list_number"],
+    ),
+    "parties": (
+        "shipper, consignee, carrier, bill to and remit to names and addresses",
+        ["shipper", "consignee", "carrier_name", "bill_to", "remit_to"],
+    ),
+    "contacts": (
+        "dispatcher name, phone and email",
+        ["dispatcher_name", "dispatcher_phone", "dispatcher_email"],
+    ),
+    "dates": (
+        "pickup, delivery, booking, invoice and due dates and times",
+        ["pickup_datetime", "delivery_datetime", "booking_date", "invoice_date", "due_date"],
+    ),
+    "amounts": (
+        "rate, agreed amount, subtotal, tax, total and currency",
+        ["rate", "agreed_amount", "currency", "subtotal", "tax", "total"],
+    ),
+    "freight": (
+        "equipment type, mode, weight, packages and units",
+        ["equipment_type", "mode", "weight", "total_packages", "total_weight", "weight_unit"],
+    ),
+}
+
+
+def _field_group_queries(schema_keys: list[str]) -> list[tuple[str, list[str]]]:
+    """(query, fields) for every group that has fields in the schema."""
+
+    out = []
+    grouped: set[str] = set()
+    for description, fields in FIELD_GROUPS.values():
+        present = [f for f in fields if f in schema_keys]
+        grouped.update(present)
+        if present:
+            out.append((description, present))
+    for f in schema_keys:
+        if f not in grouped:
+            out.append((f.replace("_", " "), [f]))
+    return out
+
+
+def _retrieve_for_fields(document_id: str, schema_keys: list[str]) -> tuple[list[dict], int]:
+    """Union of the top chunks for each field group, deduplicated, best groups first.
+
+    All group queries are embedded in one call and searched with one multi-row
+    index search. Chunks are interleaved by rank across groups so every group
+    is represented before any group gets its second chunk. Also returns how many
+    leading chunks are some group's top hit.
+    """
+
+    groups = _field_group_queries(schema_keys)
+    queries = [q for q, _ in groups]
+    embeddings = embed_questions(document_id, queries)
+    per_group = retrieve_batch(document_id, queries, embeddings, top_k=settings.extract_group_top_k)
+
+    by_row: dict[int, dict] = {}
+    order: list[int] = []
+    leaders = 0
+    for rank in range(settings.extract_group_top_k):
+        if rank == 1:
+            leaders = len(order)
+        for (_, fields), (sources, _) in zip(groups, per_group):
+            if rank >= len(sources):
+                continue
+            s = sources[rank]
+            if s["row"] not in by_row:
+                by_row[s["row"]] = {**s, "fields": []}
+                order.append(s["row"])
+            by_row[s["row"]]["fields"].extend(f for f in fields if f not in by_row[s["row"]]["fields"])
+    if settings.extract_group_top_k <= 1:
+        leaders = len(order)
+    return [by_row[r] for r in order], leaders
+
+
 def _load_doc_meta(document_id: str) -> dict:
     path = os.path.join(settings.storage_dir, "docs", document_id, "meta.json")
     if not os.path.exists(path):
@@ -111,12 +190,22 @@ def extract_structured(document_id: str, *, force: bool = False) -> dict:
         except Exception:
             pass
 
-    # Retrieve with a broad query to get likely relevant chunks.
-    field_list = ", ".join(schema.keys())
-    query = f"Extract the following fields: {field_list}"
-    sources, sims = retrieve(document_id, query, top_k=10)
+    # Targeted retrieval per field group, packed into a bounded context.
+    # Rerank scores of different group queries don't compare: rank by interleaved
+    # position instead, and take every group's top chunk before MMR fills the rest.
+    sources, leaders = _retrieve_for_fields(document_id, schema_keys)
+    packed = context_packer.pack(
+        sources,
+        max_tokens=settings.extract_context_max_tokens,
+        mmr_lambda=settings.context_mmr_lambda,
+        show_similarity=False,
+        relevance=[1.0 - i / max(1, len(sources)) for i in range(len(sources))],
+        pinned=leaders,
+    )
+    context = packed.text
 
-    if not settings.openai_api_key:
+    llm = get_chat_client()
+    if llm is None:
         # Return empty schema with some helpful debug for reviewers.
         out = {
             "_document_type": doc_type,
@@ -134,15 +223,6 @@ def extract_structured(document_id: str, *, force: bool = False) -> dict:
             pass
         return out
 
-    client = OpenAI(api_key=settings.openai_api_key)
-
-    context = "\n\n".join(
-        [
-            f"[Source {s['rank']} | page={s['page_num']}]\n{s['text']}"
-            for s in sources[: min(8, len(sources))]
-        ]
-    )
-
     system = (
         "You are extracting structured shipment data from logistics documents. "
         "Return STRICT JSON only. "
@@ -156,17 +236,14 @@ def extract_structured(document_id: str, *, force: bool = False) -> dict:
         f"Sources:\n{context}"
     )
 
-    completion = client.chat.completions.create(
-        model=settings.openai_model,
-        messages=[
+    raw = llm.complete(
+        [
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
         temperature=0.0,
-        response_format={"type": "json_object"},
-    )
-
-    raw = completion.choices[0].message.content or "{}"
+        json_mode=True,
+    ) or "{}"
     try:
         data = json.loads(raw)
     except Exception:
@@ -177,6 +254,12 @@ def extract_structured(document_id: str, *, force: bool = False) -> dict:
     out["_document_type"] = doc_type
     out["_schema_keys"] = schema_keys
     out["_cached"] = False
+    out["_context"] = {
+        "chunks": len(packed.sources),
+        "blocks": len(packed.blocks),
+        "candidates": len(sources),
+        "tokens": packed.tokens,
+    }
 
     # Persist extraction result for reuse
     try:
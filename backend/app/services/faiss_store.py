@@ -2,13 +2,27 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import asdict
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
 
 import faiss
 import numpy as np
 
 from app.core.config import settings
 from app.core.types import Chunk
+from app.services import bm25, chunk_store
+from app.services.bm25 import BM25Index
+from app.services.chunk_store import ChunkStore
+from app.services.index_factory import (
+    LOSSY_TYPES,
+    build_index,
+    choose_index_type,
+    configure_search,
+    trainable_type,
+)
 
 
 def _doc_dir(document_id: str) -> str:
@@ -19,68 +33,398 @@ def _index_path(document_id: str) -> str:
     return os.path.join(_doc_dir(document_id), "index.faiss")
 
 
-def _meta_path(document_id: str) -> str:
-    return os.path.join(_doc_dir(document_id), "chunks_meta.jsonl")
+def _index_info_path(document_id: str) -> str:
+    return os.path.join(_doc_dir(document_id), "index.json")
+
+
+def _vectors_path(document_id: str) -> str:
+    # Raw normalized vectors, kept for non-flat indexes (exact rescoring, recall evals, rebuilds).
+    return os.path.join(_doc_dir(document_id), "vectors.npy")
 
 
 def _normalize(v: np.ndarray) -> np.ndarray:
-    # Normalize rows for cosine similarity via inner product
-    norms = np.linalg.norm(v, axis=1, keepdims=True) + 1e-9
-    return v / norms
+    # Normalize rows in place for cosine similarity via inner product
+    # (v must be a writable C-contiguous float32 matrix).
+    faiss.normalize_L2(v)
+    return v
+
+
+class _LoadedDoc:
+    __slots__ = ("index", "index_type", "vectors", "store", "bm25", "nbytes", "signature")
+
+    def __init__(
+        self,
+        index,
+        index_type: str,
+        vectors: np.ndarray | None,
+        store: ChunkStore,
+        bm25_index: BM25Index,
+        signature: tuple,
+        index_bytes: int,
+    ) -> None:
+        self.index = index
+        self.index_type = index_type
+        self.vectors = vectors  # memory-mapped, paged in on demand
+        self.store = store
+        self.bm25 = bm25_index
+        self.signature = signature
+        # Rough footprint: serialized index size + chunk record index + postings.
+        self.nbytes = index_bytes + store.nbytes + bm25_index.nbytes
+
+
+class IndexCache:
+    """Process-wide LRU of loaded FAISS indexes + opened chunk stores.
+
+    Bounded by an approximate byte budget. Entries are keyed by document_id and
+    validated against the on-disk file signature (mtime/size), so a document that
+    was re-persisted by another worker is reloaded instead of served stale.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _LoadedDoc] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, document_id: str, signature: tuple) -> _LoadedDoc | None:
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is None or entry.signature != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(document_id)
+            self.hits += 1
+            return entry
+
+    def put(self, document_id: str, entry: _LoadedDoc) -> None:
+        with self._lock:
+            old = self._entries.pop(document_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                # Larger than the whole budget: serve it once, don't cache.
+                return
+            self._entries[document_id] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, document_id: str) -> None:
+        with self._lock:
+            old = self._entries.pop(document_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+_cache = IndexCache(settings.index_cache_max_bytes)
+
+# commit() holds a document's lock while rewriting its files; cold loads take it too,
+# so a reader never pairs a new index with an old chunk store (or vice versa).
+# Locks are per document: one document's commit never blocks another's queries.
+_locks_guard = threading.Lock()
+_document_locks: weakref.WeakValueDictionary[str, threading.RLock] = weakref.WeakValueDictionary()
+
+
+def document_lock(document_id: str) -> threading.RLock:
+    """Lock serializing writes (and cold loads) of one document's files."""
+    with _locks_guard:
+        lock = _document_locks.get(document_id)
+        if lock is None:
+            lock = threading.RLock()
+            _document_locks[document_id] = lock
+        return lock
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
 
 
-def persist(document_id: str, *, chunks: list[Chunk], embeddings: list[list[float]]):
-    os.makedirs(_doc_dir(document_id), exist_ok=True)
+def invalidate(document_id: str) -> None:
+    """Drop a document from the in-process cache (call after re-persist/delete)."""
+    _cache.invalidate(document_id)
 
-    emb = np.asarray(embeddings, dtype=np.float32)
-    if emb.ndim != 2 or emb.shape[0] != len(chunks):
-        raise ValueError("Embeddings shape mismatch")
 
-    emb = _normalize(emb)
-    dim = emb.shape[1]
+def _file_signature(*paths: str) -> tuple:
+    sig = []
+    for p in paths:
+        st = os.stat(p)
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
 
-    # Flat index is plenty for POC. Swap to IVFFlat/HNSW later if needed.
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb)
-    faiss.write_index(index, _index_path(document_id))
 
-    # Persist chunk metadata in the same order as vectors in the index.
-    with open(_meta_path(document_id), "w", encoding="utf-8") as f:
-        for c in chunks:
-            f.write(json.dumps(asdict(c), ensure_ascii=False) + "\n")
+def index_signature(document_id: str) -> tuple | None:
+    """mtime/size of the index files; changes whenever the document is re-persisted. None if absent."""
+    _, idx_path, _ = chunk_store.store_paths(document_id)
+    try:
+        return _file_signature(_index_path(document_id), idx_path)
+    except FileNotFoundError:
+        return None
 
 
-def query(document_id: str, query_embedding: list[float], *, top_k: int):
+def missing_artifacts(document_id: str) -> list[str]:
+    """Names of the files a query needs that are not on disk (empty == queryable)."""
+    missing = []
+    if not os.path.isdir(_doc_dir(document_id)):
+        missing.append("doc_dir")
+    if not os.path.exists(_index_path(document_id)):
+        missing.append("index.faiss")
+    if not chunk_store.exists(document_id) and not os.path.exists(chunk_store.legacy_path(document_id)):
+        missing.append("chunk_store")
+    return missing
+
+
+def _load(document_id: str) -> _LoadedDoc | None:
     ipath = _index_path(document_id)
-    mpath = _meta_path(document_id)
-    if not os.path.exists(ipath) or not os.path.exists(mpath):
-        return []
+    if not os.path.exists(ipath):
+        return None
+
+    # Storage dirs written before the binary chunk store are migrated on first read.
+    if not chunk_store.exists(document_id) and not chunk_store.migrate_legacy(document_id):
+        return None
+
+    _, idx_path, _ = chunk_store.store_paths(document_id)
+    try:
+        signature = _file_signature(ipath, idx_path)
+    except FileNotFoundError:
+        return None
+
+    entry = _cache.get(document_id, signature)
+    if entry is not None:
+        return entry
 
+    with document_lock(document_id):
+        try:
+            signature = _file_signature(ipath, idx_path)
+        except FileNotFoundError:
+            return None
+        return _load_files(document_id, signature)
+
+
+def _load_files(document_id: str, signature: tuple) -> _LoadedDoc:
+    ipath = _index_path(document_id)
+    info = _read_index_info(document_id)
+    index_type = info.get("type", "flat")
     index = faiss.read_index(ipath)
+    configure_search(index, index_type)
+
+    vpath = _vectors_path(document_id)
+    vectors = np.load(vpath, mmap_mode="r") if os.path.exists(vpath) else None
+
+    store = ChunkStore(document_id)
+    lexical = BM25Index.load(_doc_dir(document_id))
+    if lexical is None:
+        # Documents indexed before BM25 existed get their postings built on first read.
+        _build_bm25(document_id, store)
+        lexical = BM25Index.load(_doc_dir(document_id))
+
+    entry = _LoadedDoc(index, index_type, vectors, store, lexical, signature, os.path.getsize(ipath))
+    _cache.put(document_id, entry)
+    return entry
+
+
+def _build_bm25(document_id: str, store: ChunkStore) -> None:
+    # Index chunk bodies only: the shared metadata prefix is identical in every chunk.
+    bm25.save(_doc_dir(document_id), bm25.build(store.body(i) for i in range(len(store))))
+
+
+def _read_index_info(document_id: str) -> dict:
+    path = _index_info_path(document_id)
+    if not os.path.exists(path):
+        # Indexes persisted before index.json existed are all flat.
+        return {"type": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def persist(
+    document_id: str,
+    *,
+    chunks: list[Chunk],
+    embeddings: np.ndarray,
+    embedding: dict | None = None,
+):
+    writer = DocumentWriter(document_id, chunks[0].meta if chunks else None, embedding=embedding)
+    try:
+        writer.append(chunks, embeddings)
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class DocumentWriter:
+    """Builds a document's index + chunk store from batches of (chunks, embeddings).
+
+    Normalized vectors are spooled to disk as they arrive, so only the current batch
+    is held in memory until commit() builds the index from the (memory-mapped)
+    spool and swaps all files in.
+    """
+
+    def __init__(self, document_id: str, meta: dict | None, *, embedding: dict | None = None) -> None:
+        os.makedirs(_doc_dir(document_id), exist_ok=True)
+        self.document_id = document_id
+        self._store = chunk_store.ChunkStoreWriter(document_id, meta, embedding=embedding)
+        self._spool_path = os.path.join(_doc_dir(document_id), f"vectors.{uuid.uuid4().hex}.tmp")
+        self._spool = open(self._spool_path, "wb")
+        self._dim: int | None = None
+        self._count = 0
 
-    q = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
-    q = _normalize(q)
+    def __len__(self) -> int:
+        return self._count
 
-    scores, idxs = index.search(q, top_k)
-    scores = scores.reshape(-1).tolist()
-    idxs = idxs.reshape(-1).tolist()
+    def append(self, chunks: list[Chunk], embeddings: np.ndarray) -> None:
+        """Append a batch. `embeddings` is normalized in place when it is already float32."""
 
-    # Load metadata lines into a list (POC). For huge docs, use sqlite/offsets.
-    metas: list[dict] = []
-    with open(mpath, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                metas.append(json.loads(line))
+        emb = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not emb.flags.writeable:
+            emb = emb.copy()
+        if emb.ndim != 2 or emb.shape[0] != len(chunks):
+            raise ValueError("Embeddings shape mismatch")
+        if not len(chunks):
+            return
+        if self._dim is None:
+            self._dim = int(emb.shape[1])
+        elif emb.shape[1] != self._dim:
+            raise ValueError("Embeddings shape mismatch")
+
+        self._spool.write(memoryview(_normalize(emb)).cast("B"))
+        self._store.append(chunks)
+        self._count += len(chunks)
+
+    def commit(self) -> None:
+        self._spool.close()
+        n, dim = self._count, self._dim or 0
+        if not n:
+            raise ValueError("Embeddings shape mismatch")
+        emb = np.memmap(self._spool_path, dtype=np.float32, mode="r", shape=(n, dim))
+
+        requested = settings.index_type
+        index_type = choose_index_type(n, dim) if requested == "auto" else trainable_type(requested, n)
+        index, params = build_index(emb, index_type)
+
+        with document_lock(self.document_id):
+            ipath = _index_path(self.document_id)
+            tmp = f"{ipath}.{uuid.uuid4().hex}.tmp"
+            faiss.write_index(index, tmp)
+            os.replace(tmp, ipath)
+
+            info_path = _index_info_path(self.document_id)
+            tmp = f"{info_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"type": index_type, "requested": requested, "params": params, "ntotal": int(n), "dim": int(dim)},
+                    f,
+                    indent=2,
+                )
+            os.replace(tmp, info_path)
+
+            vpath = _vectors_path(self.document_id)
+            if index_type != "flat":
+                # Cached entries memory-map the current file: never truncate it in place.
+                tmp = f"{vpath}.{uuid.uuid4().hex}.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, emb)
+                os.replace(tmp, vpath)
+            elif os.path.exists(vpath):
+                os.remove(vpath)
+
+            # Chunk metadata in the same order as vectors in the index.
+            self._store.close()
+            _build_bm25(self.document_id, ChunkStore(self.document_id))
+
+            invalidate(self.document_id)
+
+        del emb
+        os.remove(self._spool_path)
+
+    def abort(self) -> None:
+        self._spool.close()
+        self._store.abort()
+        try:
+            os.remove(self._spool_path)
+        except FileNotFoundError:
+            pass
+
+
+def embedding_info(document_id: str) -> dict | None:
+    """Embedding space the document was indexed with (None for legacy/unknown)."""
+    loaded = _load(document_id)
+    if loaded is None:
+        return None
+    return loaded.store.embedding
+
+
+def load_vectors(document_id: str) -> np.ndarray | None:
+    """Normalized vectors of a document in row order (None if not ingested)."""
+    loaded = _load(document_id)
+    if loaded is None:
+        return None
+    if loaded.vectors is not None:
+        return loaded.vectors
+    return loaded.index.reconstruct_n(0, loaded.index.ntotal)
+
+
+def get_chunk(document_id: str, row: int) -> dict | None:
+    """Chunk record (asdict(Chunk) shape) for a vector row."""
+    loaded = _load(document_id)
+    if loaded is None or row < 0 or row >= len(loaded.store):
+        return None
+    return loaded.store.get(row)
+
+
+def get_store(document_id: str) -> ChunkStore | None:
+    loaded = _load(document_id)
+    return loaded.store if loaded is not None else None
+
+
+def get_bm25(document_id: str) -> BM25Index | None:
+    loaded = _load(document_id)
+    return loaded.bm25 if loaded is not None else None
+
+
+def score_rows(document_id: str, query_embedding, rows: list[int]) -> list[dict]:
+    """Exact cosine similarity + chunk fields for specific vector rows (e.g. lexical-only hits)."""
+
+    loaded = _load(document_id)
+    if loaded is None or not rows:
+        return []
+    q = _normalize(np.array(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+    if loaded.vectors is not None:
+        vecs = np.asarray(loaded.vectors[rows], dtype=np.float32)
+    else:
+        vecs = np.vstack([loaded.index.reconstruct(int(r)) for r in rows])
+    sims = vecs @ q
 
     out = []
-    rank = 1
-    for sim, i in zip(scores, idxs):
-        if i is None or i < 0 or i >= len(metas):
-            continue
-        m = metas[i]
+    for r, sim in zip(rows, sims.tolist()):
+        m = loaded.store.get(int(r))
         out.append(
             {
-                "rank": rank,
+                "rank": None,
+                "row": int(r),
                 "similarity": float(sim),
                 "page_num": m.get("page_num"),
                 "chunk_index": m.get("chunk_index"),
@@ -89,6 +433,127 @@ def query(document_id: str, query_embedding: list[float], *, top_k: int):
                 "chunk_meta": m.get("meta"),
             }
         )
-        rank += 1
+    return out
+
+
+def query(document_id: str, query_embedding: np.ndarray | list[float], *, top_k: int):
+    return query_batch(document_id, [query_embedding], top_k=top_k)[0]
+
+
+def query_batch(document_id: str, query_embeddings, *, top_k: int) -> list[list[dict]]:
+    """Top-k sources for several queries with a single multi-row index search."""
+
+    if len(query_embeddings) == 0:
+        return []
+    loaded = _load(document_id)
+    if loaded is None:
+        return [[] for _ in range(len(query_embeddings))]
+
+    index = loaded.index
+    store = loaded.store
+    n = len(store)
+
+    # Copy: the caller's query embeddings are reused (caches, fusion).
+    q = _normalize(np.array(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+
+    if loaded.index_type in LOSSY_TYPES and loaded.vectors is not None:
+        # Compressed codes only approximate cosine: over-fetch, then rescore exactly
+        # so similarities (and the guardrail) mean the same thing for every index type.
+        _, cand = index.search(q, top_k * 4)
+        scores_rows, idxs_rows = [], []
+        for qi, c in enumerate(cand):
+            c = c[c >= 0]
+            exact = loaded.vectors[c] @ q[qi]
+            order = np.argsort(-exact)[:top_k]
+            scores_rows.append(exact[order].tolist())
+            idxs_rows.append(c[order].tolist())
+    else:
+        scores, idxs = index.search(q, top_k)
+        scores_rows, idxs_rows = scores.tolist(), idxs.tolist()
+
+    results = []
+    for scores, idxs in zip(scores_rows, idxs_rows):
+        out = []
+        rank = 1
+        for sim, i in zip(scores, idxs):
+            if i is None or i < 0 or i >= n:
+                continue
+            m = store.get(i)
+            out.append(
+                {
+                    "rank": rank,
+                    "row": int(i),
+                    "similarity": float(sim),
+                    "page_num": m.get("page_num"),
+                    "chunk_index": m.get("chunk_index"),
+                    "text": m.get("text"),
+                    "chunk_id": m.get("id"),
+                    "chunk_meta": m.get("meta"),
+                }
+            )
+            rank += 1
+        results.append(out)
+
+    return results
+
+
+def evaluate_index(document_id: str, *, top_k: int = 10, sample: int = 200, compare: bool = False) -> dict | None:
+    """Recall@k and per-query latency of the document's index vs. an exact flat baseline.
+
+    Queries are stored chunk vectors (a deterministic sample). With `compare`, every
+    index type is built on the fly and reported side by side.
+    """
+
+    from app.services.index_factory import INDEX_TYPES
+
+    loaded = _load(document_id)
+    if loaded is None:
+        return None
+    vectors = np.ascontiguousarray(load_vectors(document_id), dtype=np.float32)
+    n = vectors.shape[0]
+    k = min(top_k, n)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, size=min(sample, n), replace=False)]
+
+    def timed_search(index, index_type: str) -> tuple[np.ndarray, float]:
+        out = np.empty((len(queries), k), dtype=np.int64)
+        start = time.perf_counter()
+        for i, q in enumerate(queries):
+            if index_type in LOSSY_TYPES:
+                _, cand = index.search(q.reshape(1, -1), k * 4)
+                cand = cand[0][cand[0] >= 0]
+                out[i] = cand[np.argsort(-(vectors[cand] @ q))[:k]]
+            else:
+                out[i] = index.search(q.reshape(1, -1), k)[1][0]
+        return out, (time.perf_counter() - start) * 1000 / len(queries)
+
+    baseline = faiss.IndexFlatIP(vectors.shape[1])
+    baseline.add(vectors)
+    truth, flat_ms = timed_search(baseline, "flat")
+
+    def report(index, index_type: str) -> dict:
+        found, ms = timed_search(index, index_type)
+        hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(found, truth))
+        return {"index_type": index_type, "recall_at_k": hits / truth.size, "latency_ms": ms}
 
+    out = {
+        "document_id": document_id,
+        "num_vectors": int(n),
+        "top_k": k,
+        "queries": int(len(queries)),
+        "flat_latency_ms": flat_ms,
+        "current": report(loaded.index, loaded.index_type),
+    }
+    if compare:
+        candidates = []
+        for t in INDEX_TYPES:
+            try:
+                index, _ = build_index(vectors, t)
+            except RuntimeError as e:
+                # e.g. too few vectors to train PQ codebooks
+                candidates.append({"index_type": t, "error": str(e)})
+                continue
+            configure_search(index, t)
+            candidates.append(report(index, t))
+        out["candidates"] = candidates
     return out
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import math
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+
+# Per-document index types. All use inner product on L2-normalized vectors (== cosine).
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# Types whose search scores are approximations of the true inner product.
+LOSSY_TYPES = {"ivf_pq"}
+
+# PQ codebooks have 256 centroids; faiss wants ~39 training points per centroid.
+_PQ_MIN_TRAIN = 256 * 39
+# Fewer vectors than this don't fill a single IVF list.
+_IVF_MIN_TRAIN = 39
+
+
+def _nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid.
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _pq_m(dim: int) -> int:
+    # Largest sub-quantizer count <= 64 that divides dim with >= 4 dims per sub-vector.
+    for m in range(min(64, dim // 4), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def estimate_bytes(index_type: str, n: int, dim: int) -> int:
+    raw = n * dim * 4
+    if index_type == "flat":
+        return raw
+    if index_type == "hnsw":
+        # level-0 links (2*M) + upper levels, int32 each
+        return raw + n * settings.hnsw_m * 2 * 4 * 5 // 4
+    if index_type == "ivf_flat":
+        return raw + n * 8 + _nlist(n) * dim * 4
+    if index_type == "ivf_pq":
+        return n * (_pq_m(dim) + 8) + _nlist(n) * dim * 4 + 256 * dim * 4
+    raise ValueError(f"Unknown index type {index_type!r}")
+
+
+def choose_index_type(n: int, dim: int, *, memory_budget_bytes: int | None = None) -> str:
+    """Pick an index type from chunk count and memory budget.
+
+    Small documents stay exact. Large ones get HNSW when it fits the budget,
+    otherwise IVF-Flat, and IVF-PQ when even raw vectors don't fit.
+    """
+
+    budget = memory_budget_bytes or settings.index_memory_budget_bytes
+    if n < settings.ann_min_vectors:
+        return "flat"
+    if estimate_bytes("hnsw", n, dim) <= budget:
+        return "hnsw"
+    if estimate_bytes("ivf_flat", n, dim) <= budget or n < _PQ_MIN_TRAIN:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def trainable_type(index_type: str, n: int) -> str:
+    """`index_type`, or the closest type that can be trained on `n` vectors.
+
+    Applies to explicit INDEX_TYPE values too: PQ training fails outright below 256
+    vectors, so small documents must not take the whole ingest down with it.
+    """
+
+    if index_type == "ivf_pq" and n < _PQ_MIN_TRAIN:
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and n < _IVF_MIN_TRAIN:
+        index_type = "flat"
+    return index_type
+
+
+def build_index(vectors: np.ndarray, index_type: str) -> tuple[faiss.Index, dict]:
+    """Build + fill an index of `index_type` from normalized vectors. Returns (index, params)."""
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+        params: dict = {}
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+        params = {"M": settings.hnsw_m, "efConstruction": settings.hnsw_ef_construction}
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(n)
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            params = {"nlist": nlist}
+        else:
+            m = _pq_m(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+            params = {"nlist": nlist, "m": m, "nbits": 8}
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}")
+
+    index.add(vectors)
+    return index, params
+
+
+def configure_search(index: faiss.Index, index_type: str) -> None:
+    """Apply query-time knobs (nprobe / efSearch) from settings."""
+
+    if index_type == "hnsw":
+        index.hnsw.efSearch = settings.hnsw_ef_search
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = settings.ivf_nprobe
@@ -1,17 +1,50 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
 import os
 import shutil
+import threading
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from typing import AsyncContextManager, Callable
+
+import numpy as np
 
 from app.core.config import settings
-from app.services.chunking import chunk_pages
+from app.core.types import Chunk
+from app.services.chunking import iter_chunks
+from app.services.documents import delete_document
 from app.services.embeddings import get_embedding_client
-from app.services.metadata import build_metadata_prefix, detect_document_type, extract_global_identifiers
-from app.services.text_extract import extract_text
-from app.services.faiss_store import persist
+from app.services.metadata import IDENTIFIER_KEYS, MetadataScanner, build_metadata_prefix
+from app.services.text_extract import iter_text
+from app.services.faiss_store import DocumentWriter
+from app.services.corpus_index import get_corpus_index
+from app.services import answer_cache, faiss_store, uploads
+
+
+StageHook = Callable[[str], AsyncContextManager]
+
+
+@asynccontextmanager
+async def _no_stage(name: str):
+    yield None
+
+
+async def _run_blocking(fn, *args, on_cancel: Callable[[], None] | None = None, **kwargs):
+    """asyncio.to_thread, but a cancelled caller still waits for the thread to finish,
+    so cleanup never races a half-written index. `on_cancel` is called first so
+    long-running `fn`s can stop early."""
+    fut = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        if on_cancel is not None:
+            on_cancel()
+        await asyncio.wait({fut})
+        raise
 
 
 def _ensure_dirs():
@@ -20,57 +53,351 @@ def _ensure_dirs():
     os.makedirs(os.path.join(settings.storage_dir, "docs"), exist_ok=True)
 
 
-async def ingest_document(*, file_path: str, filename: str, mime: str | None) -> dict:
+def _with_metadata(chunks, global_meta: dict):
+    # Metadata injection into chunk text (improves retrieval even without DB filters)
+    prefix = build_metadata_prefix(global_meta)
+    for c in chunks:
+        c.meta = global_meta
+        if prefix:
+            c.text = prefix + c.text
+        yield c
+
+
+def _iter_chunks(document_id: str, pages):
+    return iter_chunks(
+        document_id, pages, max_chars=settings.chunk_max_chars, overlap_chars=settings.chunk_overlap_chars
+    )
+
+
+# Streaming ingestion: extracted pages are spooled to a jsonl file while the
+# metadata scanner sees them (the prefix must be known before any chunk is
+# embedded). The chunk stage re-reads them lazily into a chunk spool, which the
+# embed stage reads back and embeds/appends batch by batch.
+
+def _spool_page(f, scanner: MetadataScanner, page: tuple[int | None, str]) -> None:
+    scanner.feed(page[1])
+    f.write(json.dumps(page, ensure_ascii=False) + "\n")
+
+
+def _read_spool(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            page_num, text = json.loads(line)
+            yield page_num, text
+
+
+def _spool_chunks(document_id: str, pages_path: str, chunks_path: str) -> int:
+    n = 0
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        for c in _iter_chunks(document_id, _read_spool(pages_path)):
+            f.write(json.dumps([c.id, c.page_num, c.chunk_index, c.text], ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def _read_chunk_spool(document_id: str, path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            cid, page_num, chunk_index, text = json.loads(line)
+            yield Chunk(id=cid, document_id=document_id, text=text, page_num=page_num, chunk_index=chunk_index)
+
+
+def _add_to_corpus(document_id: str, embedding: dict) -> None:
+    get_corpus_index().add_document(document_id, faiss_store.load_vectors(document_id), embedding=embedding)
+
+
+def _embed_into(
+    writer: DocumentWriter,
+    embedder,
+    chunks,
+    *,
+    reuse: dict[str, int] | None = None,
+    vectors=None,
+    cancel: threading.Event | None = None,
+) -> int:
+    """Embed chunks in batches of INGEST_EMBED_BATCH_CHUNKS and append them to `writer`.
+
+    With `reuse` ({text hash: row in `vectors`}) chunks whose embedded text is
+    unchanged keep their stored vector. Stops between batches once `cancel` is set
+    (the caller is being cancelled and discards the writer). Returns the number of
+    chunks embedded.
+    """
+
+    batch_size = max(1, settings.ingest_embed_batch_chunks)
+    embedded = 0
+
+    def flush(batch: list[Chunk]) -> None:
+        nonlocal embedded
+        rows = [reuse.get(_text_hash(c.text)) for c in batch] if reuse else [None] * len(batch)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if len(missing) == len(batch):
+            emb = np.asarray(embedder.embed([c.text for c in batch]), dtype=np.float32)
+        else:
+            emb = np.empty((len(batch), vectors.shape[1]), dtype=np.float32)
+            for i, row in enumerate(rows):
+                if row is not None:
+                    emb[i] = vectors[row]
+            if missing:
+                emb[missing] = np.asarray(embedder.embed([batch[i].text for i in missing]), dtype=np.float32)
+        writer.append(batch, emb)
+        embedded += len(missing)
+
+    batch = []
+    for c in chunks:
+        batch.append(c)
+        if len(batch) >= batch_size:
+            if cancel is not None and cancel.is_set():
+                return embedded
+            flush(batch)
+            batch = []
+    if batch and not (cancel is not None and cancel.is_set()):
+        flush(batch)
+    return embedded
+
+
+def _chunking_params() -> dict:
+    return {"max_chars": settings.chunk_max_chars, "overlap_chars": settings.chunk_overlap_chars}
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _reusable_vectors(document_id: str, embedding: dict) -> tuple[dict[str, int], np.ndarray | None, int]:
+    """({text hash: row}, stored vectors, chunk count) of the current index, for reindexing.
+
+    Nothing is reused if the document was indexed in another embedding space.
+    """
+
+    loaded = faiss_store.get_store(document_id)
+    vectors = faiss_store.load_vectors(document_id)
+    if loaded is None or vectors is None:
+        return {}, None, 0
+    if faiss_store.embedding_info(document_id) != embedding:
+        return {}, None, len(loaded)
+    return {_text_hash(loaded.text(i)): i for i in range(len(loaded))}, vectors, len(loaded)
+
+
+async def ingest_document(
+    *,
+    file_path: str,
+    filename: str,
+    mime: str | None,
+    document_id: str | None = None,
+    stage: StageHook | None = None,
+    sha256: str | None = None,
+    move: bool = False,
+) -> dict:
+    """Parse → chunk → embed → index one file.
+
+    `stage(name)` wraps each pipeline stage (extract/chunk/embed/index); the job
+    queue uses it for progress reporting and per-stage concurrency limits.
+    Blocking work runs in threads so the event loop stays responsive. On failure
+    or cancellation the partially written document is removed.
+
+    With `move=True` the file is renamed into the document dir instead of copied
+    (the upload spool lives on the same filesystem). `sha256` is recorded in the
+    meta and registered for upload dedup once ingestion succeeds.
+    """
+
     _ensure_dirs()
+    stage = stage or _no_stage
 
-    document_id = str(uuid.uuid4())
+    document_id = document_id or str(uuid.uuid4())
     doc_dir = os.path.join(settings.storage_dir, "docs", document_id)
     os.makedirs(doc_dir, exist_ok=True)
 
-    original_path = os.path.join(doc_dir, filename)
-    shutil.copyfile(file_path, original_path)
-
-    pages = await extract_text(original_path, mime or "")
+    spool_path = os.path.join(doc_dir, f"pages.{uuid.uuid4().hex}.tmp")
+    chunk_spool_path = os.path.join(doc_dir, f"chunks.{uuid.uuid4().hex}.tmp")
+    writer = None
+    try:
+        original_path = os.path.join(doc_dir, filename)
+        if move:
+            os.replace(file_path, original_path)
+        else:
+            shutil.copyfile(file_path, original_path)
 
-    # Global metadata detection (POC heuristics)
-    full_text = "\n\n".join([(t or "") for _, t in pages])
-    doc_type = detect_document_type(full_text)
-    identifiers = extract_global_identifiers(full_text)
+        num_pages = 0
+        scanner = MetadataScanner()
+        async with stage("extract"):
+            with open(spool_path, "w", encoding="utf-8") as f:
+                async for page in iter_text(original_path, mime or "", sha256=sha256):
+                    await _run_blocking(_spool_page, f, scanner, page)
+                    num_pages += 1
 
-    global_meta = {
-        "document_type": doc_type,
-        **identifiers,
-    }
-    prefix = build_metadata_prefix(global_meta)
+        doc_type, identifiers = scanner.result()
+        global_meta = {"document_type": doc_type, **identifiers}
 
-    chunks = chunk_pages(document_id, pages)
-    if not chunks:
-        raise ValueError("No text found in document")
+        async with stage("chunk"):
+            num_chunks = await _run_blocking(_spool_chunks, document_id, spool_path, chunk_spool_path)
+            if not num_chunks:
+                raise ValueError("No text found in document")
 
-    # Metadata injection into chunk text (improves retrieval even without DB filters)
-    for c in chunks:
-        c.meta = global_meta
-        if prefix:
-            c.text = prefix + c.text
+        async with stage("embed"):
+            embedder = get_embedding_client()
+            writer = DocumentWriter(document_id, global_meta, embedding=embedder.describe())
+            chunks = _with_metadata(_read_chunk_spool(document_id, chunk_spool_path), global_meta)
+            cancel = threading.Event()
+            await _run_blocking(_embed_into, writer, embedder, chunks, cancel=cancel, on_cancel=cancel.set)
 
-    embedder = get_embedding_client()
-    embeddings = embedder.embed([c.text for c in chunks])
+        async with stage("index"):
+            # FAISS per-document index + chunk metadata.
+            await _run_blocking(writer.commit)
+            writer = None
 
-    # FAISS per-document index + chunk metadata.
-    persist(document_id, chunks=chunks, embeddings=embeddings)
+            # Corpus-wide index for cross-document search (skipped if the embedding space differs).
+            if settings.corpus_index_enabled:
+                await _run_blocking(_add_to_corpus, document_id, embedder.describe())
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        delete_document(document_id)
+        raise
+    finally:
+        for path in (spool_path, chunk_spool_path):
+            if os.path.exists(path):
+                os.remove(path)
 
     meta = {
         "document_id": document_id,
         "filename": filename,
         "mime": mime,
         "created_at": datetime.now(timezone.utc).isoformat(),
-        "num_pages": len(pages),
-        "num_chunks": len(chunks),
+        "num_pages": num_pages,
+        "num_chunks": num_chunks,
         "document_type": doc_type,
         **identifiers,
+        "embedding": embedder.describe(),
+        "chunking": _chunking_params(),
+        "sha256": sha256,
     }
 
     with open(os.path.join(doc_dir, "meta.json"), "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
 
+    if sha256:
+        uploads.remember(sha256, document_id)
+
     return meta
+
+
+def _commit_reindex(document_id: str, writer: DocumentWriter, meta: dict, embedding: dict) -> None:
+    """Swap in the rebuilt index and meta.json, unless the document was deleted meanwhile."""
+
+    doc_dir = os.path.join(settings.storage_dir, "docs", document_id)
+    meta_path = os.path.join(doc_dir, "meta.json")
+    with faiss_store.document_lock(document_id):
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError("Document was deleted during reindex")
+        writer.commit()
+        if settings.corpus_index_enabled:
+            _add_to_corpus(document_id, embedding)
+
+        answer_cache.invalidate(document_id)
+        # Extraction results were computed from the old chunks.
+        try:
+            os.remove(os.path.join(doc_dir, "extract.json"))
+        except FileNotFoundError:
+            pass
+
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+
+def _discard_if_deleted(document_id: str) -> None:
+    # A concurrent delete_document may race the reindex's temp files back into existence.
+    doc_dir = os.path.join(settings.storage_dir, "docs", document_id)
+    with faiss_store.document_lock(document_id):
+        if not os.path.exists(os.path.join(doc_dir, "meta.json")):
+            shutil.rmtree(doc_dir, ignore_errors=True)
+
+
+async def reindex_document(document_id: str, *, stage: StageHook | None = None) -> dict:
+    """Re-run extract → chunk on the stored original and rebuild the index incrementally.
+
+    Chunks are matched to the current store by a hash of their embedded text (metadata
+    prefix included); matching chunks keep their stored vectors and only new or
+    changed chunks are embedded. Pages and chunks are spooled and embedded batch by
+    batch as in ingest_document. The document stays queryable with its old index
+    until the new one is committed; a failure leaves it untouched, and a document
+    deleted while it is being reindexed stays deleted.
+    """
+
+    stage = stage or _no_stage
+    doc_dir = os.path.join(settings.storage_dir, "docs", document_id)
+    meta_path = os.path.join(doc_dir, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    original_path = os.path.join(doc_dir, meta["filename"])
+    if not os.path.exists(original_path):
+        raise FileNotFoundError("Original file is missing; re-upload the document")
+
+    spool_path = os.path.join(doc_dir, f"pages.{uuid.uuid4().hex}.tmp")
+    chunk_spool_path = os.path.join(doc_dir, f"chunks.{uuid.uuid4().hex}.tmp")
+    writer = None
+    try:
+        num_pages = 0
+        scanner = MetadataScanner()
+        async with stage("extract"):
+            with open(spool_path, "w", encoding="utf-8") as f:
+                async for page in iter_text(original_path, meta.get("mime") or "", sha256=meta.get("sha256")):
+                    await _run_blocking(_spool_page, f, scanner, page)
+                    num_pages += 1
+
+        doc_type, identifiers = scanner.result()
+        global_meta = {"document_type": doc_type, **identifiers}
+
+        async with stage("chunk"):
+            num_chunks = await _run_blocking(_spool_chunks, document_id, spool_path, chunk_spool_path)
+            if not num_chunks:
+                raise ValueError("No text found in document")
+
+        async with stage("embed"):
+            embedder = get_embedding_client()
+            reuse, vectors, previous = await _run_blocking(_reusable_vectors, document_id, embedder.describe())
+            writer = DocumentWriter(document_id, global_meta, embedding=embedder.describe())
+            chunks = _with_metadata(_read_chunk_spool(document_id, chunk_spool_path), global_meta)
+            cancel = threading.Event()
+            embedded = await _run_blocking(
+                _embed_into, writer, embedder, chunks, reuse=reuse, vectors=vectors, cancel=cancel, on_cancel=cancel.set
+            )
+            del vectors
+
+        # Identifiers the new scan no longer finds must not linger in the metadata prefix.
+        for key in ("document_type", *IDENTIFIER_KEYS):
+            meta.pop(key, None)
+        meta.update(
+            {
+                "num_pages": num_pages,
+                "num_chunks": num_chunks,
+                "document_type": doc_type,
+                **identifiers,
+                "embedding": embedder.describe(),
+                "chunking": _chunking_params(),
+                "reindexed_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+        async with stage("index"):
+            await _run_blocking(_commit_reindex, document_id, writer, meta, embedder.describe())
+            writer = None
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        _discard_if_deleted(document_id)
+        raise
+    finally:
+        for path in (spool_path, chunk_spool_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return {
+        **meta,
+        "reindex": {
+            "previous_chunks": previous,
+            "chunks": num_chunks,
+            "reused": num_chunks - embedded,
+            "embedded": embedded,
+        },
+    }
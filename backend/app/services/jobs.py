@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from app.core.config import settings
+
+# In-process background job queue for ingestion (no external broker).
+#
+# A fixed pool of asyncio workers pulls jobs off a bounded queue. Each job runs a
+# coroutine that reports its stages through `job.stage(name)`; every stage name
+# has its own semaphore, so e.g. OCR and embedding concurrency are capped
+# independently of the worker count.
+
+STAGES = ("extract", "chunk", "embed", "index")
+
+TERMINAL = {"succeeded", "failed", "cancelled"}
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(
+        self,
+        kind: str,
+        params: dict,
+        run: Callable[["Job"], Awaitable[Any]] | None,
+        limits: dict[str, asyncio.Semaphore],
+        on_cancel: Callable[[], None] | None = None,
+    ) -> None:
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.stage_name: str | None = None
+        self.stages: dict[str, dict] = {}
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.result: Any = None
+        self.error: str | None = None
+        self._run = run
+        self._limits = limits
+        self._on_cancel = on_cancel
+        self._task: asyncio.Task | None = None
+        self._done = asyncio.Event()
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Mark a pipeline stage; waits for a slot if the stage is at its concurrency limit."""
+
+        info = {"status": "waiting", "queued_at": time.time()}
+        self.stages[name] = info
+        self.stage_name = name
+        sem = self._limits.get(name)
+        if sem is not None:
+            await sem.acquire()
+        info.update(status="running", started_at=time.time())
+        try:
+            yield info
+        except asyncio.CancelledError:
+            info.update(status="cancelled", finished_at=time.time())
+            raise
+        except BaseException:
+            info.update(status="failed", finished_at=time.time())
+            raise
+        finally:
+            if sem is not None:
+                sem.release()
+        info.update(status="done", finished_at=time.time())
+
+    async def wait(self) -> "Job":
+        await self._done.wait()
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage_name,
+            "stages": self.stages,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    def __init__(self, *, workers: int, max_queued: int, stage_limits: dict[str, int], retention: int) -> None:
+        self.workers = workers
+        self.max_queued = max_queued
+        self.stage_limits = stage_limits
+        self.retention = retention
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._queue: asyncio.Queue[Job] | None = None
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        self._workers: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._limits = {name: asyncio.Semaphore(n) for name, n in self.stage_limits.items()}
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for job in self._jobs.values():
+            if job.status not in TERMINAL:
+                self.cancel(job.id)
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(
+        self,
+        kind: str,
+        params: dict,
+        run: Callable[[Job], Awaitable[Any]],
+        *,
+        on_cancel: Callable[[], None] | None = None,
+    ) -> Job:
+        """Queue `run(job)`.
+
+        `on_cancel` is called whenever the job ends cancelled, including before `run`
+        started (when its own `finally` never executes), so it must be idempotent.
+        """
+
+        if self._queue is None:
+            raise RuntimeError("Job queue not started")
+        job = Job(kind, params, run, self._limits, on_cancel)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError("Ingestion queue is full, retry later") from None
+        self._jobs[job.id] = job
+        self._trim()
+        return job
+
+    def record(self, kind: str, params: dict, result: Any) -> Job:
+        """Register a job that is already done (e.g. a deduplicated upload)."""
+        job = Job(kind, params, None, self._limits)
+        job.started_at = job.created_at
+        self._finish(job, "succeeded", result=result)
+        self._jobs[job.id] = job
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self._jobs.get(job_id)
+        if job is None or job.status in TERMINAL:
+            return job
+        if job._task is not None:
+            # Running: cancellation lands at the job's next await.
+            job._task.cancel()
+        else:
+            # Still queued: the worker skips it when dequeued.
+            self._cancelled(job)
+        return job
+
+    def stats(self) -> dict:
+        counts: dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queued": self.max_queued,
+            "stage_limits": self.stage_limits,
+            "jobs": counts,
+        }
+
+    def _finish(self, job: Job, status: str, *, result: Any = None, error: str | None = None) -> None:
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job._task = None
+        job._done.set()
+
+    def _cancelled(self, job: Job) -> None:
+        self._finish(job, "cancelled")
+        if job._on_cancel is not None:
+            job._on_cancel()
+
+    def _trim(self) -> None:
+        # Forget the oldest finished jobs beyond the retention limit.
+        excess = len(self._jobs) - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.status in TERMINAL][: max(0, excess)]:
+            del self._jobs[job_id]
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job._task = asyncio.create_task(job._run(job))
+                try:
+                    result = await job._task
+                except asyncio.CancelledError:
+                    self._cancelled(job)
+                    if asyncio.current_task().cancelling():
+                        # The worker itself is shutting down.
+                        raise
+                except Exception as e:
+                    self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+                else:
+                    self._finish(job, "succeeded", result=result)
+            finally:
+                self._queue.task_done()
+
+
+job_queue = JobQueue(
+    workers=settings.ingest_workers,
+    max_queued=settings.ingest_queue_max,
+    stage_limits={
+        "extract": settings.ingest_extract_concurrency,
+        "chunk": settings.ingest_chunk_concurrency,
+        "embed": settings.ingest_embed_concurrency,
+        "index": settings.ingest_index_concurrency,
+    },
+    retention=settings.job_retention,
+)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+from openai import OpenAI
+
+from app.core.config import settings
+
+
+class ChatClient:
+    backend: str = ""
+    model: str = ""
+
+    def complete(self, messages: list[dict], *, temperature: float = 0.0, json_mode: bool = False) -> str:
+        """Full completion text. `json_mode` asks for a single JSON object."""
+        raise NotImplementedError
+
+    def stream(self, messages: list[dict], *, temperature: float = 0.0) -> Iterator[str]:
+        """Yield the completion as text deltas. Defaults to one delta with the full answer."""
+        yield self.complete(messages, temperature=temperature)
+
+
+_BACKENDS: dict[str, Callable[[], ChatClient]] = {}
+
+
+def register_chat_backend(name: str):
+    """Register a ChatClient factory under `name` (selected via CHAT_BACKEND)."""
+
+    def deco(factory: Callable[[], ChatClient]):
+        _BACKENDS[name] = factory
+        return factory
+
+    return deco
+
+
+def available_backends() -> list[str]:
+    return sorted(_BACKENDS)
+
+
+@register_chat_backend("openai")
+class OpenAIChatClient(ChatClient):
+    backend = "openai"
+
+    def __init__(self) -> None:
+        if not settings.openai_api_key:
+            raise RuntimeError("OPENAI_API_KEY not set")
+        self._client = OpenAI(api_key=settings.openai_api_key, base_url=settings.openai_base_url)
+        self.model = settings.openai_model
+
+    def complete(self, messages: list[dict], *, temperature: float = 0.0, json_mode: bool = False) -> str:
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        completion = self._client.chat.completions.create(
+            model=self.model, messages=messages, temperature=temperature, **extra
+        )
+        return completion.choices[0].message.content or ""
+
+    def stream(self, messages: list[dict], *, temperature: float = 0.0) -> Iterator[str]:
+        stream = self._client.chat.completions.create(
+            model=self.model, messages=messages, temperature=temperature, stream=True
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+
+def get_chat_client(backend: str | None = None) -> ChatClient | None:
+    """Build the configured chat client; None when the OpenAI backend has no API key."""
+
+    name = backend or settings.chat_backend
+    if name == "openai" and not settings.openai_api_key:
+        return None
+    factory = _BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown chat backend {name!r} (available: {', '.join(available_backends())})")
+    return factory()
@@ -2,96 +2,234 @@ from __future__ import annotations
 
 import re
 
+# Document type + global identifier detection (POC heuristics).
+#
+# Each text is lowercased once and scanned with str.find for the literal keyword
+# every pattern starts with ("bill of lading", "load", "po", "dispatcher", ...).
+# A field's precompiled pattern is only tried at those positions, and a field is
+# no longer looked for once found. Results are identical to running each pattern
+# with re.search over the whole text (leftmost match wins), at a fraction of the cost:
+# re has no literal prefix to skip ahead with for \b-anchored, case-insensitive patterns.
+
+_I = re.IGNORECASE
+
+# (type, phrases, whole words) in priority order; matched against the lowercased text.
+_TYPE_RULES: list[tuple[str, tuple[str, ...], tuple[str, ...]]] = [
+    ("bol", ("bill of lading",), ("bol",)),
+    ("rate_confirmation", ("rate confirmation", "load confirmation"), ()),
+    ("invoice", ("commercial invoice",), ("invoice",)),
+    ("packing_list", ("packing list",), ()),
+    ("manifest", ("manifest",), ()),
+    ("shipment_instructions", ("shipment instruction", "shipping instructions"), ()),
+]
+_WORD_RES = {w: re.compile(rf"\b{w}\b") for _, _, words in _TYPE_RULES for w in words}
+
+# field -> (keywords, pattern, value group). Every keyword is the lowercased start
+# of a match, so a field's first match is at one of its keywords' positions.
+_FIELDS: dict[str, tuple[tuple[str, ...], re.Pattern, int]] = {
+    "reference_id": (("reference",), re.compile(r"\bReference\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", _I), 1),
+    "load_id": (("load",), re.compile(r"\bLoad\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", _I), 1),
+    "shipment_id": (("shipment",), re.compile(r"\bShipment\s*(ID|#)\s*[:#-]?\s*([A-Z0-9-]{4,})\b", _I), 2),
+    "bol_number": (("bol",), re.compile(r"\bBOL\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", _I), 2),
+    "po_number": (
+        ("purchase", "po"),
+        re.compile(r"\b(Purchase\s*Order|PO)\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{4,})\b", _I),
+        3,
+    ),
+    "container_id": (("container",), re.compile(r"\bContainer\s*(ID|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", _I), 2),
+    "carrier_mc": (("mc",), re.compile(r"\bMC\s*#?\s*([0-9]{5,10})\b", _I), 1),
+    "booking_date": (
+        ("booking",),
+        re.compile(r"\bBooking\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", _I),
+        1,
+    ),
+    "issue_date": (
+        ("issue",),
+        re.compile(r"\bIssue\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", _I),
+        1,
+    ),
+}
+
+# Dispatcher details (common on rate confirmations) are matched per line, so
+# "Dispatcher Email" is never captured as a name. A line matches at most one of these.
+_DISPATCHER: dict[str, re.Pattern] = {
+    "dispatcher_name": re.compile(r"^(Dispatcher|Dispatcher Name)\s*[:#-]\s*(.+)$", _I),
+    "dispatcher_phone": re.compile(r"^Dispatcher\s*(Phone|Tel|Telephone)\s*[:#-]\s*(.+)$", _I),
+    "dispatcher_email": re.compile(
+        r"^Dispatcher\s*(Email)\s*[:#-]\s*([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})$", _I
+    ),
+}
+
+_USD_RE = re.compile(r"\bUSD\b")
+
+# Non-ASCII characters re.IGNORECASE equates with ASCII keyword letters; mapped
+# before the keyword search so no match is missed ("\u0130".lower() is also two chars).
+_FOLD_CHARS = "\u0130\u0131\u017f\u212a"  # dotted/dotless i, long s, Kelvin sign
+_FOLD = str.maketrans(_FOLD_CHARS, "iisk")
+
+# Characters str.splitlines() breaks on.
+_LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_LINE_BREAK_RE = re.compile(f"[{_LINE_BREAKS}]")
+
+# Identifier keys in build order (extract_global_identifiers' output order).
+IDENTIFIER_KEYS = [
+    "reference_id",
+    "load_id",
+    "shipment_id",
+    "bol_number",
+    "po_number",
+    "container_id",
+    "dispatcher_name",
+    "dispatcher_phone",
+    "dispatcher_email",
+    "carrier_mc",
+    "booking_date",
+    "issue_date",
+    "currency_hint",
+]
+
+
+def _positions(keys: str, keyword: str):
+    i = keys.find(keyword)
+    while i >= 0:
+        yield i
+        i = keys.find(keyword, i + 1)
+
+
+def _detect_type(lowered: str, limit: int = len(_TYPE_RULES)) -> int | None:
+    """Index of the first rule in `_TYPE_RULES[:limit]` that matches `lowered`."""
+    for n, (_, phrases, words) in enumerate(_TYPE_RULES[:limit]):
+        if any(p in lowered for p in phrases):
+            return n
+        for w in words:
+            if any(_WORD_RES[w].match(lowered, i) for i in _positions(lowered, w)):
+                return n
+    return None
+
+
+def _line_from(t: str, pos: int) -> str | None:
+    """The stripped line at `pos`, or None if `pos` is not its first non-space char."""
+    i = pos
+    while i > 0 and t[i - 1] not in _LINE_BREAKS:
+        if not t[i - 1].isspace():
+            return None
+        i -= 1
+    end = _LINE_BREAK_RE.search(t, pos)
+    return t[pos : end.start() if end else len(t)].strip()
+
+
+def _scan_identifiers(t: str, out: dict) -> None:
+    """Add the fields missing from `out` with their first match in `t`."""
+    if len(out) == len(IDENTIFIER_KEYS):
+        return
+    keys = t.lower()
+    if any(c in t for c in _FOLD_CHARS):
+        keys = t.translate(_FOLD).lower()
+
+    for key, (keywords, pattern, group) in _FIELDS.items():
+        if key in out:
+            continue
+        first = None
+        for kw in keywords:
+            for i in _positions(keys, kw):
+                if first is not None and i >= first.start():
+                    break
+                m = pattern.match(t, i)
+                if m:
+                    first = m
+                    break
+        if first:
+            out[key] = first.group(group)
+
+    if not all(k in out for k in _DISPATCHER):
+        for i in _positions(keys, "dispatcher"):
+            line = _line_from(t, i)
+            if line is None:
+                continue
+            for key, pattern in _DISPATCHER.items():
+                if key not in out:
+                    m = pattern.match(line)
+                    if m:
+                        out[key] = m.group(2).strip()
+                        break
+            if all(k in out for k in _DISPATCHER):
+                break
+
+    if "currency_hint" not in out:
+        if "$" in t or any(_USD_RE.match(t, i) for i in _positions(t, "USD")):
+            out["currency_hint"] = "USD"
+
 
 def detect_document_type(text: str) -> str | None:
-    t = (text or "").lower()
     # Very lightweight heuristics (POC). We'll improve with a classifier later.
-    if "bill of lading" in t or re.search(r"\bbol\b", t):
-        return "bol"
-    if "rate confirmation" in t or "load confirmation" in t:
-        return "rate_confirmation"
-    if "commercial invoice" in t or re.search(r"\binvoice\b", t):
-        return "invoice"
-    if "packing list" in t:
-        return "packing_list"
-    if "manifest" in t:
-        return "manifest"
-    if "shipment instruction" in t or "shipping instructions" in t:
-        return "shipment_instructions"
-    return None
+    n = _detect_type((text or "").lower())
+    return None if n is None else _TYPE_RULES[n][0]
 
 
 def extract_global_identifiers(text: str) -> dict:
-    t = text or ""
-
     out: dict = {}
+    _scan_identifiers(text or "", out)
+    return {k: out[k] for k in IDENTIFIER_KEYS if k in out}
 
-    # Reference / load / shipment id patterns
-    m = re.search(r"\bReference\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
-    if m:
-        out["reference_id"] = m.group(1)
-
-    m = re.search(r"\bLoad\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
-    if m:
-        out["load_id"] = m.group(1)
 
-    m = re.search(r"\bShipment\s*(ID|#)\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
-    if m:
-        out["shipment_id"] = m.group(2)
+# Text carried over from earlier pages so identifiers split across a page break
+# (e.g. "Load ID:" at the end of one page, the value on the next) are still found:
+# at least the last _TAIL_CHARS, extended back to the start of their first line.
+# Known limit: a line longer than _TAIL_MAX_CHARS is cut, and a match that needs
+# more of it than that can be missed.
+_TAIL_CHARS = 512
+_TAIL_MAX_CHARS = 16_384
 
-    m = re.search(r"\bBOL\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", t, re.IGNORECASE)
-    if m:
-        out["bol_number"] = m.group(2)
 
-    m = re.search(r"\b(Purchase\s*Order|PO)\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
-    if m:
-        out["po_number"] = m.group(3)
+def _tail(window: str) -> str:
+    """The end of `window` to carry over, starting at a line start (up to the hard cap)."""
+    if len(window) <= _TAIL_CHARS:
+        return window
+    # Whole lines only, so a cut line can't fake a line-anchored match.
+    lo = max(0, len(window) - _TAIL_MAX_CHARS)
+    head = window[lo : len(window) - _TAIL_CHARS]
+    brk = max(head.rfind(c) for c in _LINE_BREAKS)
+    if brk >= 0:
+        return window[lo + brk + 1 :]
+    return window[lo:]
 
-    m = re.search(r"\bContainer\s*(ID|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", t, re.IGNORECASE)
-    if m:
-        out["container_id"] = m.group(2)
 
-    # Dispatcher details (common on rate confirmations)
-    # Do line-based matching so we don't accidentally capture "Dispatcher Email" as a name.
-    for line in t.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+class MetadataScanner:
+    """Incremental detect_document_type + extract_global_identifiers over pages.
 
-        m = re.match(r"^(Dispatcher|Dispatcher Name)\s*[:#-]\s*(.+)$", line, re.IGNORECASE)
-        if m and "dispatcher_name" not in out:
-            out["dispatcher_name"] = m.group(2).strip()
-            continue
+    Feeding pages one by one gives the same result as running both functions on
+    the pages joined with blank lines, without holding the joined text. Only types
+    ranked above the best one so far are looked for, and identifiers stop being
+    scanned once all of them are found.
+    """
 
-        m = re.match(r"^Dispatcher\s*(Phone|Tel|Telephone)\s*[:#-]\s*(.+)$", line, re.IGNORECASE)
-        if m and "dispatcher_phone" not in out:
-            out["dispatcher_phone"] = m.group(2).strip()
-            continue
+    def __init__(self) -> None:
+        self._type: int | None = None
+        self._ids: dict = {}
+        self._tail: str | None = None
 
-        m = re.match(r"^Dispatcher\s*(Email)\s*[:#-]\s*([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})$", line, re.IGNORECASE)
-        if m and "dispatcher_email" not in out:
-            out["dispatcher_email"] = m.group(2).strip()
-            continue
+    @property
+    def done(self) -> bool:
+        return self._type == 0 and len(self._ids) == len(IDENTIFIER_KEYS)
 
-    # Carrier MC
-    m = re.search(r"\bMC\s*#?\s*([0-9]{5,10})\b", t, re.IGNORECASE)
-    if m:
-        out["carrier_mc"] = m.group(1)
+    def feed(self, text: str | None) -> None:
+        t = text or ""
+        if self._type != 0:
+            n = _detect_type(t.lower(), len(_TYPE_RULES) if self._type is None else self._type)
+            if n is not None:
+                self._type = n
 
-    # Common date markers (keep raw; normalization can be added later)
-    m = re.search(r"\bBooking\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", t, re.IGNORECASE)
-    if m:
-        out["booking_date"] = m.group(1)
+        if len(self._ids) == len(IDENTIFIER_KEYS):
+            return
 
-    m = re.search(r"\bIssue\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", t, re.IGNORECASE)
-    if m and "issue_date" not in out:
-        out["issue_date"] = m.group(1)
+        window = t if self._tail is None else f"{self._tail}\n\n{t}"
+        _scan_identifiers(window, self._ids)
 
-    # Currency hint
-    if re.search(r"\bUSD\b|\$", t):
-        out["currency_hint"] = "USD"
+        self._tail = _tail(window)
 
-    return out
+    def result(self) -> tuple[str | None, dict]:
+        doc_type = None if self._type is None else _TYPE_RULES[self._type][0]
+        return doc_type, {k: self._ids[k] for k in IDENTIFIER_KEYS if k in self._ids}
 
 
 def build_metadata_prefix(meta: dict) -> str:
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
+from typing import Iterator
 
 
 @dataclass
@@ -12,20 +13,90 @@ class MdBlock:
 
 _HEADING_RE = re.compile(r"^(#{1,6})\s+(.+)$")
 _KV_RE = re.compile(r"^\s*([A-Za-z][A-Za-z0-9 /\-_.()]{1,40})\s*[:\-]\s*(.+?)\s*$")
+# e.g. | --- | --- | or ---|--- (matched against the stripped line)
+_TABLE_SEP_RE = re.compile(r"\|?\s*:?-{2,}\s*\||[-:| ]{6,}$")
 
+# Line classes, computed once per line.
+_BLANK = 1
+_HEADING = 2
+_PIPES = 4  # markdown table row: at least two pipes
+_SEP = 8  # table separator row
+_KV = 16  # "Label: Value"
 
-def _is_table_line(line: str) -> bool:
+_TABLE_ROW = _PIPES | _SEP
+_SEP_START = frozenset("|:-")
+
+
+def _classify(line: str) -> tuple[str, int]:
     s = line.strip()
     if not s:
-        return False
-    # Markdown tables usually have pipes.
-    return s.count("|") >= 2
+        return s, _BLANK
+    flags = 0
+    first = s[0]
+    if first == "#" and _HEADING_RE.match(s):
+        flags |= _HEADING
+    if s.count("|") >= 2:
+        flags |= _PIPES
+    if first in _SEP_START and _TABLE_SEP_RE.match(s):
+        flags |= _SEP
+    if first.isascii() and first.isalpha() and ("-" in s or ":" in s) and _KV_RE.match(line):
+        flags |= _KV
+    return s, flags
+
+
+def iter_markdown_blocks(md: str) -> Iterator[MdBlock]:
+    """Yield the blocks of `parse_markdown_blocks` lazily, classifying each line once.
+
+    A table starts at a line with pipes followed by another table row, so the
+    parser keeps a one-line lookahead.
+    """
 
+    md = (md or "").replace("\r\n", "\n").replace("\r", "\n")
+    lines = iter(md.split("\n"))
+
+    kind: str | None = None  # block being collected
+    buf: list[str] = []
+
+    nxt = next(lines, None)
+    nxt_s, nxt_flags = _classify(nxt) if nxt is not None else ("", 0)
+    while nxt is not None:
+        line, s, flags = nxt, nxt_s, nxt_flags
+        nxt = next(lines, None)
+        nxt_s, nxt_flags = _classify(nxt) if nxt is not None else ("", 0)
+        table_start = flags & _PIPES and nxt_flags & _TABLE_ROW
+
+        if kind is not None:
+            if kind == "table":
+                more = flags & _TABLE_ROW
+            elif kind == "kvs":
+                more = flags & _KV
+            else:
+                more = not (flags & (_BLANK | _HEADING | _KV) or table_start)
+            if more:
+                buf.append(line)
+                continue
+            text = "\n".join(buf).strip()
+            if text:
+                yield MdBlock(kind=kind, text=text)
+            kind, buf = None, []
+
+        if flags & _BLANK:
+            continue
+        if flags & _HEADING:
+            yield MdBlock(kind="heading", text=s)
+            continue
+        if table_start:
+            kind = "table"
+        elif flags & _KV:
+            kind = "kvs"
+        else:
+            kind = "text"
+        buf.append(line)
 
-def _is_table_sep(line: str) -> bool:
-    s = line.strip()
-    # e.g. | --- | --- | or ---|---
-    return bool(re.match(r"^\s*\|?\s*:?[-]{2,}\s*\|", s)) or bool(re.match(r"^\s*[-:| ]{6,}\s*$", s))
+    if kind is not None:
+        text = "\n".join(buf).strip()
+        if text:
+            yield MdBlock(kind=kind, text=text)
 
 
 def parse_markdown_blocks(md: str) -> list[MdBlock]:
@@ -38,66 +109,4 @@ def parse_markdown_blocks(md: str) -> list[MdBlock]:
     - text: everything else, grouped by blank-line paragraphs
     """
 
-    md = (md or "").replace("\r\n", "\n").replace("\r", "\n")
-    lines = md.split("\n")
-
-    blocks: list[MdBlock] = []
-    i = 0
-    n = len(lines)
-
-    def consume_blank(j: int) -> int:
-        while j < n and not lines[j].strip():
-            j += 1
-        return j
-
-    while i < n:
-        i = consume_blank(i)
-        if i >= n:
-            break
-
-        line = lines[i]
-
-        # Heading
-        m = _HEADING_RE.match(line.strip())
-        if m:
-            blocks.append(MdBlock(kind="heading", text=line.strip()))
-            i += 1
-            continue
-
-        # Table block: header line with pipes + separator line
-        if _is_table_line(line) and i + 1 < n and (_is_table_line(lines[i + 1]) or _is_table_sep(lines[i + 1])):
-            start = i
-            i += 1
-            while i < n and (_is_table_line(lines[i]) or _is_table_sep(lines[i])):
-                i += 1
-            table_txt = "\n".join(lines[start:i]).strip()
-            blocks.append(MdBlock(kind="table", text=table_txt))
-            continue
-
-        # Key-value run
-        if _KV_RE.match(line):
-            start = i
-            i += 1
-            while i < n and _KV_RE.match(lines[i]):
-                i += 1
-            kv_txt = "\n".join(lines[start:i]).strip()
-            blocks.append(MdBlock(kind="kvs", text=kv_txt))
-            continue
-
-        # Paragraph text until blank line or structural token
-        start = i
-        i += 1
-        while i < n and lines[i].strip():
-            # stop if next line starts a new structure
-            if _HEADING_RE.match(lines[i].strip()):
-                break
-            if _KV_RE.match(lines[i]):
-                break
-            if _is_table_line(lines[i]) and i + 1 < n and (_is_table_line(lines[i + 1]) or _is_table_sep(lines[i + 1])):
-                break
-            i += 1
-        para = "\n".join(lines[start:i]).strip()
-        if para:
-            blocks.append(MdBlock(kind="text", text=para))
-
-    return blocks
+    return list(iter_markdown_blocks(md))
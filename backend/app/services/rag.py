@@ -2,12 +2,16 @@ from __future__ import annotations
 
 import math
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 
-from openai import OpenAI
+import numpy as np
 
 from app.core.config import settings
+from app.services import answer_cache, bm25, context_packer, faiss_store
 from app.services.embeddings import get_embedding_client
 from app.services.faiss_store import query as faiss_query
+from app.services.llm import get_chat_client
 
 
 def _calibrate_similarity(sim: float) -> float:
@@ -137,9 +141,38 @@ def _keyword_score(text: str, tokens: list[str]) -> float:
     return min(1.0, score / max(3.0, len(tokens)))
 
 
-def retrieve_raw(document_id: str, question: str, *, pre_k: int):
-    embedder = get_embedding_client()
-    q_emb = embedder.embed([question])[0]
+def _embedder_for(document_id: str):
+    # Query in the same embedding space the document was indexed in.
+    # Documents indexed before backends were recorded are OpenAI.
+    info = faiss_store.embedding_info(document_id) or {}
+    return get_embedding_client(info.get("backend") or "openai")
+
+
+def min_similarity_for(document_id: str) -> float:
+    """Guardrail threshold for the document's embedding space.
+
+    Hashed n-gram vectors score systematically lower than provider embeddings,
+    so the offline backend has its own threshold.
+    """
+    info = faiss_store.embedding_info(document_id) or {}
+    if info.get("backend") == "hashing":
+        return settings.hashing_min_similarity
+    return settings.min_similarity
+
+
+def embed_question(document_id: str, question: str) -> np.ndarray:
+    return _embedder_for(document_id).embed([question])[0]
+
+
+def embed_questions(document_id: str, questions: list[str]) -> np.ndarray:
+    """Several query embeddings (one row each) in one embedding call."""
+    if not questions:
+        return np.zeros((0, 0), dtype=np.float32)
+    return _embedder_for(document_id).embed(questions)
+
+
+def retrieve_raw(document_id: str, question: str, *, pre_k: int, query_embedding=None):
+    q_emb = query_embedding if query_embedding is not None else embed_question(document_id, question)
     sources = faiss_query(document_id, q_emb, top_k=pre_k)
     for i, s in enumerate(sources, start=1):
         s["rank"] = i
@@ -147,6 +180,102 @@ def retrieve_raw(document_id: str, question: str, *, pre_k: int):
     return sources, sims
 
 
+def search_corpus(question: str, *, top_k: int = 10, document_ids: list[str] | None = None) -> list[dict]:
+    """Cross-document search over the corpus index (optionally restricted to document_ids)."""
+
+    from app.services.corpus_index import get_corpus_index
+
+    corpus = get_corpus_index()
+    if corpus.embedding is None:
+        return []
+
+    embedder = get_embedding_client(corpus.embedding.get("backend") or "openai")
+    q_emb = embedder.embed([question])[0]
+    if not corpus.matches(embedder.describe(), len(q_emb)):
+        # Same backend, but another model/dimensions: scores would be meaningless.
+        raise ValueError(
+            f"Corpus index was built with {corpus.embedding}, queries now embed with {embedder.describe()}; "
+            "rebuild it (python -m app.services.corpus_index) after clearing storage/corpus"
+        )
+    hits = corpus.search(q_emb, top_k=top_k, document_ids=document_ids)
+
+    out = []
+    for h in hits:
+        m = faiss_store.get_chunk(h["document_id"], h["row"])
+        if m is None:
+            continue
+        out.append(
+            {
+                "rank": len(out) + 1,
+                "document_id": h["document_id"],
+                "similarity": h["similarity"],
+                "page_num": m.get("page_num"),
+                "chunk_index": m.get("chunk_index"),
+                "text": m.get("text"),
+                "chunk_id": m.get("id"),
+                "chunk_meta": m.get("meta"),
+            }
+        )
+    return out
+
+
+def fuse_hybrid(
+    document_id: str,
+    question: str,
+    dense: list[dict],
+    *,
+    query_embedding,
+    pre_k: int,
+    alpha: float = 0.25,
+) -> list[dict]:
+    """Sparse + dense fusion using the document's BM25 index.
+
+    Candidates are the union of the dense top `pre_k` and the BM25 top `pre_k`;
+    lexical-only hits get their exact cosine similarity so the guardrail still
+    applies. `keyword_score` is the share of the question's IDF mass found in the
+    chunk (0..1). Fusion is `similarity + alpha * keyword_score` ("weighted") or
+    reciprocal rank fusion ("rrf"), per HYBRID_FUSION.
+    """
+
+    lexical = faiss_store.get_bm25(document_id)
+    if lexical is None:
+        return rerank_hybrid(question, dense, alpha=alpha)
+
+    tokens = bm25.query_tokens(question)
+    lex_hits = lexical.search(tokens, pre_k)
+
+    by_row = {s["row"]: dict(s) for s in dense}
+    missing = [r for r, _ in lex_hits if r not in by_row]
+    for s in faiss_store.score_rows(document_id, query_embedding, missing):
+        by_row[s["row"]] = s
+
+    candidates = list(by_row.values())
+    kw_scores = lexical.match_ratio(tokens, [s["row"] for s in candidates]).tolist()
+    dense_rank = {s["row"]: i for i, s in enumerate(dense, start=1)}
+    lex_rank = {r: i for i, (r, _) in enumerate(lex_hits, start=1)}
+    lex_score = dict(lex_hits)
+    rrf_k = settings.rrf_k
+
+    for s, kw in zip(candidates, kw_scores):
+        row = s["row"]
+        s["keyword_score"] = kw
+        s["bm25_score"] = lex_score.get(row, 0.0)
+        if settings.hybrid_fusion == "rrf":
+            rr = 0.0
+            if row in dense_rank:
+                rr += 1.0 / (rrf_k + dense_rank[row])
+            if row in lex_rank:
+                rr += 1.0 / (rrf_k + lex_rank[row])
+            s["rerank_score"] = rr
+        else:
+            s["rerank_score"] = float(s.get("similarity", 0.0)) + alpha * kw
+
+    candidates.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
+    for i, s in enumerate(candidates, start=1):
+        s["rank"] = i
+    return candidates
+
+
 def rerank_hybrid(question: str, sources: list[dict], *, alpha: float = 0.25) -> list[dict]:
     tokens = _keyword_tokens(question)
 
@@ -164,22 +293,217 @@ def rerank_hybrid(question: str, sources: list[dict], *, alpha: float = 0.25) ->
     return out
 
 
-def retrieve(document_id: str, question: str, *, top_k: int | None = None):
+def retrieve(document_id: str, question: str, *, top_k: int | None = None, query_embedding=None):
     top_k = top_k or settings.top_k
     pre_k = max(top_k * 3, 12)
 
-    raw_sources, _ = retrieve_raw(document_id, question, pre_k=pre_k)
-    reranked = rerank_hybrid(question, raw_sources, alpha=0.25)
+    q_emb = query_embedding if query_embedding is not None else embed_question(document_id, question)
+    raw_sources, _ = retrieve_raw(document_id, question, pre_k=pre_k, query_embedding=q_emb)
+    reranked = fuse_hybrid(document_id, question, raw_sources, query_embedding=q_emb, pre_k=pre_k, alpha=0.25)
 
     final = reranked[:top_k]
     sims = [float(s["similarity"]) for s in final]
     return final, sims
 
 
+def retrieve_batch(document_id: str, questions: list[str], query_embeddings, *, top_k: int | None = None):
+    """`retrieve` for several questions: one multi-row FAISS search, then per-question fusion."""
+
+    top_k = top_k or settings.top_k
+    pre_k = max(top_k * 3, 12)
+
+    raw_batch = faiss_store.query_batch(document_id, query_embeddings, top_k=pre_k)
+    out = []
+    for question, q_emb, raw_sources in zip(questions, query_embeddings, raw_batch):
+        reranked = fuse_hybrid(document_id, question, raw_sources, query_embedding=q_emb, pre_k=pre_k, alpha=0.25)
+        final = reranked[:top_k]
+        out.append((final, [float(s["similarity"]) for s in final]))
+    return out
+
+
+# Bump when the answering prompt changes; cached answers are keyed by it.
+PROMPT_VERSION = "2"
+
+_SYSTEM_PROMPT = (
+    "You are an AI assistant inside a Transportation Management System. "
+    "Answer ONLY using the provided sources. "
+    "If the answer is not explicitly present, respond exactly with: Not found in document. "
+    "Keep the answer short and specific."
+)
+
+
+def _cache_key(document_id: str, question: str, llm) -> tuple:
+    model = llm.model if llm is not None else settings.openai_model
+    return answer_cache.make_key(document_id, question, model=model, prompt_version=PROMPT_VERSION)
+
+
+def _cached_answer(key: tuple, signature: tuple | None, document_id: str, question: str):
+    """(cached response | None, question embedding | None). Exact match first, then semantic."""
+
+    cached = answer_cache.get(key, signature)
+    if cached is not None:
+        return {**cached, "cached": True, "cache_match": {"type": "exact"}}, None
+
+    q_emb = embed_question(document_id, question)
+    hit = answer_cache.semantic_get(key, signature, q_emb)
+    if hit is not None:
+        response, similarity, matched = hit
+        answer_cache.put(key, signature, response)
+        return {
+            **response,
+            "cached": True,
+            "cache_match": {"type": "semantic", "similarity": similarity, "question": matched},
+        }, q_emb
+    return None, q_emb
+
+
+def _store_answer(key: tuple, signature: tuple | None, q_emb, question: str, response: dict, llm) -> None:
+    # Without an LLM the response is a placeholder; don't pin it.
+    if signature is not None and llm is not None:
+        answer_cache.put(key, signature, response)
+        answer_cache.semantic_put(key, signature, q_emb, question, response)
+
+
 def answer_question(document_id: str, question: str) -> dict:
-    sources, sims = retrieve(document_id, question)
+    """Answer from the document, serving repeat questions from the answer cache.
+
+    Exact repeats (after normalization) are looked up first, then near-duplicates
+    by question-embedding cosine. Responses carry `cached: true|false`; semantic
+    hits also carry `cache_match` with the matched question and its similarity.
+    """
+
+    llm = get_chat_client()
+    key = _cache_key(document_id, question, llm)
+    signature = faiss_store.index_signature(document_id)
+    cached, q_emb = _cached_answer(key, signature, document_id, question)
+    if cached is not None:
+        return cached
+
+    response = _answer_question(document_id, question, query_embedding=q_emb, llm=llm)
+    _store_answer(key, signature, q_emb, question, response, llm)
+    return {**response, "cached": False}
+
+
+def answer_questions(document_id: str, questions: list[str]) -> list[dict]:
+    """Answer several questions about one document; results come back in question order.
+
+    Repeated questions are answered once. Cache misses share one embedding call
+    and one multi-row index search, and their LLM calls run concurrently (up to
+    ASK_BATCH_CONCURRENCY).
+    """
+
+    llm = get_chat_client()
+    signature = faiss_store.index_signature(document_id)
+
+    # Normalized duplicates inside the batch share one answer.
+    keys = [_cache_key(document_id, q, llm) for q in questions]
+    unique: dict[tuple, str] = {}
+    for key, q in zip(keys, questions):
+        unique.setdefault(key, q)
+
+    answers: dict[tuple, dict] = {}
+    for key in list(unique):
+        cached = answer_cache.get(key, signature)
+        if cached is not None:
+            answers[key] = {**cached, "cached": True, "cache_match": {"type": "exact"}}
+
+    pending = [k for k in unique if k not in answers]
+    q_embs = embed_questions(document_id, [unique[k] for k in pending])
+    emb_by_key = dict(zip(pending, q_embs))
+
+    to_retrieve = []
+    for key in pending:
+        hit = answer_cache.semantic_get(key, signature, emb_by_key[key])
+        if hit is None:
+            to_retrieve.append(key)
+            continue
+        response, similarity, matched = hit
+        answer_cache.put(key, signature, response)
+        answers[key] = {
+            **response,
+            "cached": True,
+            "cache_match": {"type": "semantic", "similarity": similarity, "question": matched},
+        }
+
+    retrieved = retrieve_batch(document_id, [unique[k] for k in to_retrieve], [emb_by_key[k] for k in to_retrieve])
+    min_similarity = min_similarity_for(document_id)
+
+    def answer_one(key: tuple, sources: list[dict], sims: list[float]) -> dict:
+        response = _early_response(sources, sims, min_similarity, llm)
+        if response is None:
+            answer = llm.complete(_answer_messages(unique[key], sources), temperature=0.0)
+            response = _final_response(answer, sources, sims, min_similarity)
+        _store_answer(key, signature, emb_by_key[key], unique[key], response, llm)
+        return {**response, "cached": False}
+
+    workers = max(1, min(settings.ask_batch_concurrency, len(to_retrieve)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(answer_one, key, *r) for key, r in zip(to_retrieve, retrieved)}
+        for key, fut in futures.items():
+            answers[key] = fut.result()
+
+    return [answers[key] for key in keys]
+
+
+def stream_answer(document_id: str, question: str) -> Iterator[tuple[str, dict]]:
+    """Answer as a sequence of (event, data) pairs for server-sent events.
 
-    if not sources or sims[0] < settings.min_similarity:
+    `sources` (sources + confidence) as soon as retrieval is done, then `token`
+    deltas while the model generates, then `done` with the full response
+    (answer, guardrail, final confidence, cached). Cache hits and guardrail
+    answers are sent as a single token.
+    """
+
+    llm = get_chat_client()
+    key = _cache_key(document_id, question, llm)
+    signature = faiss_store.index_signature(document_id)
+    cached, q_emb = _cached_answer(key, signature, document_id, question)
+    if cached is not None:
+        yield "sources", _sources_event(cached)
+        yield "token", {"text": cached["answer"]}
+        yield "done", cached
+        return
+
+    sources, sims, min_similarity = _retrieve_for_answer(document_id, question, q_emb)
+    early = _early_response(sources, sims, min_similarity, llm)
+    if early is not None:
+        yield "sources", _sources_event(early)
+        yield "token", {"text": early["answer"]}
+        response = early
+    else:
+        conf = _confidence_from_sources(sources)
+        yield "sources", {
+            "sources": sources[:3],
+            "confidence": conf["confidence"],
+            "confidence_details": conf["details"],
+        }
+        parts: list[str] = []
+        for delta in llm.stream(_answer_messages(question, sources), temperature=0.0):
+            parts.append(delta)
+            yield "token", {"text": delta}
+        response = _final_response("".join(parts), sources, sims, min_similarity)
+
+    _store_answer(key, signature, q_emb, question, response, llm)
+    yield "done", {**response, "cached": False}
+
+
+def _sources_event(response: dict) -> dict:
+    return {
+        "sources": response["sources"],
+        "confidence": response["confidence"],
+        "confidence_details": response["confidence_details"],
+    }
+
+
+def _retrieve_for_answer(document_id: str, question: str, query_embedding=None):
+    sources, sims = retrieve(document_id, question, query_embedding=query_embedding)
+    return sources, sims, min_similarity_for(document_id)
+
+
+def _early_response(sources: list[dict], sims: list[float], min_similarity: float, llm) -> dict | None:
+    """Response that needs no LLM call (guardrail / no LLM configured), else None."""
+
+    if not sources or sims[0] < min_similarity:
         conf = _confidence_from_sources(sources)
         return {
             "answer": "Not found in document.",
@@ -189,12 +513,12 @@ def answer_question(document_id: str, question: str) -> dict:
             "guardrail": {
                 "triggered": True,
                 "reason": "low_retrieval_similarity" if sources else "no_sources",
-                "min_similarity": settings.min_similarity,
+                "min_similarity": min_similarity,
                 "top_similarity": sims[0] if sims else None,
             },
         }
 
-    if not settings.openai_api_key:
+    if llm is None:
         conf = _confidence_from_sources(sources)
         return {
             "answer": "LLM not configured (set OPENAI_API_KEY). Top matching text is returned as source.",
@@ -204,45 +528,37 @@ def answer_question(document_id: str, question: str) -> dict:
             "guardrail": {"triggered": False, "reason": None},
         }
 
-    client = OpenAI(api_key=settings.openai_api_key)
+    return None
 
-    context = "\n\n".join(
-        [
-            f"[Source {s['rank']} | page={s['page_num']} | sim={s['similarity']:.3f}]\n{s['text']}"
-            for s in sources[: min(6, len(sources))]
-        ]
-    )
 
-    system = (
-        "You are an AI assistant inside a Transportation Management System. "
-        "Answer ONLY using the provided sources. "
-        "If the answer is not explicitly present, respond exactly with: Not found in document. "
-        "Keep the answer short and specific."
-    )
+def _answer_messages(question: str, sources: list[dict]) -> list[dict]:
+    context = context_packer.pack(
+        sources,
+        max_tokens=settings.answer_context_max_tokens,
+        mmr_lambda=settings.context_mmr_lambda,
+    ).text
 
     user = f"Question: {question}\n\nSources:\n{context}"
 
-    completion = client.chat.completions.create(
-        model=settings.openai_model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        temperature=0.0,
-    )
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": user},
+    ]
+
 
-    answer = (completion.choices[0].message.content or "").strip()
+def _final_response(answer: str, sources: list[dict], sims: list[float], min_similarity: float) -> dict:
+    answer = (answer or "").strip()
     if not answer:
         answer = "Not found in document."
 
     # Guardrail #2: require answer to be grounded; if model says it isn't found, accept.
-    if answer.lower() != "not found in document." and sims[0] < settings.min_similarity:
+    if answer.lower() != "not found in document." and sims[0] < min_similarity:
         answer = "Not found in document."
 
     conf = _confidence_from_sources(sources)
 
     # Optional floor when we passed guardrails and produced an answer.
-    if answer.lower() != "not found in document." and sources and sims and sims[0] >= settings.min_similarity:
+    if answer.lower() != "not found in document." and sources and sims and sims[0] >= min_similarity:
         conf_val = max(conf["confidence"], 0.55)
         if conf_val != conf["confidence"]:
             conf["details"]["floor_applied"] = 0.55
@@ -255,3 +571,13 @@ def answer_question(document_id: str, question: str) -> dict:
         "confidence_details": conf["details"],
         "guardrail": {"triggered": False, "reason": None},
     }
+
+
+def _answer_question(document_id: str, question: str, *, query_embedding=None, llm=None) -> dict:
+    sources, sims, min_similarity = _retrieve_for_answer(document_id, question, query_embedding)
+    early = _early_response(sources, sims, min_similarity, llm)
+    if early is not None:
+        return early
+
+    answer = llm.complete(_answer_messages(question, sources), temperature=0.0)
+    return _final_response(answer, sources, sims, min_similarity)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 import pathlib
 import asyncio
-import mimetypes
-import httpx
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator
 from docx import Document as DocxDocument
 from app.core.config import settings
+from app.services import datalab_cache
+from app.services.datalab import datalab_client
 
 
 def extract_text_from_txt(path: str) -> list[tuple[int | None, str]]:
@@ -22,7 +27,41 @@ def extract_text_from_docx(path: str) -> list[tuple[int | None, str]]:
     return [(None, "\n\n".join(parts))]
 
 
-async def extract_text_from_pdf(path: str) -> list[tuple[int | None, str]]:
+def _datalab_params() -> dict:
+    # Everything sent with the conversion request that affects its output. Chunking
+    # and metadata detection need markdown, whatever DATALAB_OUTPUT_FORMAT says.
+    return {
+        "output_format": "markdown",
+        "paginate": "true" if settings.datalab_paginate else "false",
+        "mode": settings.datalab_mode,
+    }
+
+
+async def _datalab_convert(path: str, data: dict) -> list[tuple[int | None, str]]:
+    """Convert one file with Datalab (shared client, adaptive polling) and return its pages."""
+
+    payload = await datalab_client.convert(path, data)
+
+    # Extract markdown from response
+    markdown = payload.get("markdown")
+    if isinstance(markdown, str) and markdown:
+        return [(None, markdown)]
+
+    # Handle list of markdown chunks
+    if isinstance(markdown, list):
+        chunks = []
+        for chunk in markdown:
+            if isinstance(chunk, str):
+                chunks.append(chunk)
+            elif isinstance(chunk, dict) and chunk.get("content"):
+                chunks.append(chunk["content"])
+        if chunks:
+            return [(None, "\n\n".join(chunks))]
+
+    raise ValueError("Datalab conversion returned no usable markdown")
+
+
+async def extract_text_from_pdf(path: str, *, sha256: str | None = None) -> list[tuple[int | None, str]]:
     """PDF extraction via Datalab API (direct HTTP, no SDK).
 
     We intentionally prefer Datalab for PDFs because it handles OCR + layout better
@@ -31,111 +70,151 @@ async def extract_text_from_pdf(path: str) -> list[tuple[int | None, str]]:
     Notes:
     - Datalab returns markdown/html/json; for now we use markdown and treat it as a
       single text stream (page_num=None) unless we later add reliable page splitting.
+    - Conversions are cached by file content + conversion settings, so byte-identical
+      files are only sent once. Pass `sha256` when the caller already hashed the file.
     """
 
-    DATALAB_MARKER_URL = "https://www.datalab.to/api/v1/marker"
-
     if settings.datalab_api_key:
-        # Guess content type for the file
-        content_type, _ = mimetypes.guess_type(path)
-        content_type = content_type or "application/pdf"
-
-        data = {
-            "output_format": "markdown",
-            "paginate": "true" if settings.datalab_paginate else "false",
-            "mode": settings.datalab_mode,
-        }
-
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            # Submit the file
-            with open(path, "rb") as f:
-                files = {"file": (pathlib.Path(path).name, f, content_type)}
-                submit_response = await client.post(
-                    DATALAB_MARKER_URL,
-                    headers={"X-API-Key": settings.datalab_api_key},
-                    data=data,
-                    files=files,
-                )
-
-            if submit_response.status_code >= 400:
-                raise RuntimeError(f"Datalab submit failed: {submit_response.status_code} {submit_response.text}")
-
-            submit_payload = submit_response.json()
-            request_url = submit_payload.get("request_check_url")
-
-            if not request_url:
-                raise RuntimeError("Datalab response missing 'request_check_url'.")
-
-            # Poll for completion
-            start_time = asyncio.get_event_loop().time()
-            timeout_seconds = 300
-            poll_interval = 5.0
-
-            while True:
-                status_response = await client.get(
-                    request_url,
-                    headers={"X-API-Key": settings.datalab_api_key},
-                )
-
-                if status_response.status_code >= 400:
-                    raise RuntimeError(f"Datalab status check failed: {status_response.status_code}")
-
-                payload = status_response.json()
-                status_value = str(payload.get("status", "")).lower()
-
-                if payload.get("success") and status_value not in {"queued", "processing", "running"}:
-                    break
-                if status_value in {"completed", "complete", "success"} and payload.get("success") is not False:
-                    break
-                if status_value in {"failed", "error"} or payload.get("success") is False:
-                    raise RuntimeError(f"Datalab processing failed: {payload.get('error') or payload}")
-
-                if (asyncio.get_event_loop().time() - start_time) > timeout_seconds:
-                    raise TimeoutError("Datalab processing timed out.")
-
-                await asyncio.sleep(poll_interval)
-
-            # Extract markdown from response
-            markdown = payload.get("markdown")
-            if isinstance(markdown, str) and markdown:
-                return [(None, markdown)]
-
-            # Handle list of markdown chunks
-            if isinstance(markdown, list):
-                chunks = []
-                for chunk in markdown:
-                    if isinstance(chunk, str):
-                        chunks.append(chunk)
-                    elif isinstance(chunk, dict) and chunk.get("content"):
-                        chunks.append(chunk["content"])
-                if chunks:
-                    return [(None, "\n\n".join(chunks))]
-
-            raise ValueError("Datalab conversion returned no usable markdown")
+        data = _datalab_params()
+        file_hash = sha256 or await asyncio.to_thread(datalab_cache.file_sha256, path)
+        key = datalab_cache.cache_key(file_hash, data)
+
+        cached = await asyncio.to_thread(datalab_cache.get, key)
+        if cached is not None:
+            return cached
+
+        pages = await _datalab_convert(path, data)
+        await asyncio.to_thread(datalab_cache.put, key, pages, params=data)
+        return pages
 
     # Fallback to PyMuPDF if no Datalab key
+    return [page async for page in iter_pdf_pages(path)]
+
+
+# PyMuPDF fallback: page ranges are extracted in a shared process pool (MuPDF
+# holds the GIL, so threads don't help) and yielded back in page order.
+_pdf_pool: ProcessPoolExecutor | None = None
+
+
+def _pdf_workers() -> int:
+    return settings.pdf_extract_workers or min(os.cpu_count() or 1, 8)
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: forking a process that runs threads (uvicorn, ingest jobs) is unsafe.
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=_pdf_workers(), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_pool
+
+
+def shutdown_pdf_pool() -> None:
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+        _pdf_pool = None
+
+
+def _pdf_page_count(path: str) -> int:
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+def _extract_pdf_range(path: str, start: int, stop: int) -> list[tuple[int | None, str]]:
     import fitz  # PyMuPDF
 
     pages: list[tuple[int | None, str]] = []
-    pdf = fitz.open(path)
-    for i in range(pdf.page_count):
-        page = pdf.load_page(i)
-        text = page.get_text("text") or ""
-        pages.append((i + 1, text))
+    with fitz.open(path) as pdf:
+        for i in range(start, stop):
+            page = pdf.load_page(i)
+            text = page.get_text("text") or ""
+            pages.append((i + 1, text))
     return pages
 
 
-async def extract_text(path: str, mime: str) -> list[tuple[int | None, str]]:
+async def iter_pdf_pages(path: str) -> AsyncIterator[tuple[int | None, str]]:
+    """Yield (page_num, text) for every page, in order, without blocking the event loop.
+
+    Short PDFs are read in a thread; longer ones are split into ranges of
+    `PDF_PAGES_PER_SHARD` pages that run in parallel in the process pool, with
+    about one shard per worker in flight.
+    """
+
+    loop = asyncio.get_running_loop()
+    page_count = await asyncio.to_thread(_pdf_page_count, path)
+
+    per_shard = max(1, settings.pdf_pages_per_shard)
+    if page_count < settings.pdf_parallel_min_pages or _pdf_workers() <= 1:
+        for page in await asyncio.to_thread(_extract_pdf_range, path, 0, page_count):
+            yield page
+        return
+
+    # Keep about one shard per worker in flight: finished shards wait in memory
+    # until they are yielded, so submitting all of them up front would buffer the
+    # whole document whenever the consumer is slower than extraction.
+    pool = _get_pdf_pool()
+    starts = iter(range(0, page_count, per_shard))
+    futures: deque[asyncio.Future] = deque()
+
+    def submit_next() -> None:
+        start = next(starts, None)
+        if start is not None:
+            futures.append(
+                loop.run_in_executor(pool, _extract_pdf_range, path, start, min(start + per_shard, page_count))
+            )
+
+    for _ in range(_pdf_workers()):
+        submit_next()
+    try:
+        while futures:
+            pages = await futures[0]
+            futures.popleft()
+            submit_next()
+            for page in pages:
+                yield page
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+_DOCX_MIMES = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/msword",
+}
+
+
+def _kind(path: str, mime: str) -> str:
     mime = (mime or "").lower()
     if mime in {"text/plain"} or path.lower().endswith(".txt"):
-        return extract_text_from_txt(path)
-    if mime in {
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "application/msword",
-    } or path.lower().endswith(".docx"):
-        return extract_text_from_docx(path)
+        return "txt"
+    if mime in _DOCX_MIMES or path.lower().endswith(".docx"):
+        return "docx"
     if mime in {"application/pdf"} or path.lower().endswith(".pdf"):
-        return await extract_text_from_pdf(path)
-
+        return "pdf"
     # Best-effort fallback
+    return "txt"
+
+
+async def extract_text(path: str, mime: str, *, sha256: str | None = None) -> list[tuple[int | None, str]]:
+    kind = _kind(path, mime)
+    if kind == "docx":
+        return extract_text_from_docx(path)
+    if kind == "pdf":
+        return await extract_text_from_pdf(path, sha256=sha256)
     return extract_text_from_txt(path)
+
+
+async def iter_text(path: str, mime: str, *, sha256: str | None = None) -> AsyncIterator[tuple[int | None, str]]:
+    """extract_text page by page. The PyMuPDF fallback yields pages as they are
+    extracted; other formats (and Datalab markdown) arrive as one stream."""
+
+    if _kind(path, mime) == "pdf" and not settings.datalab_api_key:
+        async for page in iter_pdf_pages(path):
+            yield page
+        return
+    for page in await extract_text(path, mime, sha256=sha256):
+        yield page
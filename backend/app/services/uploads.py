@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import BinaryIO
+
+from app.core.config import settings
+
+# Upload spooling + content-hash dedup.
+#
+# Uploads are streamed once into storage/uploads/<uuid>.part while being hashed;
+# ingest then os.replace()s the file into the document dir (same filesystem, no
+# second copy). storage/hashes/<sha256> points at the document built from that
+# content, so re-uploading identical bytes reuses the existing document.
+
+_CHUNK = 1024 * 1024
+
+# sha256 -> job id of an ingest that is still running for that content.
+_inflight: dict[str, str] = {}
+
+
+def uploads_dir() -> str:
+    return os.path.join(settings.storage_dir, "uploads")
+
+
+def _hashes_dir() -> str:
+    return os.path.join(settings.storage_dir, "hashes")
+
+
+def safe_filename(filename: str | None) -> str:
+    # Client-supplied names end up in paths; keep only the final component.
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name if name not in ("", ".", "..") else "document"
+
+
+def spool(src: BinaryIO) -> tuple[str, str, int]:
+    """Stream `src` to a temp file under uploads/, hashing as it goes.
+
+    Returns (path, sha256 hex, size). Blocking; run it in a thread.
+    """
+
+    os.makedirs(uploads_dir(), exist_ok=True)
+    path = os.path.join(uploads_dir(), f"{uuid.uuid4().hex}.part")
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                buf = src.read(_CHUNK)
+                if not buf:
+                    break
+                h.update(buf)
+                f.write(buf)
+                size += len(buf)
+    except BaseException:
+        discard(path)
+        raise
+    return path, h.hexdigest(), size
+
+
+def discard(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def lookup(sha256: str) -> dict | None:
+    """Meta of the stored document with this content hash, if any (stale pointers are dropped)."""
+
+    pointer = os.path.join(_hashes_dir(), sha256)
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            document_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    meta_path = os.path.join(settings.storage_dir, "docs", document_id, "meta.json")
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        meta = None
+    if not meta or meta.get("sha256") != sha256:
+        forget(sha256, document_id)
+        return None
+    return meta
+
+
+def remember(sha256: str, document_id: str) -> None:
+    os.makedirs(_hashes_dir(), exist_ok=True)
+    pointer = os.path.join(_hashes_dir(), sha256)
+    tmp = f"{pointer}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(document_id)
+    os.replace(tmp, pointer)
+
+
+def forget(sha256: str, document_id: str | None = None) -> None:
+    """Drop the hash pointer (only if it still points at `document_id`, when given)."""
+
+    pointer = os.path.join(_hashes_dir(), sha256)
+    try:
+        if document_id is not None:
+            with open(pointer, "r", encoding="utf-8") as f:
+                if f.read().strip() != document_id:
+                    return
+        os.unlink(pointer)
+    except FileNotFoundError:
+        pass
+
+
+def inflight_job(sha256: str) -> str | None:
+    return _inflight.get(sha256)
+
+
+def track_inflight(sha256: str, job_id: str) -> None:
+    _inflight[sha256] = job_id
+
+
+def untrack_inflight(sha256: str) -> None:
+    _inflight.pop(sha256, None)
+
+
+def gc_uploads(max_age_s: float | None = None) -> int:
+    """Delete leftover upload temp files older than `max_age_s`. Returns the count removed."""
+
+    max_age_s = settings.upload_tmp_max_age_s if max_age_s is None else max_age_s
+    cutoff = time.time() - max_age_s
+    removed = 0
+    for root in (uploads_dir(), _hashes_dir()):
+        if not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            # hashes/ only holds stray pointer temp files; uploads/ holds nothing durable.
+            if root == _hashes_dir() and not entry.name.endswith(".tmp"):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
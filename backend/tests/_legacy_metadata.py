@@ -0,0 +1,97 @@
+"""detect_document_type / extract_global_identifiers as they were before the
+single-pass scanner, kept as the reference it is checked against (see test_metadata.py)."""
+
+from __future__ import annotations
+
+import re
+
+
+def detect_document_type(text: str) -> str | None:
+    t = (text or "").lower()
+    # Very lightweight heuristics (POC). We'll improve with a classifier later.
+    if "bill of lading" in t or re.search(r"\bbol\b", t):
+        return "bol"
+    if "rate confirmation" in t or "load confirmation" in t:
+        return "rate_confirmation"
+    if "commercial invoice" in t or re.search(r"\binvoice\b", t):
+        return "invoice"
+    if "packing list" in t:
+        return "packing_list"
+    if "manifest" in t:
+        return "manifest"
+    if "shipment instruction" in t or "shipping instructions" in t:
+        return "shipment_instructions"
+    return None
+
+
+def extract_global_identifiers(text: str) -> dict:
+    t = text or ""
+
+    out: dict = {}
+
+    # Reference / load / shipment id patterns
+    m = re.search(r"\bReference\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
+    if m:
+        out["reference_id"] = m.group(1)
+
+    m = re.search(r"\bLoad\s*ID\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
+    if m:
+        out["load_id"] = m.group(1)
+
+    m = re.search(r"\bShipment\s*(ID|#)\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
+    if m:
+        out["shipment_id"] = m.group(2)
+
+    m = re.search(r"\bBOL\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", t, re.IGNORECASE)
+    if m:
+        out["bol_number"] = m.group(2)
+
+    m = re.search(r"\b(Purchase\s*Order|PO)\s*(Number|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{4,})\b", t, re.IGNORECASE)
+    if m:
+        out["po_number"] = m.group(3)
+
+    m = re.search(r"\bContainer\s*(ID|No\.?|#)?\s*[:#-]?\s*([A-Z0-9-]{6,})\b", t, re.IGNORECASE)
+    if m:
+        out["container_id"] = m.group(2)
+
+    # Dispatcher details (common on rate confirmations)
+    # Do line-based matching so we don't accidentally capture "Dispatcher Email" as a name.
+    for line in t.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        m = re.match(r"^(Dispatcher|Dispatcher Name)\s*[:#-]\s*(.+)$", line, re.IGNORECASE)
+        if m and "dispatcher_name" not in out:
+            out["dispatcher_name"] = m.group(2).strip()
+            continue
+
+        m = re.match(r"^Dispatcher\s*(Phone|Tel|Telephone)\s*[:#-]\s*(.+)$", line, re.IGNORECASE)
+        if m and "dispatcher_phone" not in out:
+            out["dispatcher_phone"] = m.group(2).strip()
+            continue
+
+        m = re.match(r"^Dispatcher\s*(Email)\s*[:#-]\s*([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})$", line, re.IGNORECASE)
+        if m and "dispatcher_email" not in out:
+            out["dispatcher_email"] = m.group(2).strip()
+            continue
+
+    # Carrier MC
+    m = re.search(r"\bMC\s*#?\s*([0-9]{5,10})\b", t, re.IGNORECASE)
+    if m:
+        out["carrier_mc"] = m.group(1)
+
+    # Common date markers (keep raw; normalization can be added later)
+    m = re.search(r"\bBooking\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", t, re.IGNORECASE)
+    if m:
+        out["booking_date"] = m.group(1)
+
+    m = re.search(r"\bIssue\s*Date\s*[:#-]?\s*([0-9]{1,2}[-/][0-9]{1,2}[-/][0-9]{2,4})\b", t, re.IGNORECASE)
+    if m and "issue_date" not in out:
+        out["issue_date"] = m.group(1)
+
+    # Currency hint
+    if re.search(r"\bUSD\b|\$", t):
+        out["currency_hint"] = "USD"
+
+    return out
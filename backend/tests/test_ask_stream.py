@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import app
+from app.services import answer_cache, llm, rag
+from app.services.ingest import ingest_document
+
+TEXT = (
+    "RATE CONFIRMATION\nLoad ID: LD-12345\n\n"
+    "The carrier will pick up 12 pallets of frozen produce at the Fresno dock on March 4.\n\n"
+    "The total rate for this load is $2,450 including fuel surcharge and detention.\n\n"
+    "Delivery is scheduled at the Denver warehouse with a 2 hour appointment window."
+)
+
+
+class FakeStreamingLLM(llm.ChatClient):
+    backend = "fake"
+    model = "fake-stream"
+    deltas = ["The total ", "rate is ", "$2,450."]
+    fail_after: int | None = None
+
+    def complete(self, messages, *, temperature=0.0, json_mode=False):
+        return "".join(self.deltas)
+
+    def stream(self, messages, *, temperature=0.0):
+        for i, delta in enumerate(self.deltas):
+            if self.fail_after is not None and i == self.fail_after:
+                raise RuntimeError("provider hung up")
+            yield delta
+
+
+llm.register_chat_backend("fake")(FakeStreamingLLM)
+
+
+@pytest.fixture
+def document_id(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "storage_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "embedding_backend", "hashing")
+    monkeypatch.setattr(settings, "embedding_cache_enabled", False)
+    monkeypatch.setattr(settings, "corpus_index_enabled", False)
+    monkeypatch.setattr(settings, "chat_backend", "fake")
+    monkeypatch.setattr(FakeStreamingLLM, "fail_after", None)
+    path = tmp_path / "rate.txt"
+    path.write_text(TEXT)
+    meta = asyncio.run(ingest_document(file_path=str(path), filename="rate.txt", mime="text/plain"))
+    yield meta["document_id"]
+    answer_cache.invalidate(meta["document_id"])
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    """Parse an SSE body; every frame must be `event:` + one `data:` line + a blank line."""
+
+    assert body.endswith("\n\n")
+    out = []
+    for frame in body[:-2].split("\n\n"):
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        out.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return out
+
+
+def _ask(document_id: str, question: str) -> list[tuple[str, dict]]:
+    response = TestClient(app).post("/ask/stream", json={"document_id": document_id, "question": question})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    return _events(response.text)
+
+
+def test_sources_then_tokens_then_done(document_id):
+    events = _ask(document_id, "What is the total rate for this load?")
+
+    names = [e for e, _ in events]
+    assert names == ["sources", "token", "token", "token", "done"]
+    sources = events[0][1]
+    assert sources["sources"] and set(sources) == {"sources", "confidence", "confidence_details"}
+    assert [d["text"] for e, d in events if e == "token"] == FakeStreamingLLM.deltas
+    done = events[-1][1]
+    assert done["answer"] == "The total rate is $2,450."
+    assert done["cached"] is False and "guardrail" in done
+
+
+def test_cached_answer_is_replayed_as_one_token(document_id):
+    question = "What is the total rate for this load?"
+    first = _ask(document_id, question)
+    second = _ask(document_id, question)
+
+    assert [e for e, _ in second] == ["sources", "token", "done"]
+    assert second[1][1]["text"] == first[-1][1]["answer"]
+    assert second[-1][1]["cached"] is True
+
+
+def test_guardrail_answer_skips_the_model(document_id, monkeypatch):
+    monkeypatch.setattr(rag, "min_similarity_for", lambda document_id: 1.01)
+
+    events = _ask(document_id, "Who signed the contract?")
+
+    assert [e for e, _ in events] == ["sources", "token", "done"]
+    assert events[1][1]["text"] == "Not found in document."
+    assert events[-1][1]["guardrail"]["triggered"] is True
+
+
+def test_model_failure_ends_the_stream_with_an_error_event(document_id, monkeypatch):
+    monkeypatch.setattr(FakeStreamingLLM, "fail_after", 1)
+
+    events = _ask(document_id, "What is the total rate for this load?")
+
+    assert [e for e, _ in events] == ["sources", "token", "error"]
+    assert events[-1][1] == {"detail": "RuntimeError: provider hung up"}
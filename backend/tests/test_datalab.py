@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services import datalab
+from app.services.datalab import DatalabClient
+
+CHECK_URL = "https://datalab.test/api/v1/marker/req-{n}"
+
+
+def _mock_client(handler) -> DatalabClient:
+    client = DatalabClient()
+    client._ensure()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+class FakeDatalab:
+    """Submit/poll protocol of the marker endpoint; a request completes after `pending_polls` checks."""
+
+    def __init__(self, pending_polls: int = 0, *, fail: bool = False) -> None:
+        self.pending_polls = pending_polls
+        self.fail = fail
+        self.submit_times: list[float] = []
+        self.polls: dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            self.submit_times.append(time.monotonic())
+            url = CHECK_URL.format(n=len(self.submit_times))
+            self.polls[url] = 0
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return httpx.Response(200, json={"success": True, "request_check_url": url})
+
+        url = str(request.url)
+        self.polls[url] += 1
+        if self.polls[url] <= self.pending_polls:
+            return httpx.Response(200, json={"status": "processing"})
+        self.in_flight -= 1
+        if self.fail:
+            return httpx.Response(200, json={"status": "failed", "success": False, "error": "bad scan"})
+        return httpx.Response(200, json={"status": "complete", "success": True, "markdown": f"# {url}"})
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+
+def test_polling_backs_off_with_jitter(monkeypatch, pdf):
+    monkeypatch.setattr(settings, "datalab_submit_rate", 0)
+    monkeypatch.setattr(settings, "datalab_poll_initial_s", 0.5)
+    monkeypatch.setattr(settings, "datalab_poll_max_s", 2.0)
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(datalab.asyncio, "sleep", fake_sleep)
+    server = FakeDatalab(pending_polls=5)
+    client = _mock_client(server)
+
+    payload = asyncio.run(client.convert(pdf, {"output_format": "markdown"}))
+
+    assert payload["markdown"].startswith("# ")
+    expected = [0.5, 0.75, 1.125, 1.6875, 2.0, 2.0]
+    assert len(delays) == len(expected)
+    for got, want in zip(delays, expected):
+        assert 0.8 * want <= got <= 1.2 * want
+    stats = client.stats()
+    assert stats["submitted"] == 1 and stats["failed"] == 0 and stats["in_flight"] == 0
+    assert stats["polls_per_conversion"]["max"] == 6
+
+
+def test_submissions_are_rate_limited_and_capped(monkeypatch, pdf):
+    monkeypatch.setattr(settings, "datalab_submit_rate", 20.0)
+    monkeypatch.setattr(settings, "datalab_max_concurrent", 2)
+    monkeypatch.setattr(settings, "datalab_poll_initial_s", 0.01)
+    server = FakeDatalab(pending_polls=2)
+    client = _mock_client(server)
+    seen_in_flight = []
+
+    async def main():
+        async def watch():
+            while True:
+                seen_in_flight.append(client.stats()["in_flight"])
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch())
+        results = await asyncio.gather(*(client.convert(pdf, {}) for _ in range(6)))
+        watcher.cancel()
+        return results
+
+    results = asyncio.run(main())
+
+    assert len(results) == 6 and client.submitted == 6
+    assert server.max_in_flight <= 2
+    assert max(seen_in_flight) == 2 and client.stats()["in_flight"] == 0
+    gaps = [b - a for a, b in zip(server.submit_times, server.submit_times[1:])]
+    assert min(gaps) >= 0.05 * 0.9
+
+
+def test_failed_conversion_raises_and_is_counted(monkeypatch, pdf):
+    monkeypatch.setattr(settings, "datalab_submit_rate", 0)
+    monkeypatch.setattr(settings, "datalab_poll_initial_s", 0.01)
+    client = _mock_client(FakeDatalab(fail=True))
+
+    with pytest.raises(RuntimeError, match="bad scan"):
+        asyncio.run(client.convert(pdf, {}))
+    assert client.stats()["failed"] == 1 and client.stats()["in_flight"] == 0
+
+
+def test_submit_error_is_raised(monkeypatch, pdf):
+    monkeypatch.setattr(settings, "datalab_submit_rate", 0)
+    client = _mock_client(lambda request: httpx.Response(401, text="bad key"))
+
+    with pytest.raises(RuntimeError, match="401 bad key"):
+        asyncio.run(client.convert(pdf, {}))
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services import datalab_cache, text_extract
+from app.services.datalab import DatalabClient
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "datalab_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings, "datalab_cache_enabled", True)
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Fake marker endpoint wired into text_extract; records the form data of each submit."""
+
+    submits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            submits.append(request.content)
+            return httpx.Response(200, json={"request_check_url": "https://datalab.test/check/1"})
+        return httpx.Response(200, json={"status": "complete", "success": True, "markdown": "# Invoice\n\nTotal: $5"})
+
+    client = DatalabClient()
+    client._ensure()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(text_extract, "datalab_client", client)
+    monkeypatch.setattr(settings, "datalab_api_key", "test")
+    monkeypatch.setattr(settings, "datalab_submit_rate", 0)
+    monkeypatch.setattr(settings, "datalab_poll_initial_s", 0.01)
+    return submits
+
+
+def _pdf(tmp_path, name: str, content: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_identical_files_are_converted_once(cache, server, tmp_path):
+    a = _pdf(tmp_path, "a.pdf", b"%PDF same bytes")
+    b = _pdf(tmp_path, "b.pdf", b"%PDF same bytes")
+
+    first = asyncio.run(text_extract.extract_text_from_pdf(a))
+    second = asyncio.run(text_extract.extract_text_from_pdf(b))
+
+    assert first == second == [(None, "# Invoice\n\nTotal: $5")]
+    assert len(server) == 1
+    # Ingestion always asks for markdown, whatever DATALAB_OUTPUT_FORMAT says.
+    assert b'name="output_format"\r\n\r\nmarkdown' in server[0]
+
+
+def test_conversion_settings_are_part_of_the_key(cache, server, tmp_path, monkeypatch):
+    path = _pdf(tmp_path, "a.pdf", b"%PDF content")
+    asyncio.run(text_extract.extract_text_from_pdf(path))
+    monkeypatch.setattr(settings, "datalab_mode", "accurate")
+    asyncio.run(text_extract.extract_text_from_pdf(path))
+    asyncio.run(text_extract.extract_text_from_pdf(path, sha256=datalab_cache.file_sha256(path)))
+    assert len(server) == 2
+
+
+def test_least_recently_used_entries_are_evicted(cache, monkeypatch):
+    pages = [(None, "x" * 1000)]
+    datalab_cache.put("old", pages, params={})
+    datalab_cache.put("new", pages, params={})
+    now = time.time()
+    os.utime(cache / "old.json", (now - 60, now - 60))
+    os.utime(cache / "new.json", (now - 30, now - 30))
+    assert datalab_cache.get("old") == pages  # a hit makes "old" the most recent entry
+
+    size = os.path.getsize(cache / "old.json")
+    monkeypatch.setattr(settings, "datalab_cache_max_bytes", 2 * size + size // 2)
+    datalab_cache.put("newest", pages, params={})
+
+    assert sorted(p.name for p in cache.iterdir()) == ["newest.json", "old.json"]
+    assert datalab_cache.get("new") is None
@@ -0,0 +1,146 @@
+import base64
+import json
+import threading
+
+import httpx
+import numpy as np
+import pytest
+from openai import OpenAI
+
+from app.core.config import settings
+from app.services import embedding_batch
+from app.services.embedding_batch import embed_batched, estimate_tokens, pack_batches
+from app.services.embeddings import OpenAIEmbeddingClient
+
+
+class Transient(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def no_backoff_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(embedding_batch.time, "sleep", delays.append)
+    return delays
+
+
+def _fake_vectors(texts: list[str]) -> np.ndarray:
+    # Row i encodes the text's own number, so misplaced batches are detectable.
+    return np.array([[float(t.split()[-1]), 1.0] for t in texts], dtype=np.float32)
+
+
+def test_pack_batches_respects_token_and_input_budgets():
+    texts = ["x" * 30] * 10  # 10 tokens each
+    batches = pack_batches(texts, max_tokens=35, max_inputs=100)
+    assert batches == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert pack_batches(texts, max_tokens=10_000, max_inputs=4) == [(0, 4), (4, 8), (8, 10)]
+    # An oversized input still gets a batch of its own.
+    assert pack_batches(["x" * 300, "y"], max_tokens=10, max_inputs=100) == [(0, 1), (1, 2)]
+    assert estimate_tokens("") == 1
+
+
+def test_embed_batched_keeps_input_order_under_concurrency():
+    texts = [f"chunk {i}" for i in range(50)]
+    calls = []
+    lock = threading.Lock()
+
+    def embed(batch: list[str]) -> np.ndarray:
+        with lock:
+            calls.append(len(batch))
+        return _fake_vectors(batch)
+
+    out = embed_batched(texts, embed, max_tokens=10_000, max_inputs=7, concurrency=4)
+    assert out.dtype == np.float32 and out.flags.c_contiguous
+    assert out[:, 0].tolist() == list(range(50))
+    assert sorted(calls) == sorted([7] * 7 + [1])
+
+
+def test_embed_batched_retries_retryable_errors(no_backoff_sleep):
+    failures = {"chunk 0": 2}
+
+    def embed(batch: list[str]) -> np.ndarray:
+        if failures.get(batch[0], 0):
+            failures[batch[0]] -= 1
+            raise Transient()
+        return _fake_vectors(batch)
+
+    out = embed_batched(
+        [f"chunk {i}" for i in range(4)],
+        embed,
+        max_tokens=10_000,
+        max_inputs=2,
+        concurrency=1,
+        max_retries=3,
+        is_retryable=lambda e: isinstance(e, Transient),
+    )
+    assert out[:, 0].tolist() == [0, 1, 2, 3]
+    assert len(no_backoff_sleep) == 2
+    # Full jitter: each delay is drawn from [0, base * 2**attempt].
+    assert no_backoff_sleep[0] <= 0.5 and no_backoff_sleep[1] <= 1.0
+
+
+def test_embed_batched_gives_up_after_max_retries_or_on_other_errors():
+    def always_transient(batch):
+        raise Transient()
+
+    def transient(e: Exception) -> bool:
+        return isinstance(e, Transient)
+
+    with pytest.raises(Transient):
+        embed_batched(
+            ["chunk 0"],
+            always_transient,
+            max_tokens=100,
+            max_inputs=1,
+            concurrency=1,
+            max_retries=2,
+            is_retryable=transient,
+        )
+
+    calls = []
+
+    def broken(batch):
+        calls.append(batch)
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        embed_batched(
+            ["chunk 0"], broken, max_tokens=100, max_inputs=1, concurrency=1, max_retries=5, is_retryable=transient
+        )
+    assert len(calls) == 1
+
+
+def test_embed_batched_rejects_short_responses():
+    with pytest.raises(ValueError, match="returned 1 vectors for 2 inputs"):
+        embed_batched(
+            ["chunk 0", "chunk 1"], lambda b: _fake_vectors(b[:1]), max_tokens=100, max_inputs=2, concurrency=1
+        )
+
+
+def test_openai_client_batches_and_retries_rate_limits(monkeypatch, no_backoff_sleep):
+    monkeypatch.setattr(settings, "openai_api_key", "test")
+    monkeypatch.setattr(settings, "embedding_batch_max_inputs", 3)
+    monkeypatch.setattr(settings, "embedding_concurrency", 1)
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        if len(requests) == 1:
+            return httpx.Response(429, json={"error": {"message": "slow down"}})
+        assert body["encoding_format"] == "base64"
+        data = [
+            {"object": "embedding", "index": i, "embedding": base64.b64encode(_fake_vectors([t]).tobytes()).decode()}
+            for i, t in enumerate(body["input"])
+        ]
+        usage = {"prompt_tokens": 1, "total_tokens": 1}
+        return httpx.Response(200, json={"object": "list", "data": data, "model": body["model"], "usage": usage})
+
+    client = OpenAIEmbeddingClient()
+    http_client = httpx.Client(transport=httpx.MockTransport(handler))
+    client._client = OpenAI(api_key="test", max_retries=0, http_client=http_client)
+
+    out = client.embed([f"chunk {i}" for i in range(7)])
+    assert out[:, 0].tolist() == list(range(7))
+    assert [len(r["input"]) for r in requests] == [3, 3, 3, 1]
+    assert len(no_backoff_sleep) == 1
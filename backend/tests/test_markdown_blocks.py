@@ -0,0 +1,93 @@
+"""Golden-file and equivalence tests for the markdown block parser.
+
+Golden files under golden/markdown/ pair an input `<name>.md` with the blocks the
+parser produced before the single-pass rewrite (`<name>.json`). Regenerate them
+from the reference parser with:
+
+    UPDATE_GOLDEN=1 python -m pytest -q tests/test_markdown_blocks.py
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+from dataclasses import asdict
+from pathlib import Path
+
+import pytest
+
+import _legacy_markdown_blocks as legacy
+from app.services.parsing.markdown_blocks import iter_markdown_blocks, parse_markdown_blocks
+
+GOLDEN_DIR = Path(__file__).parent / "golden" / "markdown"
+CASES = sorted(p.stem for p in GOLDEN_DIR.glob("*.md"))
+
+
+def _dump(blocks) -> list[dict]:
+    return [asdict(b) for b in blocks]
+
+
+def _read(path: Path) -> str:
+    # Keep \r\n / \r as written; the parser normalizes line endings itself.
+    return path.read_bytes().decode("utf-8")
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_golden(name: str):
+    md = _read(GOLDEN_DIR / f"{name}.md")
+    golden_path = GOLDEN_DIR / f"{name}.json"
+    if os.environ.get("UPDATE_GOLDEN"):
+        golden_path.write_text(json.dumps(_dump(legacy.parse_markdown_blocks(md)), indent=2) + "\n", encoding="utf-8")
+
+    expected = json.loads(golden_path.read_text(encoding="utf-8"))
+    assert _dump(parse_markdown_blocks(md)) == expected
+    assert _dump(iter_markdown_blocks(md)) == expected
+
+
+# Line fragments that exercise every classifier branch and their boundaries.
+_FRAGMENTS = [
+    "",
+    "   ",
+    "\t",
+    "# Heading",
+    "###### h6",
+    "####### h7",
+    "#nospace",
+    "## ",
+    "| a | b |",
+    "a | b | c",
+    "| one |",
+    "|---|---|",
+    "| --- | :---: |",
+    ":--- | ---:",
+    "------",
+    "-----",
+    "- - - -",
+    "|||",
+    "Key: value",
+    "Key - value",
+    "K: v",
+    "x: y",
+    "Long key with spaces and (parens): v",
+    "A very very very long key exceeding forty chars: v",
+    "1. numbered: item",
+    "- bullet",
+    "plain text line",
+    "text with | one pipe",
+    "  indented Key: value  ",
+    "Total: $1,200 | USD | paid",
+    "é accented: value",
+]
+
+
+def _random_doc(rng: random.Random) -> str:
+    lines = [rng.choice(_FRAGMENTS) for _ in range(rng.randint(0, 25))]
+    return rng.choice(["\n", "\r\n", "\r"]).join(lines)
+
+
+def test_matches_reference_parser_on_random_documents():
+    rng = random.Random(22)
+    for _ in range(5000):
+        md = _random_doc(rng)
+        assert _dump(parse_markdown_blocks(md)) == _dump(legacy.parse_markdown_blocks(md)), md
@@ -0,0 +1,84 @@
+import random
+
+import _legacy_metadata as legacy
+from app.services.metadata import MetadataScanner, detect_document_type, extract_global_identifiers
+
+
+def _scan(pages: list[str]) -> tuple[str | None, dict]:
+    scanner = MetadataScanner()
+    for page in pages:
+        scanner.feed(page)
+    return scanner.result()
+
+
+def _joined(pages: list[str]) -> tuple[str | None, dict]:
+    text = "\n\n".join(pages)
+    return detect_document_type(text), extract_global_identifiers(text)
+
+
+def test_identifier_split_after_long_last_line():
+    pages = ["x" * 600 + " Load ID:", "LD12345 rest"]
+    assert _scan(pages) == _joined(pages) == (None, {"load_id": "LD12345"})
+
+
+def test_scanner_matches_joined_text():
+    pages = [
+        "RATE CONFIRMATION\nDispatcher: Jo\nMC # 123456",
+        "Dispatcher Phone: 555-1111\r\nReference ID:",
+        "RF-9999 Booking Date: 1/2/2024 $",
+    ]
+    assert _scan(pages) == _joined(pages)
+
+
+# Fragments around every keyword, case variant and line-break kind the patterns care about.
+_FRAGMENTS = [
+    "Load ID:", "LD-12345", "load id ld-77", "Reference ID: RF-9999", "reference idx",
+    "Dispatcher: Bob", "  Dispatcher Name - Al ", "Dispatcher Phone: 555", "Dispatcher Tel:",
+    "Dispatcher Email: a@b.co", "dispatcher email: X@Y.ORG", "XDispatcher: no", " x Dispatcher: no",
+    "MC # 123456", "mc#99999999999", "Booking Date: 1/2/2024", "Issue Date", "3/4/25",
+    "$", "USD", "usd", "(USD)", "invoice", "Commercial Invoice", "invoices", "bill of lading",
+    "BOL", "bol#", "BOL No. 1234567", "Container No", "ABCDEF12", "PO", "po number 4455", "pounds",
+    "Shipment #", "shipment id: S-1234", "packing list", "manifest", "manifesto",
+    "Purchase Order 998877", "rate confirmation", "load confirmation", "shipping instructions",
+    "shipment instruction", "\u0130ssue Date: 1/2/22", "\u017fhipment #AB12", "\u212aill",
+    "lorem ipsum dolor sit amet " * 8, "y" * 700, "", ":", "-", "#",
+]
+_SEPARATORS = ["\n", " ", "", "\r", "\t", "\r\n", "\x0c", "\u2028", "  "]
+
+
+def _random_pages(rng: random.Random) -> list[str]:
+    return [
+        "".join(rng.choice(_FRAGMENTS) + rng.choice(_SEPARATORS) for _ in range(rng.randint(0, 10)))
+        for _ in range(rng.randint(1, 6))
+    ]
+
+
+def test_matches_reference_functions():
+    rng = random.Random(25)
+    for _ in range(3000):
+        pages = _random_pages(rng)
+        for text in pages + ["\n\n".join(pages)]:
+            assert detect_document_type(text) == legacy.detect_document_type(text), text
+            assert extract_global_identifiers(text) == legacy.extract_global_identifiers(text), text
+
+
+def test_scanner_matches_reference_on_joined_pages():
+    rng = random.Random(250)
+    for _ in range(3000):
+        pages = _random_pages(rng)
+        joined = "\n\n".join(pages)
+        expected = (legacy.detect_document_type(joined), legacy.extract_global_identifiers(joined))
+        assert _scan(pages) == expected, pages
+
+
+def test_scanner_stops_once_everything_is_found():
+    scanner = MetadataScanner()
+    scanner.feed(
+        "BILL OF LADING\nReference ID: R-1234\nLoad ID: L-1234\nShipment ID: S-1234\nBOL No. B-123456\n"
+        "PO # 4455\nContainer # CONT123456\nDispatcher: Jo\nDispatcher Phone: 5\n"
+        "Dispatcher Email: a@b.co\nMC # 123456\nBooking Date: 1/2/24\nIssue Date: 1/3/24\n$5\n"
+    )
+    assert scanner.done
+    before = scanner.result()
+    scanner.feed("Load ID: OTHER-999 invoice")
+    assert scanner.result() == before
@@ -0,0 +1,93 @@
+"""Throughput benchmark for the markdown block parser on synthetic Datalab-like output.
+
+Builds `--pages` pages of headings, key-value runs, tables and paragraphs, then
+times `parse_markdown_blocks` (best of `--repeat`). With `--compare` the
+pre-rewrite reference parser kept in backend/tests is timed on the same input and
+its blocks are checked for equality.
+
+    cd backend && PYTHONPATH=.. python -m evals.bench_markdown_blocks --pages 1000 --compare
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import random
+import time
+from pathlib import Path
+
+from app.services.parsing.markdown_blocks import parse_markdown_blocks
+
+_REFERENCE = Path(__file__).resolve().parent.parent / "backend" / "tests" / "_legacy_markdown_blocks.py"
+
+_WORDS = "freight carrier shipper consignee pallet weight rate total due dock trailer seal".split()
+
+
+def _sentence(rng: random.Random, n: int = 12) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+
+def synthetic_markdown(pages: int, *, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    out = []
+    for p in range(pages):
+        out.append(f"# Page {p + 1}\n")
+        out.append("\n".join(f"{w.title()} ID: {rng.randint(10000, 99999)}" for w in rng.sample(_WORDS, 4)))
+        out.append("")
+        rows = ["| Item | Qty | Amount |", "| --- | ---: | ---: |"]
+        rows += [f"| {_sentence(rng, 3)} | {rng.randint(1, 40)} | ${rng.randint(10, 999)}.00 |" for _ in range(8)]
+        out.append("\n".join(rows))
+        out.append("")
+        for _ in range(4):
+            out.append("\n".join(_sentence(rng) for _ in range(4)))
+            out.append("")
+    return "\n".join(out)
+
+
+def _load_reference():
+    spec = importlib.util.spec_from_file_location("_legacy_markdown_blocks", _REFERENCE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.parse_markdown_blocks
+
+
+def _best_of(fn, md: str, repeat: int) -> tuple[float, list]:
+    best, blocks = float("inf"), []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        blocks = fn(md)
+        best = min(best, time.perf_counter() - t)
+    return best, blocks
+
+
+def run(pages: int, *, repeat: int = 3, compare: bool = False) -> dict:
+    md = synthetic_markdown(pages)
+    mb = len(md.encode("utf-8")) / 1e6
+    secs, blocks = _best_of(parse_markdown_blocks, md, repeat)
+    report = {
+        "pages": pages,
+        "size_mb": round(mb, 2),
+        "blocks": len(blocks),
+        "seconds": round(secs, 3),
+        "mb_per_s": round(mb / secs, 1),
+    }
+    if compare:
+        ref_secs, ref_blocks = _best_of(_load_reference(), md, repeat)
+        report["reference_seconds"] = round(ref_secs, 3)
+        report["speedup"] = round(ref_secs / secs, 2)
+        report["identical"] = blocks == ref_blocks
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the markdown block parser")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", action="store_true", help="also time the pre-rewrite reference parser")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.pages, repeat=args.repeat, compare=args.compare), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Throughput benchmark for document type / identifier detection.
+
+Builds `--pages` pages of filler text with a rate-confirmation header on page 1 and
+times three cases: the page-by-page `MetadataScanner` when some identifiers are
+never found (every page is scanned), the same when everything is on page 1 (the
+scanner stops early), and the two functions on the joined text. With `--compare`
+the pre-rewrite functions kept in backend/tests are timed on the joined text and
+their results are checked for equality.
+
+    cd backend && PYTHONPATH=.. python -m evals.bench_metadata --pages 3000 --compare
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import random
+import time
+from pathlib import Path
+
+from app.services.metadata import MetadataScanner, detect_document_type, extract_global_identifiers
+
+_REFERENCE = Path(__file__).resolve().parent.parent / "backend" / "tests" / "_legacy_metadata.py"
+
+_WORDS = (
+    "the shipment will be delivered to the consignee at dock freight pallets weight total "
+    "amount terms and conditions apply carrier shall"
+).split()
+
+_PARTIAL_HEADER = "RATE CONFIRMATION\nLoad ID: LD-55555\nDispatcher: Jo\nDispatcher Phone: 555-1111\nMC # 123456\n$1,200\n"
+_FULL_HEADER = (
+    "BILL OF LADING\nReference ID: R-1234\nLoad ID: L-1234\nShipment ID: S-1234\nBOL No. B-123456\n"
+    "PO # 4455\nContainer # CONT123456\nDispatcher: Jo\nDispatcher Phone: 5\nDispatcher Email: a@b.co\n"
+    "MC # 123456\nBooking Date: 1/2/24\nIssue Date: 1/3/24\n$5\n"
+)
+
+
+def synthetic_pages(pages: int, header: str, *, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    out = ["\n".join(" ".join(rng.choice(_WORDS) for _ in range(14)) for _ in range(45)) for _ in range(pages)]
+    out[0] = header + out[0]
+    return out
+
+
+def _scan(pages: list[str]) -> tuple[str | None, dict]:
+    scanner = MetadataScanner()
+    for page in pages:
+        scanner.feed(page)
+    return scanner.result()
+
+
+def _timed(fn, *args) -> tuple[float, object]:
+    t = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - t, result
+
+
+def run(pages: int, *, compare: bool = False) -> dict:
+    partial = synthetic_pages(pages, _PARTIAL_HEADER)
+    full = synthetic_pages(pages, _FULL_HEADER)
+    joined = "\n\n".join(partial)
+    mb = len(joined) / 1e6
+
+    def both(text: str):
+        return detect_document_type(text), extract_global_identifiers(text)
+
+    scan_s, _ = _timed(_scan, partial)
+    early_s, _ = _timed(_scan, full)
+    joined_s, result = _timed(both, joined)
+    report = {
+        "pages": pages,
+        "size_mb": round(mb, 2),
+        "scanner_seconds": round(scan_s, 3),
+        "scanner_mb_per_s": round(mb / scan_s, 1),
+        "scanner_early_stop_seconds": round(early_s, 4),
+        "joined_seconds": round(joined_s, 3),
+    }
+    if compare:
+        spec = importlib.util.spec_from_file_location("_legacy_metadata", _REFERENCE)
+        legacy = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(legacy)
+        ref_s, ref = _timed(lambda t: (legacy.detect_document_type(t), legacy.extract_global_identifiers(t)), joined)
+        report["reference_joined_seconds"] = round(ref_s, 3)
+        report["speedup"] = round(ref_s / joined_s, 1)
+        report["identical"] = result == ref
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark document type / identifier detection")
+    parser.add_argument("--pages", type=int, default=3000)
+    parser.add_argument("--compare", action="store_true", help="also time the pre-rewrite reference functions")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.pages, compare=args.compare), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Throughput benchmark for the PyMuPDF fallback (no DATALAB_API_KEY).
+
+Writes a `--pages` page synthetic PDF to a temp dir, then times `iter_pdf_pages`
+(sharded across the process pool, `--workers` processes) against reading every
+page in one thread as extraction did before sharding, and checks both return the
+same pages. The pool's spawn start-up is included, as it is on a cold server.
+
+    cd backend && PYTHONPATH=.. python -m evals.bench_pdf_extract --pages 500 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from app.core.config import settings
+from app.services import text_extract
+
+_WORDS = (
+    "freight invoice carrier shipper consignee pallet weight rate total due delivery pickup "
+    "appointment reference container"
+).split()
+
+
+def synthetic_pdf(path: str, pages: int, *, seed: int = 0) -> None:
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    with fitz.open() as pdf:
+        for _ in range(pages):
+            page = pdf.new_page()
+            text = "\n".join(" ".join(rng.choice(_WORDS) for _ in range(10)) for _ in range(45))
+            page.insert_text((40, 40), text, fontsize=8)
+        pdf.save(path)
+
+
+async def _collect(path: str) -> list[tuple[int | None, str]]:
+    return [page async for page in text_extract.iter_pdf_pages(path)]
+
+
+def run(pages: int, *, workers: int = 4) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        synthetic_pdf(path, pages)
+
+        t = time.perf_counter()
+        sequential = text_extract._extract_pdf_range(path, 0, pages)
+        sequential_s = time.perf_counter() - t
+
+        settings.pdf_extract_workers = workers
+        text_extract.shutdown_pdf_pool()
+        try:
+            t = time.perf_counter()
+            sharded = asyncio.run(_collect(path))
+            sharded_s = time.perf_counter() - t
+        finally:
+            text_extract.shutdown_pdf_pool()
+
+    return {
+        "pages": pages,
+        "workers": workers,
+        "cpus": os.cpu_count(),
+        "pages_per_shard": settings.pdf_pages_per_shard,
+        "sequential_seconds": round(sequential_s, 3),
+        "sharded_seconds": round(sharded_s, 3),
+        "speedup": round(sequential_s / sharded_s, 2),
+        "identical": sharded == sequential,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark PyMuPDF page extraction")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=min(os.cpu_count() or 1, 8))
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.pages, workers=args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Threshold sweep for the semantic (near-duplicate question) answer cache.
+
+Replays a question list against one document: every question is answered fresh
+once, then each threshold is simulated offline. A question reuses the answer of
+the most similar earlier fresh-answered question when their cosine reaches the
+threshold. Reused answers are scored with `evaluate_turn` against the question's
+own fresh sources, so the sweep shows how often answers are reused and what
+that costs in turn score and answer agreement.
+
+    cd backend && PYTHONPATH=.. python -m evals.semantic_cache_eval <document_id> questions.json
+    # questions.json: ["What is the rate?", "what's the agreed amount", ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+
+import numpy as np
+
+from evals.turn_eval import evaluate_turn
+
+DEFAULT_THRESHOLDS = (0.80, 0.85, 0.90, 0.92, 0.94, 0.96, 0.98)
+
+
+def _normalize_answer(answer: str) -> str:
+    return " ".join((answer or "").lower().split()).rstrip(".")
+
+
+def _eval(question: str, response: dict, sources: list[dict]) -> dict:
+    return evaluate_turn(
+        question=question,
+        answer=response.get("answer", ""),
+        sources=sources,
+        confidence=float(response.get("confidence", 0.0)),
+        guardrail=response.get("guardrail"),
+    )
+
+
+def sweep_thresholds(turns: list[dict], thresholds=DEFAULT_THRESHOLDS) -> dict:
+    """Simulate the semantic cache over `turns` for each threshold.
+
+    Each turn: {"question", "embedding", "response"} where response is the fresh
+    /ask payload (answer, sources, confidence, guardrail).
+    """
+
+    if not turns:
+        return {"turn_count": 0, "fresh": {}, "thresholds": []}
+
+    emb = np.asarray([t["embedding"] for t in turns], dtype=np.float32)
+    emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    sims = emb @ emb.T
+
+    fresh_evals = [_eval(t["question"], t["response"], t["response"].get("sources", [])) for t in turns]
+    fresh_score = sum(e["overall_score"] for e in fresh_evals) / len(turns)
+    fresh_pass = sum(1 for e in fresh_evals if e["verdict"] == "pass") / len(turns)
+
+    rows = []
+    for threshold in thresholds:
+        cached: list[int] = []  # turns answered fresh, i.e. stored in the cache
+        scores, passes, reused, agree, reused_sims = [], 0, 0, 0, []
+        for i, turn in enumerate(turns):
+            match = max(cached, key=lambda j: sims[i, j], default=None)
+            if match is not None and sims[i, match] >= threshold:
+                response = turns[match]["response"]
+                reused += 1
+                reused_sims.append(float(sims[i, match]))
+                agree += _normalize_answer(response.get("answer", "")) == _normalize_answer(turn["response"].get("answer", ""))
+                e = _eval(turn["question"], response, turn["response"].get("sources", []))
+            else:
+                cached.append(i)
+                e = fresh_evals[i]
+            scores.append(e["overall_score"])
+            passes += e["verdict"] == "pass"
+
+        rows.append(
+            {
+                "threshold": threshold,
+                "reuse_rate": round(reused / len(turns), 4),
+                "reused": reused,
+                "answer_agreement": round(agree / reused, 4) if reused else None,
+                "avg_overall_score": round(sum(scores) / len(turns), 4),
+                "score_delta": round(sum(scores) / len(turns) - fresh_score, 4),
+                "pass_rate": round(passes / len(turns), 4),
+                "min_reused_similarity": round(min(reused_sims), 4) if reused_sims else None,
+            }
+        )
+
+    return {
+        "turn_count": len(turns),
+        "fresh": {"avg_overall_score": round(fresh_score, 4), "pass_rate": round(fresh_pass, 4)},
+        "thresholds": rows,
+    }
+
+
+def collect_turns(document_id: str, questions: list[str]) -> list[dict]:
+    """Answer every question fresh (no answer cache) through the backend RAG pipeline."""
+
+    from app.services.llm import get_chat_client
+    from app.services.rag import _answer_question, embed_question
+
+    llm = get_chat_client()
+    turns = []
+    for q in questions:
+        q_emb = embed_question(document_id, q)
+        response = _answer_question(document_id, q, query_embedding=q_emb, llm=llm)
+        turns.append({"question": q, "embedding": q_emb, "response": response})
+    return turns
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Sweep the semantic answer-cache threshold")
+    parser.add_argument("document_id")
+    parser.add_argument("questions", help="JSON file with a list of questions (paraphrases included)")
+    parser.add_argument("--thresholds", default=",".join(str(t) for t in DEFAULT_THRESHOLDS))
+    args = parser.parse_args(argv)
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    thresholds = [float(t) for t in args.thresholds.split(",") if t.strip()]
+
+    report = sweep_thresholds(collect_turns(args.document_id, questions), thresholds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
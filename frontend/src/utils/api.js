@@ -29,7 +29,13 @@ export const api = {
     return response.json();
   },
 
-  async uploadDocument(file) {
+  async getJob(jobId) {
+    const response = await fetch(`${API_BASE}/jobs/${jobId}`);
+    if (!response.ok) throw new Error("Failed to get job status");
+    return response.json();
+  },
+
+  async uploadDocument(file, { pollIntervalMs = 1000, onProgress } = {}) {
     const formData = new FormData();
     formData.append("file", file);
 
@@ -42,7 +48,19 @@ export const api = {
       throw new Error("Upload failed");
     }
 
-    return response.json();
+    // Ingestion runs as a background job; poll until it finishes.
+    let job = await response.json();
+    while (job.status === "queued" || job.status === "running") {
+      onProgress?.(job);
+      await new Promise((resolve) => setTimeout(resolve, pollIntervalMs));
+      job = await api.getJob(job.job_id);
+    }
+
+    if (job.status !== "succeeded") {
+      throw new Error(job.error || `Upload ${job.status}`);
+    }
+
+    return job.result;
   },
 
   async askQuestion(documentId, question) {
@@ -64,6 +82,57 @@ export const api = {
     return response.json();
   },
 
+  // Streams /ask/stream (server-sent events). Resolves with the final response.
+  async askQuestionStream(documentId, question, { onSources, onToken } = {}) {
+    const response = await fetch(`${API_BASE}/ask/stream`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        document_id: documentId,
+        question: question,
+      }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error("Failed to get answer");
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let result = null;
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const block = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+
+        let event = "message";
+        let data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event: ")) event = line.slice(7);
+          else if (line.startsWith("data: ")) data += line.slice(6);
+        }
+        const payload = data ? JSON.parse(data) : {};
+
+        if (event === "sources") onSources?.(payload);
+        else if (event === "token") onToken?.(payload.text);
+        else if (event === "done") result = payload;
+        else if (event === "error") throw new Error(payload.detail || "Failed to get answer");
+      }
+    }
+
+    if (!result) throw new Error("Answer stream ended early");
+    return result;
+  },
+
   async extractData(documentId, { force = false } = {}) {
     const response = await fetch(`${API_BASE}/extract`, {
       method: "POST",